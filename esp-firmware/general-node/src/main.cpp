@@ -6,6 +6,8 @@
 #define LED_ANIMATE_DELAY 300
 #define LED_PIN 10
 #define BAUD_RATE 115200
+// commands the host may have in flight must fit; matches SERIAL_RX_BUFFER_BYTES in python-interface/src/lib/Config.py
+#define SERIAL_RX_BUFFER_SIZE 1024
 #define NV_STORE_ON_SET true
 #define DELAYED_BOOT_START 5000
 
@@ -70,7 +72,11 @@ Task task_path_lighting(TASK_IMMEDIATE, TASK_ONCE, &pathLighting);
 
 void setup()
 {
+    Serial.setRxBufferSize(SERIAL_RX_BUFFER_SIZE);
     Serial.begin(BAUD_RATE);
+    // the boot output goes between two frame delimiters: the first closes a frame the host may have been reading when
+    // the board restarted, and the host reads the whole as a line of text (see serial_codec.hpp)
+    Serial.write(SERIAL_FRAME_DELIMITER);
 
     ulong start_time = millis();
 
@@ -79,7 +85,9 @@ void setup()
         Serial.printf(". ");
         delay(1000);
     }
-    Serial.print("Starting Node...\n");
+    Serial.print("Starting Node...");
+    Serial.write(SERIAL_FRAME_DELIMITER);
+    Serial.print("\n");
 
     if (!prefs.begin("node_config", false))
     {
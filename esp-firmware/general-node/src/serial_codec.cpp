@@ -0,0 +1,121 @@
+#include "serial_codec.hpp"
+
+const SerialKeyTag SERIAL_KEY_TAGS[] = {
+    {"payload_type", "t"},
+    {"payload", "p"},
+    {"cmd", "c"},
+    {"req_id", "i"},
+    {"response", "r"},
+    {"to_node_id", "T"},
+    {"from_node_id", "F"},
+    {"HEX", "h"},
+    {"msg", "m"},
+    {"nodeId", "n"},
+    {"subs", "s"},
+    {"root", "R"},
+    {"room_id", "o"},
+    {"base_ssid", "b"},
+    {"base_password", "B"},
+    {"ssid", "S"},
+    {"password", "P"},
+    {"success", "k"},
+    {"encoding", "e"},
+    {"baud", "d"},
+};
+
+const size_t SERIAL_KEY_TAG_COUNT = sizeof(SERIAL_KEY_TAGS) / sizeof(SERIAL_KEY_TAGS[0]);
+
+static const char *renameSerialKey(const char *key, bool toTags)
+{
+    for (size_t i = 0; i < SERIAL_KEY_TAG_COUNT; i++)
+    {
+        const char *from = toTags ? SERIAL_KEY_TAGS[i].name : SERIAL_KEY_TAGS[i].tag;
+        if (strcmp(key, from) == 0)
+        {
+            return toTags ? SERIAL_KEY_TAGS[i].tag : SERIAL_KEY_TAGS[i].name;
+        }
+    }
+    return key;
+}
+
+void renameSerialKeys(JsonVariantConst source, JsonVariant destination, bool toTags)
+{
+    if (source.is<JsonObjectConst>())
+    {
+        JsonObject object = destination.to<JsonObject>();
+        for (JsonPairConst pair : source.as<JsonObjectConst>())
+        {
+            renameSerialKeys(pair.value(), object[renameSerialKey(pair.key().c_str(), toTags)].to<JsonVariant>(), toTags);
+        }
+    }
+    else if (source.is<JsonArrayConst>())
+    {
+        JsonArray array = destination.to<JsonArray>();
+        for (JsonVariantConst item : source.as<JsonArrayConst>())
+        {
+            renameSerialKeys(item, array.add<JsonVariant>(), toTags);
+        }
+    }
+    else
+    {
+        destination.set(source);
+    }
+}
+
+size_t cobsDecode(const uint8_t *input, size_t length, uint8_t *output)
+{
+    size_t read = 0;
+    size_t written = 0;
+
+    while (read < length)
+    {
+        uint8_t code = input[read++];
+        if (code == 0 || read + code - 1 > length)
+        {
+            return 0;
+        }
+        for (uint8_t i = 1; i < code; i++)
+        {
+            output[written++] = input[read++];
+        }
+        // every block but a full one and the last ends where the encoder removed a zero
+        if (code < 0xFF && read < length)
+        {
+            output[written++] = 0;
+        }
+    }
+    return written;
+}
+
+CobsWriter::CobsWriter(Print &output)
+{
+    this->output = &output;
+    this->used = 0;
+}
+
+void CobsWriter::flushBlock(uint8_t code)
+{
+    this->output->write(code);
+    this->output->write(this->block, this->used);
+    this->used = 0;
+}
+
+size_t CobsWriter::write(uint8_t byte)
+{
+    if (byte == 0)
+    {
+        this->flushBlock(this->used + 1);
+        return 1;
+    }
+    this->block[this->used++] = byte;
+    if (this->used == sizeof(this->block))
+    {
+        this->flushBlock(0xFF);
+    }
+    return 1;
+}
+
+void CobsWriter::finish()
+{
+    this->flushBlock(this->used + 1);
+}
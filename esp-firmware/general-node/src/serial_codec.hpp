@@ -0,0 +1,78 @@
+#pragma once
+
+#include <Arduino.h>
+#include <ArduinoJson.h>
+
+/**
+ * @brief Compact binary encoding of the serial link
+ *
+ * JSON lines stay the default. After the host sends `set-encoding` with `"encoding": "msgpack"`, documents go out as
+ * MessagePack with one-letter keys (see `SERIAL_KEY_TAGS`), COBS-encoded so they contain no zero byte, between two zero bytes:
+ *
+ *      0x00 <COBS(MessagePack)> 0x00
+ *
+ * Text the firmware prints (boot dots, "Invalid Command", logs) never contains a zero byte, so the host tells the two apart.
+ * The boot output is bracketed by zero bytes to close a frame cut off by a restart; the host reads all-text frames as lines.
+ * Incoming commands are accepted in either encoding at any time; a frame starts with a zero byte, a JSON line does not.
+ * The key tags must match `SHORT_KEYS` in python-interface/src/lib/SerialCodec.py.
+ */
+
+#define SERIAL_FRAME_DELIMITER 0x00
+#define SERIAL_MAX_FRAME 512
+
+/**
+ * @brief Long key name and its one-letter tag
+ */
+struct SerialKeyTag
+{
+    const char *name;
+    const char *tag;
+};
+
+extern const SerialKeyTag SERIAL_KEY_TAGS[];
+extern const size_t SERIAL_KEY_TAG_COUNT;
+
+/**
+ * @brief Copy a JSON value, renaming every object key found in `SERIAL_KEY_TAGS`
+ *
+ * @param source Value to copy
+ * @param destination Where the copy goes
+ * @param toTags true to rename long names to tags, false for tags to long names
+ */
+void renameSerialKeys(JsonVariantConst source, JsonVariant destination, bool toTags);
+
+/**
+ * @brief Decode a COBS block in place of a buffer
+ *
+ * @param input COBS bytes, without the zero delimiters
+ * @param length Number of bytes in `input`
+ * @param output Buffer for the decoded bytes, at least `length` bytes long
+ * @return size_t Number of decoded bytes, 0 if `input` is not valid COBS
+ */
+size_t cobsDecode(const uint8_t *input, size_t length, uint8_t *output);
+
+/**
+ * @brief Print that COBS-encodes whatever is written to it, a block of at most 254 bytes at a time
+ *
+ * Lets `serializeMsgPack` stream a frame of any size without buffering the whole document.
+ * Call `finish()` after the last byte.
+ */
+class CobsWriter : public Print
+{
+private:
+    Print *output;
+    uint8_t block[254];
+    uint8_t used;
+
+    void flushBlock(uint8_t code);
+
+public:
+    CobsWriter(Print &output);
+
+    size_t write(uint8_t byte) override;
+
+    /**
+     * @brief Write the last block
+     */
+    void finish();
+};
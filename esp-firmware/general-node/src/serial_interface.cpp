@@ -7,6 +7,11 @@ SerialInterface::SerialInterface(NodeConfig &config, Mesh &mesh)
     this->serial = config.serial_config.serial;
     this->mesh = &mesh;
     this->nodeConfig = &config;
+    // JSON until the host asks for something else; a restart goes back to it
+    this->compactEncoding = false;
+    this->baudRate = this->serial->baudRate();
+    this->pendingBaudRate = 0;
+    this->baudConfirmDeadline = 0;
 }
 
 void SerialInterface::setSendMessageCallable(void (*sendMessageCallback)(JsonDocument &serial_json_mesh))
@@ -17,10 +22,27 @@ void SerialInterface::setSendMessageCallable(void (*sendMessageCallback)(JsonDoc
 void SerialInterface::sendResponse(JsonDocument &response_serial_json, JsonDocument &incoming_serial_json)
 {
     incoming_serial_json["payload"]["response"] = response_serial_json;
-    String stringified_json_response;
 
-    serializeJson(incoming_serial_json, *this->serial);
-    this->serial->println();
+    this->send(incoming_serial_json);
+}
+
+void SerialInterface::send(JsonDocument &serial_json)
+{
+    if (!this->compactEncoding)
+    {
+        serializeJson(serial_json, *this->serial);
+        this->serial->println();
+        return;
+    }
+
+    JsonDocument compact_serial_json;
+    renameSerialKeys(serial_json.as<JsonVariantConst>(), compact_serial_json.to<JsonVariant>(), true);
+
+    CobsWriter frame(*this->serial);
+    this->serial->write(SERIAL_FRAME_DELIMITER);
+    serializeMsgPack(compact_serial_json, frame);
+    frame.finish();
+    this->serial->write(SERIAL_FRAME_DELIMITER);
 }
 
 void SerialInterface::sendMessage(JsonDocument &incoming_serial_json)
@@ -111,20 +133,131 @@ void SerialInterface::getBaseNetworkCredentials(JsonDocument &incoming_serial_js
     this->sendResponse(response_serial_json, incoming_serial_json_payload);
 }
 
+void SerialInterface::setEncoding(JsonDocument &incoming_serial_json_payload)
+{
+    String encoding = incoming_serial_json_payload["payload"]["encoding"].as<String>();
+    bool known = (encoding == "json" || encoding == "msgpack");
+
+    JsonDocument response_serial_json;
+    response_serial_json["success"] = known;
+    response_serial_json["encoding"] = known ? encoding : String(this->compactEncoding ? "msgpack" : "json");
+
+    // the answer still goes out in the old encoding, so the host knows when to expect the new one
+    this->sendResponse(response_serial_json, incoming_serial_json_payload);
+    if (known)
+    {
+        this->compactEncoding = (encoding == "msgpack");
+    }
+}
+
+void SerialInterface::setBaudRate(JsonDocument &incoming_serial_json_payload)
+{
+    static const uint32_t supported_baud_rates[] = {115200, 230400, 460800, 921600};
+    uint32_t baud_rate = incoming_serial_json_payload["payload"]["baud"].as<uint32_t>();
+
+    JsonDocument response_serial_json;
+    if (this->pendingBaudRate != 0 && baud_rate == this->pendingBaudRate)
+    {
+        // read at the new rate, so it works both ways
+        this->baudRate = this->pendingBaudRate;
+        this->pendingBaudRate = 0;
+        response_serial_json["success"] = true;
+        response_serial_json["baud"] = this->baudRate;
+        this->sendResponse(response_serial_json, incoming_serial_json_payload);
+        return;
+    }
+
+    bool supported = false;
+    for (uint32_t supported_baud_rate : supported_baud_rates)
+    {
+        supported = supported || (baud_rate == supported_baud_rate);
+    }
+    response_serial_json["success"] = supported;
+    response_serial_json["baud"] = supported ? baud_rate : this->baudRate;
+
+    // the answer still goes out at the old rate
+    this->sendResponse(response_serial_json, incoming_serial_json_payload);
+    if (!supported || baud_rate == this->baudRate)
+    {
+        return;
+    }
+    this->serial->flush();
+    this->serial->updateBaudRate(baud_rate);
+    this->pendingBaudRate = baud_rate;
+    this->baudConfirmDeadline = millis() + SERIAL_BAUD_CONFIRM_TIMEOUT;
+}
+
+void SerialInterface::checkBaudRate()
+{
+    if (this->pendingBaudRate == 0 || (long)(millis() - this->baudConfirmDeadline) < 0)
+    {
+        return;
+    }
+    // nothing readable came at the new rate; whatever did is garbage
+    this->serial->updateBaudRate(this->baudRate);
+    this->pendingBaudRate = 0;
+    while (this->serial->available())
+    {
+        this->serial->read();
+    }
+}
+
 void SerialInterface::displayLiveMessage(JsonDocument payload)
 {
-    serializeJson(payload, *this->serial);
-    this->serial->println();
+    this->send(payload);
 }
 
-void SerialInterface::processSerial()
+bool SerialInterface::readCommand(JsonDocument &incoming_serial_json)
 {
-    if (this->serial->available())
+    if (this->serial->peek() != SERIAL_FRAME_DELIMITER)
     {
         String incoming_stringified_json = this->serial->readStringUntil('\n');
         incoming_stringified_json.trim();
-        JsonDocument incoming_serial_json;
         deserializeJson(incoming_serial_json, incoming_stringified_json);
+        return true;
+    }
+
+    static uint8_t frame[SERIAL_MAX_FRAME];
+    static uint8_t decoded[SERIAL_MAX_FRAME];
+
+    this->serial->read();
+    size_t length = this->serial->readBytesUntil(SERIAL_FRAME_DELIMITER, frame, sizeof(frame));
+    if (length == 0)
+    {
+        // the zero taken as opening delimiter closed a frame read only in part; the one after it opens this frame
+        length = this->serial->readBytesUntil(SERIAL_FRAME_DELIMITER, frame, sizeof(frame));
+    }
+    if (length == 0)
+    {
+        return false;
+    }
+    if (length == sizeof(frame))
+    {
+        // longer than any command; the host sends those as JSON lines
+        return true;
+    }
+
+    size_t decoded_length = cobsDecode(frame, length, decoded);
+    JsonDocument compact_serial_json;
+    if (decoded_length == 0 || deserializeMsgPack(compact_serial_json, decoded, decoded_length))
+    {
+        // leaves the document empty, answered with "Invalid Command" like a malformed JSON line
+        return true;
+    }
+    renameSerialKeys(compact_serial_json.as<JsonVariantConst>(), incoming_serial_json.to<JsonVariant>(), false);
+    return true;
+}
+
+void SerialInterface::processSerial()
+{
+    this->checkBaudRate();
+    if (this->serial->available())
+    {
+        JsonDocument incoming_serial_json;
+        if (!this->readCommand(incoming_serial_json))
+        {
+            return;
+        }
 
         if (incoming_serial_json["payload"]["cmd"] == "ping")
         {
@@ -158,6 +291,14 @@ void SerialInterface::processSerial()
         {
             this->getBaseNetworkCredentials(incoming_serial_json);
         }
+        else if (incoming_serial_json["payload"]["cmd"] == "set-encoding")
+        {
+            this->setEncoding(incoming_serial_json);
+        }
+        else if (incoming_serial_json["payload"]["cmd"] == "set-baud")
+        {
+            this->setBaudRate(incoming_serial_json);
+        }
         else if (incoming_serial_json["payload"]["cmd"] == "esp-reset")
         {
             ESP.restart();
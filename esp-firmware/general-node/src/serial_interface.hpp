@@ -2,6 +2,10 @@
 #include <ArduinoJson.h>
 #include <painlessMesh.h>
 #include "mesh.hpp"
+#include "serial_codec.hpp"
+
+// milliseconds the host has to confirm a new baud rate by asking for it again at that rate, before the board goes back
+#define SERIAL_BAUD_CONFIRM_TIMEOUT 2000
 
 /**
  * @brief Serial Interface Class
@@ -10,6 +14,10 @@
  * - `serial` : A pointer to the HardwareSerial object
  * - `mesh` : A pointer to the Mesh object
  * - `nodeId` : The node ID of the current node
+ * - `compactEncoding` : Whether documents are sent as MessagePack frames instead of JSON lines (see serial_codec.hpp)
+ * - `baudRate` : The last baud rate known to work with the host
+ * - `pendingBaudRate` : The baud rate switched to but not confirmed by the host yet, 0 if none
+ * - `baudConfirmDeadline` : When the board goes back to `baudRate` if `pendingBaudRate` is not confirmed
  *
  *
  */
@@ -19,6 +27,10 @@ private:
     HardwareSerial *serial;
     Mesh *mesh;
     NodeConfig *nodeConfig;
+    bool compactEncoding;
+    uint32_t baudRate;
+    uint32_t pendingBaudRate;
+    unsigned long baudConfirmDeadline;
 
     /**
      * @brief Function pointer to keep callback funtion from Main for sending message to the mesh network
@@ -64,6 +76,41 @@ private:
      */
     void getBaseNetworkCredentials(JsonDocument &incoming_serial_json);
 
+    /**
+     * @brief Process the incoming command "set-encoding": answer in the current encoding, then send everything after in the requested one
+     *
+     * @param incoming_serial_json
+     */
+    void setEncoding(JsonDocument &incoming_serial_json);
+
+    /**
+     * @brief Process the incoming command "set-baud": answer at the current rate, then switch to the requested one.
+     * The host confirms by sending the same command at the new rate; without that the board goes back (see `checkBaudRate`)
+     *
+     * @param incoming_serial_json
+     */
+    void setBaudRate(JsonDocument &incoming_serial_json);
+
+    /**
+     * @brief Go back to the last working baud rate if the host has not confirmed the new one in time
+     */
+    void checkBaudRate();
+
+    /**
+     * @brief Write a document to the serial interface in the current encoding: a JSON line, or a MessagePack frame
+     *
+     * @param serial_json
+     */
+    void send(JsonDocument &serial_json);
+
+    /**
+     * @brief Read one command from the serial interface, as a JSON line or a MessagePack frame
+     *
+     * @param incoming_serial_json Filled with the command, with long key names
+     * @return true if a command was read
+     */
+    bool readCommand(JsonDocument &incoming_serial_json);
+
     /**
      * @brief Wrapper to send the response back to the serial interface against the incoming commands
      *
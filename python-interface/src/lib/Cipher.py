@@ -0,0 +1,150 @@
+'''
+Module to run the workspace cipher fast enough for a busy mesh.
+`workspace.encrypt`/`decrypt` are written by the teams during a session, usually as a loop over the characters of the message,
+and `decrypt` runs on the serial thread for every mesh message received. CipherEngine keeps their contract but, when the cipher
+treats each character on its own (shift, affine and substitution ciphers), compiles it into a `str.translate` table once
+and translates whole messages, or a whole burst of them with `decrypt_many`, in C.
+
+The table is built by probing the workspace functions and is kept until `SHIFT_KEY` or the functions themselves change.
+Ciphers that depend on the position of a character, on the length of the message or on chance (Vigenère, transpositions, salts)
+fail the probe and keep being called for every message, as before.
+'''
+import random
+import threading
+
+from collections.abc import Iterable
+from types import ModuleType
+
+# characters probed one by one; messages with any other character go to the workspace functions
+PROBE_ALPHABET = ''.join(chr(code) for code in range(0x20, 0x7f))
+# separates the messages of a batch; not a printable character, so never part of a message that is translated
+BATCH_SEPARATOR = '\n'
+
+def _probeMessages() -> list[str]:
+    '''
+    @return: list[str] - Messages a per-character cipher must encrypt to the concatenation of its characters' images
+    '''
+    generator = random.Random(0)
+    messages: list[str] = [PROBE_ALPHABET, PROBE_ALPHABET[::-1], PROBE_ALPHABET * 3, 'The quick brown fox jumps over the lazy dog.']
+    messages += [''.join(generator.choices(PROBE_ALPHABET, k=length)) for length in (2, 3, 5, 8, 13, 21, 34, 55, 89, 144)]
+    return messages
+
+PROBE_MESSAGES = _probeMessages()
+
+def compileTable(function) -> dict[int, str] | None:
+    '''
+    Build the `str.translate` table of a cipher function, if it is a per-character substitution
+    @param function: Callable[[str], str] - Workspace encrypt or decrypt
+    @return: dict[int, str] | None - Code point to image, without the characters it leaves as they are; None if the function cannot be replaced by a table
+    '''
+    try:
+        images = [function(character) for character in PROBE_ALPHABET]
+        if not all(isinstance(image, str) for image in images):
+            return None
+        table: dict[int, str] = {ord(character): image for character, image in zip(PROBE_ALPHABET, images)}
+        for message in PROBE_MESSAGES:
+            if function(message) != message.translate(table):
+                return None
+    except Exception:
+        # a cipher that fails on single characters still gets its chance on real messages
+        return None
+    return {code: image for code, image in table.items() if chr(code) != image}
+
+def translatable(message) -> bool:
+    '''
+    @return: bool - Whether a message only has probed characters, so its table translation matches the workspace function
+    '''
+    return isinstance(message, str) and message.isascii() and message.isprintable()
+
+
+class CipherEngine:
+    """
+    Drop-in `encrypt`/`decrypt` for a workspace module, backed by compiled translation tables when the cipher allows it
+    @param module: ModuleType - Module defining `encrypt(message)` and `decrypt(message)`, normally `workspace`
+    @param keyName: str - Module attribute whose change means the tables must be built again (default: 'SHIFT_KEY')
+    """
+
+    def __init__(self, module: ModuleType, keyName: str = 'SHIFT_KEY'):
+        self.module = module
+        self.keyName = keyName
+        self._lock = threading.Lock()
+        # (key, encrypt, decrypt) the tables were built for, and {direction: (table or None, whether batches can be joined)}
+        self._compiled: tuple[tuple, dict[str, tuple[dict[int, str] | None, bool]]] | None = None
+        # how many times the tables were built, for benchmarks and tests
+        self.compilations: int = 0
+
+    def __repr__(self) -> str:
+        return f"CipherEngine Object: {self.module.__name__ = }, {self.keyName = }, {self.compiled = }"
+
+    def __state(self) -> tuple:
+        return (getattr(self.module, self.keyName, None), self.module.encrypt, self.module.decrypt)
+
+    def __tables(self) -> dict[str, tuple[dict[int, str] | None, bool]]:
+        '''
+        Private method to return the tables of the current cipher, building them if the key or the functions changed
+        '''
+        state = self.__state()
+        compiled = self._compiled
+        if compiled is not None and compiled[0] == state:
+            return compiled[1]
+        with self._lock:
+            compiled = self._compiled
+            if compiled is None or compiled[0] != state:
+                tables: dict[str, tuple[dict[int, str] | None, bool]] = {}
+                for direction, function in (('encrypt', state[1]), ('decrypt', state[2])):
+                    table = compileTable(function)
+                    tables[direction] = (table, table is not None and not any(BATCH_SEPARATOR in image for image in table.values()))
+                compiled = self._compiled = (state, tables)
+                self.compilations += 1
+        return compiled[1]
+
+    @property
+    def compiled(self) -> dict[str, bool]:
+        '''
+        @return: dict[str, bool] - Whether encrypt and decrypt currently run from a table
+        '''
+        return {direction: table is not None for direction, (table, _) in self.__tables().items()}
+
+    def invalidate(self) -> None:
+        '''
+        Build the tables again on the next call, for changes to the cipher that leave the key and the functions as they are
+        '''
+        self._compiled = None
+
+    def encrypt(self, message: str) -> str:
+        table, _ = self.__tables()['encrypt']
+        if table is None or not translatable(message):
+            return self.module.encrypt(message)
+        return message.translate(table) if table else message
+
+    def decrypt(self, message: str) -> str:
+        table, _ = self.__tables()['decrypt']
+        if table is None or not translatable(message):
+            return self.module.decrypt(message)
+        return message.translate(table) if table else message
+
+    def decrypt_many(self, messages: Iterable[str]) -> list[str]:
+        '''
+        Decrypt a burst of messages in one pass: joined, translated once and split again
+        @param messages: Iterable[str] - Encrypted messages
+        @return: list[str] - Decrypted messages, in the same order
+        '''
+        messages = list(messages)
+        table, batchable = self.__tables()['decrypt']
+        if table is None:
+            return [self.module.decrypt(message) for message in messages]
+        if not batchable:
+            return [self.decrypt(message) for message in messages]
+
+        results: list[str] = list(messages)
+        batch: list[int] = []
+        for index, message in enumerate(messages):
+            if translatable(message):
+                batch.append(index)
+            else:
+                results[index] = self.module.decrypt(message)
+        if batch and table:
+            translated: list[str] = BATCH_SEPARATOR.join([messages[index] for index in batch]).translate(table).split(BATCH_SEPARATOR)
+            for index, message in zip(batch, translated):
+                results[index] = message
+        return results
@@ -1,16 +1,29 @@
+import itertools
 import json
 
 from Config import TOPOLOGY_FILE, log as logger
-from Config import decrypt
+from Config import decrypt, decrypt_many
+from Topology import Topology
 
 class CommandParser:
     """
     Class to parse command strings passed from command interface to main controller into JSON objects based on predefined serial interfacing schemas set up on the board firmware and to extract information from JSON strings.
     """
 
-    def create_payload(self, command: str) -> str:
+    def __init__(self):
+        self._request_ids = itertools.count(1)
+        # index of the latest topology reported by the board, rebuilt once per topology response
+        self.topology: Topology | None = None
+
+    def next_request_id(self) -> int:
+        """
+        Returns a new request ID, unique for this parser. Safe to call from several threads.
+        """
+        return next(self._request_ids)
+
+    def create_payload(self, command: str, request_id: int | None = None) -> str:
         """
-        Parses a command string and returns a JSON string of the payload.
+        Parses a command string and returns a JSON string of the payload. If `request_id` is given it is stamped into the payload as `req_id`; the board echoes it back in its response.
         """
         components = command.strip().split()
         if not components:
@@ -32,11 +45,18 @@ class CommandParser:
                     'HEX': components[2],
                     'msg': components[3]
                 }
+            elif cmd_type == 'set_encoding' and len(components) == 2:
+                payload = {'cmd': 'set-encoding', 'encoding': components[1].lower()}
+            elif cmd_type == 'set_baud' and len(components) == 2:
+                payload = {'cmd': 'set-baud', 'baud': int(components[1])}
 ############ ...something here?
             else:
                 logger.error('Invalid command or incorrect parameters.')
                 return json.dumps({})
 
+            if request_id is not None:
+                payload['req_id'] = request_id
+
             result = {
                 'payload_type': 'cmd',
                 'payload': payload
@@ -46,27 +66,69 @@ class CommandParser:
             logger.exception('Error processing command.')
             return json.dumps({})
 
+    def parse_line(self, json_str: str) -> dict | None:
+        """
+        Parses one line received from the board. Returns None if it is not a JSON object.
+        """
+        try:
+            data = json.loads(json_str)
+        except (json.JSONDecodeError, RecursionError):
+            # RecursionError: nested deeper than the json module handles, e.g. the topology of a very deep mesh
+            return None
+        return data if isinstance(data, dict) else None
+
     def extract_from_payload(self, json_str: str) -> str:
         """
         Extracts relevant information from a JSON string. Returns the input string if it cannot be parsed.
         """
+        data = self.parse_line(json_str)
+        if data is None:
+            # logger.warning('Malformed JSON received, returning original.')
+            return json_str
+        return self.extract_from_data(data, json_str)
+
+    def extract_from_data(self, data: dict, json_str: str = '') -> str:
+        """
+        Extracts relevant information from a line already parsed with `parse_line`. Returns `json_str` if the payload cannot be handled.
+        """
+        shown = self.process_data(data)
+        return json_str if shown is None else json.dumps(shown, indent=2)
+
+    def process_many(self, datas: list[dict | None]) -> list[dict | None]:
+        """
+        Handles a burst of lines parsed with `parse_line`, in order, like `process_data`, decrypting all their mesh messages in one pass. Lines that could not be parsed (None) stay None.
+        """
+        messages = [data['payload'] for data in datas if self.is_mesh_message(data)]
+        if messages:
+            try:
+                for payload, message in zip(messages, self.decrypt_many([payload['msg'] for payload in messages])):
+                    payload['msg'] = message
+            except Exception:
+                # the workspace cipher is edited during the session; a failing one is reported per line as before
+                return [None if data is None else self.process_data(data) for data in datas]
+        return [None if data is None else self.process_data(data, decrypt=False) for data in datas]
+
+    def is_mesh_message(self, data: dict | None) -> bool:
+        return isinstance(data, dict) and data.get('payload_type') == 'mesh' and isinstance(data.get('payload'), dict) and 'msg' in data['payload']
+
+    def process_data(self, data: dict, decrypt: bool = True) -> dict | None:
+        """
+        Handles a line already parsed with `parse_line`: indexes and exports topologies and decrypts mesh messages, unless `decrypt` is False because `process_many` already did. Returns the part of the line worth showing, or None if the payload cannot be handled.
+        """
         try:
-            data = json.loads(json_str)
             payload = data.get('payload', {})
             if 'response' in payload:
+                if payload['cmd'] in ('topology', 'capture-topology'):
+                    self.topology = Topology(payload['response'])
                 if payload['cmd'] == 'capture-topology':
                     self.export_to_jsonfile(TOPOLOGY_FILE, payload['response'], append=False)
-                return json.dumps(payload['response'], indent=2)
-            elif data.get('payload_type') == 'mesh':
+                return payload['response']
+            elif data.get('payload_type') == 'mesh' and decrypt:
                 payload['msg'] = self.decrypt(payload['msg'])
-                return json.dumps(payload, indent=2)
-            return json.dumps(payload, indent=2)
-        except json.JSONDecodeError:
-            # logger.warning('Malformed JSON received, returning original.')
-            return json_str
+            return payload
         except Exception as e:
             logger.exception('Unhandled exception during JSON extraction.')
-            return json_str
+            return None
 
     def export_to_jsonfile(self, filename: str, contents: dict, append: bool = False) -> None:
         mode = 'a' if append else 'w'
@@ -77,6 +139,9 @@ class CommandParser:
     def decrypt(self, message: str) -> str:
         return decrypt(message)
 
+    def decrypt_many(self, messages: list[str]) -> list[str]:
+        return decrypt_many(messages)
+
 # This allows the script to be run for testing purposes
 if __name__ == '__main__':
     parser = CommandParser()
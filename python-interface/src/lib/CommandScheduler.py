@@ -0,0 +1,136 @@
+'''
+Module to order and merge client commands before they reach the serial writer.
+CommandScheduler is a drop-in replacement for the `queue.Queue` of (command, reply) items the serial writer reads from.
+'''
+import heapq
+import itertools
+import queue
+import threading
+
+from typing import Callable
+
+Reply = Callable[[dict], None] | None
+
+class CommandScheduler:
+    """
+    Priority queue of (command, reply) items with duplicate merging.
+    Control commands go out before reads, and reads before bulk commands like `ping_node`; commands of the same priority keep their order.
+    An idempotent command that is already queued or waiting for the board's answer is not sent again; its reply is added to the earlier one and the single answer is sent to every waiter.
+    Commands are merged on their board prefix and words, so `get_topology`, `@0 get_topology` and `get_topology ` are the same command for the board they all reach
+    @param localTargets: set[str] | None - Board prefixes, without the `@`, that name the board this queue feeds and so mean the same as no prefix, e.g. its hw index and node id (default: None)
+    """
+    # lower goes first; anything not listed is bulk
+    priorities: dict[str, int] = {
+        'mirror-mirror': 0,
+        'set_encoding': 0,
+        'set_baud': 0,
+        'get_topology': 1,
+        'export_topology': 1,
+    }
+    bulkPriority: int = 2
+
+    # commands whose answer does not depend on who asked or how often
+    idempotent: set[str] = {'get_topology', 'export_topology'}
+
+    def __init__(self, localTargets: set[str] | None = None):
+        self.localTargets: set[str] = set(localTargets or ())
+        self._lock = threading.Lock()
+        self._notEmpty = threading.Condition(self._lock)
+        self._heap: list[tuple[int, int, str, Reply]] = []
+        self._order = itertools.count()
+        # merge key -> (reply, command as the waiter sent it without the board prefix) of everyone waiting for the one copy that is queued or in flight
+        self._waiters: dict[str, list[tuple[Reply, str]]] = {}
+
+    @staticmethod
+    def commandName(command: str) -> str:
+        '''
+        @param command: str - Command string, optionally prefixed with `@[hw index]`
+        @return: str - First word of the command, without the board prefix
+        '''
+        words = command.split()
+        if words and words[0].startswith('@'):
+            words = words[1:]
+        return words[0] if words else ''
+
+    @staticmethod
+    def splitTarget(command: str) -> tuple[str | None, str]:
+        '''
+        @param command: str - Command string, optionally prefixed with `@[hw index]`
+        @return: tuple[str | None, str] - Board prefix without the `@` (None if there is none) and the command without it
+        '''
+        if command.startswith('@'):
+            target, _, command = command[1:].partition(' ')
+            return target, command.strip()
+        return None, command
+
+    def mergeKey(self, command: str) -> str:
+        '''
+        @param command: str - Command string, optionally prefixed with `@[hw index]`
+        @return: str - Key under which copies of the command merge: its words, single spaced, after the board prefix unless it names this queue's board
+        '''
+        target, command = self.splitTarget(command)
+        words = ' '.join(command.split())
+        return words if target is None or target in self.localTargets else f'@{target} {words}'
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+    def empty(self) -> bool:
+        return not self._heap
+
+    def hasPending(self, commands: set[str]) -> bool:
+        '''
+        @param commands: set[str] - Idempotent command strings to look for; matched the way copies merge, so a prefixed or spaced out copy counts
+        @return: bool - True if any of them is queued or waiting for the board's answer
+        '''
+        keys = {self.mergeKey(command) for command in commands}
+        with self._lock:
+            return any(key in self._waiters for key in keys)
+
+    def put(self, item: tuple[str, Reply], block: bool = True, timeout: float | None = None) -> None:
+        '''
+        Queue a (command, reply) item. Never blocks; `block` and `timeout` are accepted for `queue.Queue` compatibility
+        '''
+        command, reply = item
+        name = self.commandName(command)
+        with self._lock:
+            if name in self.idempotent:
+                key = self.mergeKey(command)
+                waiter = (reply, self.splitTarget(command)[1])
+                if key in self._waiters:
+                    self._waiters[key].append(waiter)
+                    return
+                self._waiters[key] = [waiter]
+                reply = self.__fanOut(key)
+            heapq.heappush(self._heap, (self.priorities.get(name, self.bulkPriority), next(self._order), command, reply))
+            self._notEmpty.notify()
+
+    def get(self, block: bool = True, timeout: float | None = None) -> tuple[str, Reply]:
+        '''
+        Take the most urgent (command, reply) item, same semantics as `queue.Queue.get`
+        @raise queue.Empty: if no item is available within `timeout`, or right away if `block` is False
+        '''
+        with self._notEmpty:
+            if block and not self._notEmpty.wait_for(lambda: self._heap, timeout):
+                raise queue.Empty
+            if not self._heap:
+                raise queue.Empty
+            _, _, command, reply = heapq.heappop(self._heap)
+        return command, reply
+
+    def get_nowait(self) -> tuple[str, Reply]:
+        return self.get(block=False)
+
+    def __fanOut(self, key: str) -> Callable[[dict], None]:
+        '''
+        Private method to build the reply for a merged command. Once the board answers, later duplicates are sent again instead of merged
+        @param key: str - Merge key of the command the waiters asked for
+        @return: Callable[[dict], None] - Sends the answer to every waiter of the command, each with the command echoed as it sent it
+        '''
+        def reply(frame: dict) -> None:
+            with self._lock:
+                waiters = self._waiters.pop(key, [])
+            for waiter, command in waiters:
+                if waiter is not None:
+                    waiter({**frame, 'cmd': command})
+        return reply
@@ -10,16 +10,87 @@ SRC_DIR = os.path.dirname(LIB_DIR)
 if SRC_DIR not in sys.path:
     sys.path.append(SRC_DIR)
 
-from workspace import encrypt, decrypt
+import workspace
+
+from Cipher import CipherEngine
+
+# the workspace cipher, compiled to translation tables when it substitutes each character on its own; rebuilt when SHIFT_KEY changes
+Cipher = CipherEngine(workspace)
+encrypt = Cipher.encrypt
+decrypt = Cipher.decrypt
+decrypt_many = Cipher.decrypt_many
 
 TOPOLOGY_FILE = os.path.join(SRC_DIR, 'topology.json')
 WORDLIST_FILE = os.path.join(LIB_DIR, 'wordlist')
+# index of the word list, rebuilt whenever the word list changes
+WORDLIST_CACHE_FILE = os.path.join(SRC_DIR, 'wordlist.cache')
+# words run together into each `ping_node` payload
+PAYLOAD_WORDS = 5
+# benchmark results, one JSON file per run named after the commit it measured
+BENCHMARK_DIR = os.path.join(SRC_DIR, 'benchmarks')
 EXIT_COMMAND = 'exit'
 SOCK_HOST = '127.0.0.1'
 SOCK_PORT = 65432
 
+# local HTTP endpoint serving the controller's metrics in the Prometheus text format, at /metrics
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9465
+
+# seconds the serial threads block waiting for board data or queued commands before
+# re-checking for shutdown. This does not delay commands or messages; they wake the threads immediately.
+SERIAL_WAIT_TIMEOUT = 0.5
+
+# commands sent to a board but not answered yet. The firmware reads one command per loop, so every answer is taken as an
+# acknowledgement: the window starts at SERIAL_WINDOW_INITIAL and moves between the bounds with the answer latency (see FlowControl)
+SERIAL_WINDOW_MIN = 1
+SERIAL_WINDOW_INITIAL = 4
+SERIAL_WINDOW_MAX = 16
+# bytes of unanswered commands allowed on the way to a board; no more than its UART receive buffer (SERIAL_RX_BUFFER_SIZE in main.cpp)
+SERIAL_RX_BUFFER_BYTES = 1024
+
+# line rate the boards start at, and the faster ones tried in turn once connected, fastest first; the board goes back to
+# the rate that worked unless the host confirms the new one within its confirmation window (SERIAL_BAUD_CONFIRM_TIMEOUT in serial_interface.hpp)
+SERIAL_BAUD_RATE = 115200
+SERIAL_BAUD_RATES = [921600, 460800, 230400]
+# seconds to wait for the answer to a rate change or its confirmation; longer than the board's window, so the board has gone back by then
+SERIAL_BAUD_CONFIRM_TIMEOUT = 3
+# request timeouts in a row, at a negotiated rate, after which the board is taken to have restarted at SERIAL_BAUD_RATE
+SERIAL_BAUD_FALLBACK_TIMEOUTS = 3
+
+# encoding asked of the boards once connected: 'json' lines, or 'msgpack' frames (see SerialCodec); boards go back to JSON when they restart
+SERIAL_ENCODING = 'json'
+
+# seconds to wait for the board to answer a command, and how many times to resend it before reporting a timeout
+REQUEST_TIMEOUT = 5
+REQUEST_RETRIES = 0
+
+# seconds the command interface waits for a reply; longer than the server's own timeout so its error gets through
+CLIENT_REPLY_TIMEOUT = REQUEST_TIMEOUT * (REQUEST_RETRIES + 1) + 1
+
+# bytes of replies the server holds for one client; a client this far behind is not reading, and is disconnected
+CLIENT_SEND_BUFFER_BYTES = 4 * 1024 * 1024
+# seconds a closing connection gets to take the replies still held for it
+CLIENT_SEND_TIMEOUT = 5
+
+# named groups of hardware indexes that `ping_node` accepts as a target, e.g. 'blue': [0, 1, 2, 3, 4]
+TEAMS: dict[str, list[int]] = {}
+
+# seconds between background topology polls (`--poll-topology`): back to the minimum whenever the mesh changes,
+# doubling up to the maximum while it stays the same
+TOPOLOGY_POLL_MIN_INTERVAL = 5
+TOPOLOGY_POLL_MAX_INTERVAL = 120
+
 # set the log level here
 LOG_LEVEL = logging.INFO
 
 log = get_logger(level = LOG_LEVEL)
+# what the boards send, shown as is; no level prefix and no colour, like the serial monitor
+serial_log = get_logger('SerialMonitor', level = LOG_LEVEL, formatter = logging.Formatter('%(message)s'), colors = {'INFO': ''})
+
+# main_controller logs from a background thread unless run with `--sync-logging`. Records beyond the queue size are dropped rather than
+# blocking the serial thread; the console shows at most this many lines per second of each listed kind, the `--log-file` gets every line
+LOG_QUEUE_SIZE = 10000
+CONSOLE_RATE_LIMITS = {'mesh': 20}
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
 
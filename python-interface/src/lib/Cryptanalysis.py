@@ -0,0 +1,421 @@
+'''
+Module to break the shift and affine ciphers of intercepted mesh messages, for the red team.
+Every key of both ciphers is tried at once with NumPy over a message x key matrix, over two alphabets:
+'letters' (a-z, case kept, everything else left as is, the classic Caesar) and 'printable' (the 95 printable ASCII characters, like `chr(ord(c) + key)` ciphers).
+Each decryption is scored with English letter frequencies and with letter trigrams of the `wordlist` vocabulary the messages are drawn from,
+and the scores add up per sender node, so the right key stands out more with every message a team sends. The best keys are then checked by segmenting their decryption into words of the list.
+
+Needs NumPy, which the rest of the controller does not (`pip install numpy`).
+
+    python Cryptanalysis.py captured.jsonl                   # board lines or main_controller --log-file records
+    python Cryptanalysis.py --demo 200                       # messages from made up senders with random keys
+
+A Cryptanalyst can also be fed live: `main_controller.py --crack` submits every mesh message it receives and answers the `crack` command with the rankings.
+'''
+import collections
+import json
+import math
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+from collections.abc import Iterable
+
+from Wordlist import WordlistIndex
+
+# share of each letter in English text, a to z
+ENGLISH_LETTER_FREQUENCIES = (
+    8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074,
+)
+# symbols the language model knows: the 26 letters, one class for every other character, and padding after the end of a message, which scores 0
+LETTER_CLASSES = 26
+OTHER_CLASS = 26
+PAD_CLASS = 27
+MODEL_CLASSES = 28
+# log probability of a character that is not a letter; messages are made of words only, so it is very unlikely
+OTHER_LOG_PROBABILITY = math.log(1e-4)
+# added for each upper case letter; the model ignores case, and this prefers the lower case of two decryptions that differ only in case
+UPPER_CASE_LOG_PROBABILITY = math.log(0.5)
+# weight of the letter frequencies against the trigrams, which carry most of the signal
+LETTER_FREQUENCY_WEIGHT = 0.5
+# key x message x character elements scored at once; bounds the memory of the largest keyspaces
+SCORE_CHUNK_ELEMENTS = 2_000_000
+
+class Alphabet:
+    """
+    Characters a cipher shifts and multiplies; the rest are left as they are
+    @param name: str - Name shown in rankings
+    @param characters: str - The alphabet in order; a character's position is what the cipher works on
+    @param foldCase: bool - Also treat upper case letters as their lower case position, and keep their case when decrypting (default: False)
+    """
+
+    def __init__(self, name: str, characters: str, foldCase: bool = False):
+        self.name = name
+        self.characters = characters
+        self.size = len(characters)
+        self.foldCase = foldCase
+        # encoded positions past the alphabet: characters outside it, and padding
+        self.outside: int = self.size
+        self.padding: int = self.size + 1
+        # character code -> position in the alphabet
+        self.positions = np.full(128, self.outside, dtype=np.int16)
+        for position, character in enumerate(characters):
+            self.positions[ord(character)] = position
+            if foldCase:
+                self.positions[ord(character.upper())] = position
+        self.keys = Keyspace(self.size)
+
+        # key x encoded position -> language model class of the character it decrypts to, and whether that is an upper case letter
+        plain = (self.keys.inverses[:, None] * (np.arange(self.size)[None] - self.keys.shifts[:, None])) % self.size
+        classes = np.array([ord(character.lower()) - ord('a') if 'a' <= character.lower() <= 'z' else OTHER_CLASS for character in characters], dtype=np.int16)
+        upper = np.array([character.isupper() for character in characters])
+        self.keyClasses = np.concatenate([classes[plain], np.full((len(self.keys), 1), OTHER_CLASS), np.full((len(self.keys), 1), PAD_CLASS)], axis=1).astype(np.int16)
+        self.keyUpper = np.concatenate([upper[plain], np.zeros((len(self.keys), 2), dtype=bool)], axis=1)
+
+    def __repr__(self) -> str:
+        return f"Alphabet Object: {self.name = }, {self.size = }, {len(self.keys) = }"
+
+    def encode(self, messages: list[str]) -> np.ndarray:
+        '''
+        @param messages: list[str] - Ciphertexts
+        @return: np.ndarray - Alphabet position of each character, messages x longest length; `outside` for characters outside the alphabet, `padding` after the end
+        '''
+        length: int = max((len(message) for message in messages), default=0)
+        positions = np.full((len(messages), length), self.padding, dtype=np.int16)
+        for row, message in enumerate(messages):
+            codes = np.frombuffer(message.encode('utf-32-le'), dtype=np.uint32)
+            positions[row, :len(codes)] = np.where(codes < 128, self.positions[np.minimum(codes, 127)], self.outside)
+        return positions
+
+    def decrypt(self, message: str, multiplier: int, shift: int) -> str:
+        '''
+        @return: str - The message decrypted with the key whose encryption is `(multiplier * x + shift) % size`
+        '''
+        inverse: int = pow(multiplier, -1, self.size)
+        characters: list[str] = []
+        for character in message:
+            position: int = int(self.positions[ord(character)]) if ord(character) < 128 else self.outside
+            if position == self.outside:
+                characters.append(character)
+                continue
+            plain: str = self.characters[(inverse * (position - shift)) % self.size]
+            characters.append(plain.upper() if self.foldCase and character.isupper() else plain)
+        return ''.join(characters)
+
+
+class Keyspace:
+    """
+    Every shift and affine key of an alphabet: encryption is `(multiplier * x + shift) % size`, a shift cipher has multiplier 1
+    @param size: int - Number of characters in the alphabet
+    """
+
+    def __init__(self, size: int):
+        multipliers: list[int] = [multiplier for multiplier in range(1, size) if math.gcd(multiplier, size) == 1]
+        self.multipliers = np.repeat(np.array(multipliers, dtype=np.int32), size)
+        self.shifts = np.tile(np.arange(size, dtype=np.int32), len(multipliers))
+        self.inverses = np.array([pow(int(multiplier), -1, size) for multiplier in self.multipliers], dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.multipliers)
+
+
+class LanguageModel:
+    """
+    Log probabilities of letters and letter trigrams, for scoring candidate plaintexts
+    @param letters: np.ndarray - Log probability of each model class
+    @param trigrams: np.ndarray - Log probability of each trigram of model classes, flattened to MODEL_CLASSES ** 3 entries
+    """
+
+    def __init__(self, letters: np.ndarray, trigrams: np.ndarray):
+        self.letters = letters.astype(np.float32)
+        self.trigrams = trigrams.astype(np.float32)
+        self.words: WordlistIndex | None = None
+        # alphabet name -> key x encoded position -> letter score of the character it decrypts to
+        self._letterTables: dict[str, np.ndarray] = {}
+
+    @classmethod
+    def fromWordlist(cls, wordlist: WordlistIndex, shuffles: int = 8, seed: int = 0) -> 'LanguageModel':
+        '''
+        Build the model from the word list messages are made of: English letter frequencies, and trigrams of the words run together in random order, like messages are
+        @param wordlist: WordlistIndex - Words messages are made of
+        @param shuffles: int - Number of random orders the trigrams are counted over, for the trigrams across word boundaries (default: 8)
+        @param seed: int - Seed of the random orders (default: 0)
+        @return: LanguageModel - The model, checking decryptions against `wordlist`
+        '''
+        words: list[str] = [word for word in wordlist.words if word.isalpha() and word.isascii()]
+
+        frequencies = np.array(ENGLISH_LETTER_FREQUENCIES, dtype=np.float64)
+        letters = np.full(MODEL_CLASSES, OTHER_LOG_PROBABILITY)
+        letters[:LETTER_CLASSES] = np.log(frequencies / frequencies.sum())
+        letters[PAD_CLASS] = 0
+
+        counts = np.zeros(LETTER_CLASSES ** 3, dtype=np.float64)
+        generator = random.Random(seed)
+        for _ in range(shuffles):
+            generator.shuffle(words)
+            text = np.frombuffer(''.join(words).encode(), dtype=np.uint8).astype(np.int64) - ord('a')
+            np.add.at(counts, text[:-2] * LETTER_CLASSES ** 2 + text[1:-1] * LETTER_CLASSES + text[2:], 1)
+        # add-half smoothing, so trigrams the vocabulary lacks are unlikely rather than impossible
+        letterTrigrams = np.log((counts + 0.5) / (counts.sum() + 0.5 * counts.size))
+
+        # trigrams with a character that is not a letter get the penalty of that character on top of the least likely letter trigram
+        trigrams = np.full((MODEL_CLASSES,) * 3, letterTrigrams.min() + OTHER_LOG_PROBABILITY)
+        trigrams[:LETTER_CLASSES, :LETTER_CLASSES, :LETTER_CLASSES] = letterTrigrams.reshape((LETTER_CLASSES,) * 3)
+        trigrams[PAD_CLASS, :, :] = trigrams[:, PAD_CLASS, :] = trigrams[:, :, PAD_CLASS] = 0
+        model = cls(letters, trigrams.reshape(-1))
+        model.words = wordlist
+        return model
+
+    def score(self, alphabet: Alphabet, messages: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Score every key of an alphabet against every message in one pass
+        @param alphabet: Alphabet - Alphabet whose keyspace is tried
+        @param messages: list[str] - Ciphertexts
+        @return: tuple[np.ndarray, np.ndarray] - Log likelihood of each message decrypted with each key (messages x keys), and the characters scored per message
+        '''
+        positions = alphabet.encode(messages)
+        count, length = positions.shape
+        # letter scores do not depend on order: count each position per message, and multiply with the score of each key's decryption of it
+        width: int = alphabet.size + 2
+        counts = np.bincount((np.arange(count)[:, None] * width + positions).ravel(), minlength=count * width).reshape(count, width).astype(np.float32)
+        scores = LETTER_FREQUENCY_WEIGHT * (counts @ self.letterTable(alphabet).T)
+        if length >= 3:
+            step: int = max(1, SCORE_CHUNK_ELEMENTS // (count * length))
+            for start in range(0, len(alphabet.keys), step):
+                # keys x messages x characters: model class of each decrypted character; 28 ** 3 trigrams still fit in int16
+                classes = alphabet.keyClasses[start:start + step][:, positions]
+                trigramIndex = (classes[:, :, :-2] * MODEL_CLASSES + classes[:, :, 1:-1]) * MODEL_CLASSES + classes[:, :, 2:]
+                scores[:, start:start + step] += self.trigrams[trigramIndex].sum(axis=2).T
+        return scores, (positions != alphabet.padding).sum(axis=1)
+
+    def letterTable(self, alphabet: Alphabet) -> np.ndarray:
+        '''
+        @return: np.ndarray - Key x encoded position -> letter score of the character it decrypts to, case penalty included
+        '''
+        table = self._letterTables.get(alphabet.name)
+        if table is None:
+            table = self._letterTables[alphabet.name] = self.letters[alphabet.keyClasses] + UPPER_CASE_LOG_PROBABILITY * alphabet.keyUpper
+        return table
+
+
+class Cryptanalyst:
+    """
+    Ranks the shift and affine keys of each sender node from the messages it sends, as they come
+    @param model: LanguageModel - Scores candidate plaintexts
+    @param alphabets: list[Alphabet] | None - Alphabets to try (default: None, ALPHABETS)
+    @param halfLife: float - Messages after which a message's score counts half, so a team that changes its key is followed (default: 50)
+    @param queueSize: int - Live messages waiting to be analysed; more are dropped (default: 10000)
+    @param batchSize: int - Most live messages analysed in one pass (default: 256)
+    """
+
+    def __init__(self, model: LanguageModel, alphabets: list[Alphabet] | None = None, halfLife: float = 50, queueSize: int = 10000, batchSize: int = 256):
+        self.model = model
+        self.alphabets = alphabets or ALPHABETS
+        self.decay: float = 0.5 ** (1 / halfLife)
+        self.batchSize = batchSize
+        self._lock = threading.Lock()
+        # sender -> alphabet name -> summed score per key; sender -> characters scored and the latest messages, for samples
+        self._scores: dict[str, dict[str, np.ndarray]] = {}
+        self._characters: dict[str, float] = {}
+        self._latest: dict[str, collections.deque] = {}
+        self.analysed: int = 0
+        self.dropped: int = 0
+        self._queue: queue.Queue = queue.Queue(queueSize)
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        return f"Cryptanalyst Object: {len(self._scores) = }, {self.analysed = }, {self.dropped = }"
+
+    def feed(self, senders: list, messages: list[str]) -> None:
+        '''
+        Score a batch of messages and add the scores to their senders
+        @param senders: list - Sender of each message, e.g. its `from_node_id`
+        @param messages: list[str] - Ciphertexts
+        '''
+        bySender: dict[str, list[int]] = {}
+        for index, sender in enumerate(senders):
+            bySender.setdefault(str(sender), []).append(index)
+        scored = {alphabet.name: self.model.score(alphabet, messages) for alphabet in self.alphabets}
+
+        with self._lock:
+            for sender, indexes in bySender.items():
+                totals = self._scores.setdefault(sender, {alphabet.name: np.zeros(len(alphabet.keys)) for alphabet in self.alphabets})
+                characters: float = self._characters.get(sender, 0)
+                for index in indexes:
+                    for name, (scores, lengths) in scored.items():
+                        totals[name] *= self.decay
+                        totals[name] += scores[index]
+                    characters = characters * self.decay + lengths[index]
+                self._characters[sender] = characters
+                self._latest.setdefault(sender, collections.deque(maxlen=3)).extend(messages[index] for index in indexes)
+            self.analysed += len(messages)
+
+    def senders(self) -> list[str]:
+        with self._lock:
+            return list(self._scores)
+
+    def ranking(self, sender, top: int = 5) -> list[dict]:
+        '''
+        @param sender: Sender node, as fed
+        @param top: int - Number of keys to return
+        @return: list[dict] - Most likely keys, best first: alphabet, cipher, multiplier, shift, score (log likelihood per character),
+            margin over the next key, the latest message decrypted with the key, how plausible that is as a payload (0 to 1) and its words, if it splits into words of the list
+        '''
+        sender = str(sender)
+        with self._lock:
+            if sender not in self._scores:
+                return []
+            characters: float = max(self._characters[sender], 1e-9)
+            candidates: list[tuple[float, Alphabet, int]] = []
+            for alphabet in self.alphabets:
+                perCharacter = self._scores[sender][alphabet.name] / characters
+                best = np.argpartition(-perCharacter, min(top, len(perCharacter) - 1))[:top + 1]
+                candidates += [(float(perCharacter[key]), alphabet, int(key)) for key in best]
+            latest: str = self._latest[sender][-1]
+        candidates.sort(key=lambda candidate: -candidate[0])
+
+        ranking: list[dict] = []
+        for rank, (score, alphabet, key) in enumerate(candidates[:top]):
+            multiplier, shift = int(alphabet.keys.multipliers[key]), int(alphabet.keys.shifts[key])
+            sample: str = alphabet.decrypt(latest, multiplier, shift)
+            ranking.append({
+                'alphabet': alphabet.name,
+                'cipher': 'shift' if multiplier == 1 else 'affine',
+                'multiplier': multiplier,
+                'shift': shift,
+                'score': round(score, 3),
+                'margin': round(score - candidates[rank + 1][0], 3) if rank + 1 < len(candidates) else None,
+                'sample': sample,
+                'plausibility': round(self.model.words.plausibility(sample), 2) if self.model.words else None,
+                'words': self.model.words.segment(sample) if self.model.words else None,
+            })
+        return ranking
+
+    def rankings(self, top: int = 3) -> dict[str, list[dict]]:
+        '''
+        @return: dict[str, list[dict]] - `ranking` of every sender seen
+        '''
+        return {sender: self.ranking(sender, top) for sender in self.senders()}
+
+    def submit(self, sender, message: str) -> None:
+        '''
+        Queue a live message for the background thread; dropped if the queue is full, so the caller never waits
+        '''
+        try:
+            self._queue.put_nowait((sender, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> 'Cryptanalyst':
+        '''
+        Analyse submitted messages in a background thread, a batch at a time
+        @return: Cryptanalyst - The same object
+        '''
+        self._thread = threading.Thread(target=self.__run, name='Cryptanalyst', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __run(self) -> None:
+        while True:
+            batch: list = [self._queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop: bool = None in batch
+            batch = [item for item in batch if item is not None and isinstance(item[1], str)]
+            if batch:
+                senders, messages = zip(*batch)
+                self.feed(list(senders), list(messages))
+            if stop:
+                return
+
+
+ALPHABETS = [
+    Alphabet('letters', 'abcdefghijklmnopqrstuvwxyz', foldCase=True),
+    Alphabet('printable', ''.join(chr(code) for code in range(0x20, 0x7f))),
+]
+
+def readMessages(files: Iterable[str]) -> Iterable[tuple[str, str]]:
+    '''
+    Mesh messages from files of board lines or of main_controller `--log-file` records
+    @param files: Iterable[str] - Files to read
+    @return: Iterable[tuple[str, str]] - Sender node ID and ciphertext of each message
+    '''
+    for file in files:
+        with open(file) as ifile:
+            for line in ifile:
+                try:
+                    document = json.loads(line)
+                except ValueError:
+                    continue
+                # log records keep the board line in 'data', or as text after the header
+                if isinstance(document, dict) and 'payload_type' not in document:
+                    document = document.get('data', document)
+                payload = document.get('payload') if isinstance(document, dict) else None
+                if document.get('payload_type', 'mesh') == 'mesh' and isinstance(payload, dict) and isinstance(payload.get('msg'), str):
+                    yield str(payload.get('from_node_id')), payload['msg']
+
+def demoMessages(count: int, wordlist: WordlistIndex, senders: int = 5, payloadWords: int = 5, seed: int = 1) -> tuple[list[tuple[str, str]], dict[str, tuple[str, int, int]]]:
+    '''
+    Messages like the command interface sends, from made up senders each with its own random key
+    @return: tuple[list[tuple[str, str]], dict[str, tuple[str, int, int]]] - Sender and ciphertext of each message, and the key of each sender
+    '''
+    generator = random.Random(seed)
+    keys: dict[str, tuple[str, int, int]] = {}
+    for index in range(senders):
+        alphabet = generator.choice(ALPHABETS)
+        key: int = generator.randrange(len(alphabet.keys))
+        keys[str(1000 + index)] = (alphabet.name, int(alphabet.keys.multipliers[key]), int(alphabet.keys.shifts[key]))
+    messages: list[tuple[str, str]] = []
+    for _ in range(count):
+        sender = generator.choice(list(keys))
+        name, multiplier, shift = keys[sender]
+        alphabet = next(alphabet for alphabet in ALPHABETS if alphabet.name == name)
+        plain: str = ''.join(wordlist.sample(payloadWords, generator))
+        cipher: str = ''.join(alphabet.characters[(multiplier * int(alphabet.positions[ord(character)]) + shift) % alphabet.size] for character in plain)
+        messages.append((sender, cipher))
+    return messages, keys
+
+if __name__ == '__main__':
+    import argparse
+
+    from Config import PAYLOAD_WORDS, WORDLIST_CACHE_FILE, WORDLIST_FILE
+
+    arg_parser = argparse.ArgumentParser(description='Rank the shift and affine keys of captured mesh messages per sender')
+    arg_parser.add_argument('files', nargs='*', help='JSON lines files of board lines or main_controller --log-file records')
+    arg_parser.add_argument('--demo', type=int, metavar='COUNT', help='analyse COUNT made up messages from senders with random keys instead')
+    arg_parser.add_argument('--top', type=int, default=3, help='keys shown per sender (default: 3)')
+    arg_parser.add_argument('--batch', type=int, default=256, help='messages scored per pass (default: 256)')
+    args = arg_parser.parse_args()
+
+    wordlist = WordlistIndex.load(WORDLIST_FILE, WORDLIST_CACHE_FILE)
+    analyst = Cryptanalyst(LanguageModel.fromWordlist(wordlist))
+    keys: dict = {}
+    if args.demo:
+        captured, keys = demoMessages(args.demo, wordlist, payloadWords=PAYLOAD_WORDS)
+    else:
+        captured = list(readMessages(args.files))
+    started: float = time.perf_counter()
+    for start in range(0, len(captured), args.batch):
+        senders, messages = zip(*captured[start:start + args.batch])
+        analyst.feed(list(senders), list(messages))
+    elapsed: float = time.perf_counter() - started
+    print(f"{len(captured)} messages from {len(analyst.senders())} senders analysed in {elapsed:.2f}s ({len(captured) / max(elapsed, 1e-9):.0f} messages/s)")
+
+    for sender, ranking in analyst.rankings(args.top).items():
+        print(f"\nSender {sender}" + (f" (actual key: {keys[sender]})" if sender in keys else ''))
+        for candidate in ranking:
+            print(f"  {candidate['alphabet']:<9} {candidate['cipher']:<6} x{candidate['multiplier']:<3} +{candidate['shift']:<3} "
+                  f"score {candidate['score']:.3f} (+{candidate['margin']}), plausibility {candidate['plausibility']:.0%}: {' '.join(candidate['words'] or [candidate['sample']])}")
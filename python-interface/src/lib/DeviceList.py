@@ -1,84 +1,144 @@
 '''
-This file contains the list of ESPs allowed to be used for YSP workshop in form of a python dictionary with 'NodeID' as key and 'HardwareID' as value.
+This file contains the registry of ESPs allowed to be used for YSP workshop, mapping each board's 'NodeID' to its 'HardwareID'.
 The ESPs are identified by their NodeID, which is a unique identifier for each ESP.
 The NodeID is derived by converting last 32bits of the ESP's MAC address to base 10 (Decimal/int).
+
+The list itself lives in one file shared with the UI, `UserInterface/UI/public/nodeID.csv`, one `HardwareID,NodeID` row per board.
+Edit that file to add boards; running controllers pick the change up without a restart.
 '''
-AllowedDevicesNodeIDs: dict[int, int] = {
-    864076657: 0,
-    864076913: 1,
-    2365952225: 2,
-    864074501: 3,
-    864072381: 4,
-    3867413669: 5,
-    864041801: 6,
-    2365948837: 7,
-    864069593: 8,
-    864073565: 9,
-    2365949985: 10,
-    864077329: 11,
-    3867414565: 12,
-    864076945: 13,
-    3867413857: 14,
-    2365948089: 15,
-    3867413293: 16,
-    2365952577: 17,
-    2365952329: 18,
-    3867421645: 19,
-    864040541: 20,
-    864077385: 21,
-    3867412793: 22,
-    2365951949: 23,
-    3867411913: 24,
-    2365951113: 25,
-    864073801: 26,
-    3867413889: 27,
-    3867411781: 28,
-    3867410537: 29,
-    3867413665: 30,
-    864065333: 31,
-    864060077: 32,
-    864061849: 33,
-    3867410645: 34,
-    864070781: 35,
-    2365947425: 36,
-    864072973: 37,
-    2365949265: 38,
-    2365947517: 39,
-    3867410601: 40,
-    864060597: 41,
-    3867413809: 42,
-    864072769: 43,
-    2365949373: 44,
-    2365944413: 45,
-    2365950521: 46,
-    3867414557: 47,
-    2365951497: 48,
-    864069165: 49,
-    2365952357: 50,
-    864065361: 51,
-    2365951869: 52,
-    864060033: 53,
-    864060877: 54,
-    2365949461: 55,
-    2365947113: 56,
-    3867412585: 57,
-    2365947765: 58,
-    3867413037: 59,
-    2365952105: 60,
-    864071897: 61,
-    2365952397: 62,
-    2365946201: 63,
-    864075961: 64,
-    3867414265: 65,
-    2365951697: 66,
-    2365952661: 67,
-    2365950961: 68,
-    864063689: 69,
-    3867411805: 70,
-    2365944825: 71,
-    2365952805: 72,
-    2365949769: 73,
-    864060237: 74,
-    2365951381: 75,
-    864070425: 76
-}
+import csv
+import json
+import os
+import threading
+import time
+
+from collections.abc import Iterator, Mapping
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+DEVICE_REGISTRY_FILE = os.path.join(REPO_DIR, 'UserInterface', 'UI', 'public', 'nodeID.csv')
+
+def nodeIDFromSerialNumber(serialNumber: str) -> int:
+    '''
+    Find the Node ID of a board from the MAC address it reports as its USB serial number
+    @param serialNumber: str - Serial number of the board, a colon separated MAC address
+    @return: int - Node ID of the board
+    @raise IndexError | ValueError: if the serial number is not a MAC address
+    '''
+    partialMAC: list[str] = serialNumber.split(':')[-4:]
+    return int(''.join(partialMAC), 16) + 1
+
+
+class DeviceRegistry(Mapping):
+    """
+    Allowed boards loaded from a CSV (`HardwareID,NodeID` rows) or JSON (`{"NodeID": HardwareID}`) file.
+    Behaves as a read-only {NodeID: HardwareID} dictionary, and also looks boards up by Hardware Index and serial number.
+    The file is checked for changes at most once every `checkInterval` seconds and reloaded when it changes.
+    @param path: str - File to load the boards from
+    @param checkInterval: float - Minimum seconds between checks of the file's modification time (default: 1s)
+    """
+
+    def __init__(self, path: str, checkInterval: float = 1.0):
+        self.path = path
+        self.checkInterval = checkInterval
+        self._lock = threading.Lock()
+        self._mtime: float | None = None
+        self._nextCheck: float = 0
+        # both maps are replaced together on reload, so readers never see one without the other
+        self._maps: tuple[dict[int, int], dict[int, int]] = ({}, {})
+        self.reload()
+
+    def __repr__(self) -> str:
+        return f"DeviceRegistry Object: {self.path = }, Boards: {len(self)}"
+
+    def __load(self) -> dict[int, int]:
+        '''
+        Private method to read the registry file
+        @return: dict[int, int] - NodeID to HardwareID
+        '''
+        if self.path.endswith('.json'):
+            with open(self.path) as ifile:
+                return {int(nodeID): int(hardwareIndex) for nodeID, hardwareIndex in json.load(ifile).items()}
+        devices: dict[int, int] = {}
+        with open(self.path, newline='') as ifile:
+            for row in csv.reader(ifile):
+                # skip blank lines and an optional header
+                if len(row) < 2 or not row[0].strip().isdigit() or not row[1].strip().isdigit():
+                    continue
+                devices[int(row[1])] = int(row[0])
+        return devices
+
+    def reload(self) -> bool:
+        '''
+        Read the registry file again if it changed since the last load
+        @return: bool - True if the registry was reloaded
+        '''
+        with self._lock:
+            self._nextCheck = time.monotonic() + self.checkInterval
+            try:
+                mtime: float = os.stat(self.path).st_mtime
+            except OSError as e:
+                if self._mtime is None:
+                    print(f"Device registry {self.path} not found: {e}")
+                    self._mtime = 0
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                devices = self.__load()
+            except (OSError, ValueError, AttributeError) as e:
+                # keep serving the previous list if the file is mid-edit or broken
+                print(f"Could not load device registry {self.path}: {e}")
+                return False
+            self._mtime = mtime
+            self._maps = (devices, {hardwareIndex: nodeID for nodeID, hardwareIndex in devices.items()})
+            return True
+
+    def __current(self) -> tuple[dict[int, int], dict[int, int]]:
+        '''
+        Private method to get the maps, reloading the file first if it is due for a check
+        '''
+        if time.monotonic() >= self._nextCheck:
+            self.reload()
+        return self._maps
+
+    def __getitem__(self, nodeID: int) -> int:
+        return self.__current()[0][nodeID]
+
+    def __contains__(self, nodeID: object) -> bool:
+        return nodeID in self.__current()[0]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.__current()[0])
+
+    def __len__(self) -> int:
+        return len(self.__current()[0])
+
+    def hardwareIndexOf(self, nodeID: int) -> int | None:
+        '''
+        @param nodeID: int - Node ID of the board
+        @return: int | None - Hardware Index of the board, or None if it is not allowed
+        '''
+        return self.__current()[0].get(nodeID)
+
+    def nodeIDOf(self, hardwareIndex: int) -> int | None:
+        '''
+        @param hardwareIndex: int - Number written on the board
+        @return: int | None - Node ID of the board, or None if no allowed board has that Hardware Index
+        '''
+        return self.__current()[1].get(hardwareIndex)
+
+    def lookupSerialNumber(self, serialNumber: str) -> tuple[int, int] | None:
+        '''
+        @param serialNumber: str - USB serial number (MAC address) reported by the board
+        @return: tuple[int, int] | None - (Node ID, Hardware Index) of the board, or None if it is not allowed or the serial number is not a MAC address
+        '''
+        try:
+            nodeID: int = nodeIDFromSerialNumber(serialNumber)
+        except (IndexError, ValueError):
+            return None
+        hardwareIndex: int | None = self.hardwareIndexOf(nodeID)
+        return None if hardwareIndex is None else (nodeID, hardwareIndex)
+
+
+# NodeID -> HardwareID of every allowed board, kept up to date with the registry file
+AllowedDevicesNodeIDs: DeviceRegistry = DeviceRegistry(DEVICE_REGISTRY_FILE)
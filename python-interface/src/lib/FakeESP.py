@@ -0,0 +1,375 @@
+'''
+Module to stand in for a development board when none is connected.
+FakeESP opens a pseudo-terminal and answers the JSON commands of the general-node firmware (`SerialInterface::processSerial`) on it,
+so the controller can attach to it with DeviceIdentifierType.PORT and be tested or loaded without hardware. POSIX only.
+
+Run it on its own and point the controller at the port it prints:
+    python FakeESP.py --latency 0.02 --loss 0.01
+    python main_controller.py --port /dev/pts/5
+'''
+import json
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+
+from typing import Callable
+
+from SerialCodec import FRAME_DELIMITER, MAX_COMMAND_FRAME, decodeFrame, encodeFrame
+
+class FakeESP:
+    """
+    Simulated board running the general-node firmware, behind a pseudo-terminal.
+    Like the firmware it reads one command line at a time, answers by echoing the command with a 'response' added,
+    prints `Invalid Command` for anything it does not understand and drops what it receives while booting.
+    After `set-encoding msgpack` it answers in MessagePack frames (see SerialCodec) until it restarts; it reads both encodings at any time.
+    `set-baud` switches the throttle to the new rate, and back unless the host asks for it again within the confirmation window.
+    @param nodeID: int - Node ID the board reports as its own (default: 1)
+    @param topology: dict | Callable[[], dict] | None - Nested `{nodeId, subs}` tree answered to topology commands, or a function returning the current one (default: None, the board alone)
+    @param latency: float - Seconds the board takes to answer each command (default: 0)
+    @param jitter: float - Up to this many seconds are added at random to each answer (default: 0)
+    @param loss: float - Probability that a command is dropped without an answer (default: 0)
+    @param baudrate: int | None - Line rate both directions are throttled to, at 10 bits per byte; None for no throttling (default: 115200)
+    @param bootTime: float - Seconds the board spends booting on start and on `esp-reset`; the firmware uses 5s (default: 0)
+    @param roomID: int - Room ID the board starts with (default: 0)
+    @param baseSSID: str - Base network SSID the board starts with (default: 'ysp')
+    @param basePassword: str - Base network password the board starts with (default: 'password')
+    @param seed: int | None - Seed for the latency and loss draws, for repeatable runs (default: None)
+    @param maxBaudrate: int | None - Fastest rate the simulated USB bridge carries; at faster ones the board reads only garbage, as when the rates do not match (default: None, all of SUPPORTED_BAUD_RATES)
+    """
+    # like `setBaudRate` in serial_interface.cpp
+    SUPPORTED_BAUD_RATES: tuple[int, ...] = (115200, 230400, 460800, 921600)
+    BAUD_CONFIRM_TIMEOUT: float = 2
+
+    def __init__(self, nodeID: int = 1, topology: dict | Callable[[], dict] | None = None, latency: float = 0, jitter: float = 0, loss: float = 0,
+                 baudrate: int | None = 115200, bootTime: float = 0, roomID: int = 0, baseSSID: str = 'ysp', basePassword: str = 'password', seed: int | None = None,
+                 maxBaudrate: int | None = None):
+        self.nodeID = nodeID
+        self.topology: dict | Callable[[], dict] = topology if topology is not None else {'nodeId': nodeID, 'subs': []}
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.baudrate = baudrate
+        self.maxBaudrate = maxBaudrate
+        self._startBaudrate: int | None = baudrate
+        # rate agreed with the host, and the one switched to but not confirmed yet, with its deadline
+        self.lineRate: int = 115200
+        self._pendingRate: int | None = None
+        self._rateDeadline: float = 0
+        self.bootTime = bootTime
+        self.roomID = roomID
+        self.baseSSID = baseSSID
+        self.basePassword = basePassword
+        self._random = random.Random(seed)
+        # commands answered and dropped, and mesh messages sent, for load tests to check against
+        self.answered: int = 0
+        self.dropped: int = 0
+        self.sent: list[dict] = []
+        self._master, self._slave = pty.openpty()
+        # no echo and no newline translation on either side, like a USB serial device
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port: str = os.ttyname(self._slave)
+        self._writeLock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._bootedAt: float = 0
+        # 'json' or 'msgpack', like the firmware's compactEncoding; back to 'json' on every boot
+        self.encoding: str = 'json'
+        # line time spent sending since the host's bytes were last read
+        self._txTime: float = 0
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self) -> str:
+        return f"FakeESP Object: {self.port = }, {self.nodeID = }, {self.latency = }, {self.loss = }, {self.baudrate = }, {self.answered = }, {self.dropped = }"
+
+    def __enter__(self) -> 'FakeESP':
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def start(self) -> 'FakeESP':
+        '''
+        Boot the board and start answering commands in a background thread
+        @return: FakeESP - The same object, so it can be created and started in one line
+        '''
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self.__run, name=f'FakeESP-{self.nodeID}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop answering and close the pseudo-terminal
+        '''
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def sendLiveMessage(self, payload: dict) -> None:
+        '''
+        Print a mesh message as if another node had sent it to this board (`SerialInterface::displayLiveMessage`)
+        @param payload: dict - Message payload: from_node_id, to_node_id, HEX and msg
+        '''
+        self.__write({'payload_type': 'mesh', 'payload': payload})
+
+    def __throttle(self, size: int) -> None:
+        '''
+        Private method to hold the line for as long as `size` bytes take at the configured baud rate
+        '''
+        if self.baudrate:
+            time.sleep(size * 10 / self.baudrate)
+
+    def __writeRaw(self, data: bytes) -> None:
+        with self._writeLock:
+            # in small chunks so the host sees a long answer arrive over time, as it does from a real board
+            for start in range(0, len(data), 64):
+                chunk = data[start:start + 64]
+                try:
+                    os.write(self._master, chunk)
+                except OSError:
+                    return
+                self.__throttle(len(chunk))
+                if self.baudrate:
+                    self._txTime += len(chunk) * 10 / self.baudrate
+
+    def __write(self, document: dict) -> None:
+        '''
+        Private method to print a document the way `SerialInterface::send` does: serializeJson followed by println, or a MessagePack frame
+        '''
+        if self.encoding == 'msgpack':
+            self.__writeRaw(encodeFrame(document))
+        else:
+            self.__writeRaw(json.dumps(document, separators=(',', ':')).encode() + b'\r\n')
+
+    def __boot(self) -> None:
+        '''
+        Private method to go through the firmware's delayed boot; anything received meanwhile is lost
+        '''
+        deadline: float = time.monotonic() + self.bootTime
+        self.__writeRaw(FRAME_DELIMITER)
+        while not self._stopEvent.is_set() and time.monotonic() < deadline:
+            self.__writeRaw(b'. ')
+            self._stopEvent.wait(min(1, max(0, deadline - time.monotonic())))
+        self.encoding = 'json'
+        self.lineRate = 115200
+        self.baudrate = self._startBaudrate
+        self._pendingRate = None
+        self.__writeRaw(b'Starting Node...' + FRAME_DELIMITER + b'\n')
+        self._bootedAt = time.monotonic()
+
+    def __run(self) -> None:
+        '''
+        Private method to read commands line by line and answer them until stopped
+        '''
+        self.__boot()
+        buffer = bytearray()
+        while not self._stopEvent.is_set():
+            if self._pendingRate is not None and time.monotonic() >= self._rateDeadline:
+                # not confirmed in time; what came meanwhile was garbage
+                self.__switchRate(self.lineRate)
+                self._pendingRate = None
+                buffer.clear()
+            try:
+                ready, _, _ = select.select([self._master], [], [], 0.1)
+                if not ready:
+                    continue
+                data: bytes = os.read(self._master, 4096)
+            except OSError:
+                # the host side is not open; wait for it to come back
+                self._stopEvent.wait(0.1)
+                continue
+            if self._pendingRate is not None and self.maxBaudrate and self._pendingRate > self.maxBaudrate:
+                # the bridge cannot carry this rate; nothing the host sends is readable
+                continue
+            if self.baudrate:
+                # the line is full duplex: what arrived while the last answers went out took no extra time
+                time.sleep(max(0, len(data) * 10 / self.baudrate - self._txTime))
+                self._txTime = 0
+            buffer += data
+            while (command := self.__nextCommand(buffer)) is not None:
+                if self.__process(command) == 'reset':
+                    buffer.clear()
+                    self.__boot()
+                    # the UART buffer does not survive the restart
+                    self.__drain()
+
+    def __switchRate(self, rate: int) -> None:
+        '''
+        Private method to change the line rate, and the throttle with it unless throttling is off
+        '''
+        if self._startBaudrate:
+            self.baudrate = rate
+
+    def __nextCommand(self, buffer: bytearray) -> dict | str | None:
+        '''
+        Private method to take the next complete command off the receive buffer, like `SerialInterface::readCommand`
+        @param buffer: bytearray - Bytes received and not read yet; the command is removed from it
+        @return: dict | str | None - A decoded frame ({} if malformed), a line, or None until a whole command has arrived
+        '''
+        if buffer[:1] != FRAME_DELIMITER:
+            line, newline, rest = bytes(buffer).partition(b'\n')
+            if not newline:
+                return None
+            buffer[:] = rest
+            return line.decode(errors='replace').strip()
+        while buffer[:2] == FRAME_DELIMITER * 2:
+            # the zero taken as opening delimiter closed a frame read only in part
+            del buffer[:1]
+        end: int = buffer.find(FRAME_DELIMITER, 1)
+        if end == -1:
+            return None
+        frame: bytes = bytes(buffer[1:end])
+        del buffer[:end + 1]
+        if len(frame) > MAX_COMMAND_FRAME:
+            return {}
+        try:
+            return decodeFrame(frame)
+        except ValueError:
+            return {}
+
+    def __drain(self) -> None:
+        '''
+        Private method to discard whatever the host sent while the board was booting
+        '''
+        while select.select([self._master], [], [], 0)[0]:
+            try:
+                os.read(self._master, 4096)
+            except OSError:
+                return
+
+    def __process(self, line: dict | str) -> str | None:
+        '''
+        Private method to answer one command, like `SerialInterface::processSerial`
+        @param line: dict | str - Line received from the host, without the newline, or a decoded frame
+        @return: str | None - 'reset' if the board restarted
+        '''
+        try:
+            document = json.loads(line) if isinstance(line, str) else line
+            payload: dict = document['payload']
+            command = payload['cmd']
+        except (ValueError, TypeError, KeyError):
+            self.__writeRaw(b'Invalid Command\r\n')
+            return None
+
+        if self.loss and self._random.random() < self.loss:
+            self.dropped += 1
+            return None
+        delay: float = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            self._stopEvent.wait(delay)
+
+        match command:
+            case 'ping':
+                message = {'payload_type': 'mesh', 'payload': {
+                    'from_node_id': self.nodeID,
+                    'to_node_id': payload.get('to_node_id'),
+                    'HEX': payload.get('HEX'),
+                    'msg': payload.get('msg'),
+                }}
+                self.sent.append(message['payload'])
+                response: dict = message
+            case 'capture-topology' | 'topology':
+                response = self.topology() if callable(self.topology) else self.topology
+            case 'set-room-id':
+                try:
+                    self.roomID = int(payload.get('room_id', 0)) & 0xFF
+                except (ValueError, TypeError):
+                    self.roomID = 0
+                response = {'success': True, 'room_id': self.roomID}
+            case 'set-base-network-credentials':
+                self.baseSSID = str(payload.get('base_ssid'))
+                self.basePassword = str(payload.get('base_password'))
+                response = {'success': True, 'base_ssid': self.baseSSID, 'base_password': self.basePassword}
+            case 'get-room-id':
+                response = {'room_id': self.roomID}
+            case 'get-wireless-credentials':
+                response = {'ssid': f'{self.baseSSID}-{self.roomID}', 'password': f'{self.basePassword}{self.roomID}'}
+            case 'get-base-network-credentials':
+                response = {'base_ssid': self.baseSSID, 'base_password': self.basePassword}
+            case 'set-encoding':
+                encoding = payload.get('encoding')
+                known: bool = encoding in ('json', 'msgpack')
+                response = {'success': known, 'encoding': encoding if known else self.encoding}
+                # the answer still goes out in the old encoding
+                payload['response'] = response
+                self.__write(document)
+                self.answered += 1
+                if known:
+                    self.encoding = encoding
+                return None
+            case 'set-baud':
+                try:
+                    rate = int(payload.get('baud', 0))
+                except (ValueError, TypeError):
+                    rate = 0
+                if self._pendingRate is not None and rate == self._pendingRate:
+                    # read at the new rate, so it works both ways
+                    self.lineRate = rate
+                    self._pendingRate = None
+                    response = {'success': True, 'baud': rate}
+                else:
+                    supported: bool = rate in self.SUPPORTED_BAUD_RATES
+                    payload['response'] = {'success': supported, 'baud': rate if supported else self.lineRate}
+                    # the answer still goes out at the old rate
+                    self.__write(document)
+                    self.answered += 1
+                    if supported and rate != self.lineRate:
+                        self.__switchRate(rate)
+                        self._pendingRate = rate
+                        self._rateDeadline = time.monotonic() + self.BAUD_CONFIRM_TIMEOUT
+                    return None
+            case 'esp-reset':
+                return 'reset'
+            case _:
+                self.__writeRaw(b'Invalid Command\r\n')
+                return None
+
+        payload['response'] = response
+        try:
+            self.__write(document)
+        except RecursionError:
+            # trees hundreds of hops deep nest past what the json module can encode; a real board runs out of memory instead
+            print(f"FakeESP {self.nodeID}: answer to `{command}` is nested too deep to serialize")
+            return None
+        self.answered += 1
+        return None
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Simulated development board on a pseudo-terminal')
+    arg_parser.add_argument('--node-id', type=int, default=1, help='node ID the board reports (default: 1)')
+    arg_parser.add_argument('--topology', metavar='FILE', help='JSON file with the nested {nodeId, subs} tree to report, e.g. esp-firmware/root-node/lib/data.json')
+    arg_parser.add_argument('--latency', type=float, default=0, help='seconds to answer each command (default: 0)')
+    arg_parser.add_argument('--jitter', type=float, default=0, help='extra random seconds per answer, up to this much (default: 0)')
+    arg_parser.add_argument('--loss', type=float, default=0, help='probability of dropping a command (default: 0)')
+    arg_parser.add_argument('--baudrate', type=int, default=115200, help='line rate to throttle to; 0 for no throttling (default: 115200)')
+    arg_parser.add_argument('--max-baudrate', type=int, help='fastest rate the simulated USB bridge carries; faster ones fail to confirm (default: all supported)')
+    arg_parser.add_argument('--boot-time', type=float, default=0, help='seconds spent booting on start and reset (default: 0)')
+    args = arg_parser.parse_args()
+
+    topology = None
+    if args.topology:
+        with open(args.topology) as ifile:
+            topology = json.load(ifile)
+
+    fake = FakeESP(nodeID=args.node_id, topology=topology, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                   baudrate=args.baudrate or None, bootTime=args.boot_time, maxBaudrate=args.max_baudrate)
+    fake.start()
+    print(f"Fake ESP32 with node ID {fake.nodeID} listening on {fake.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\n{fake}")
+        fake.stop()
@@ -0,0 +1,89 @@
+'''
+Module for the flow control of commands to a board.
+The firmware handles one command per `loop()` and has no other way to say it is falling behind, so its answers are the acknowledgements:
+AckWindow keeps as many commands in flight as the board answers without them queueing up, like a TCP congestion window driven by delay.
+'''
+import threading
+
+class AckWindow:
+    """
+    Number of unanswered commands allowed in flight to one board, adapted to how fast it answers.
+    Each command is timed against the quickest answer seen for commands of its kind. While answers come back within `tolerance`
+    times that, the board keeps up and the window grows by one command per window of answers; slower answers mean commands are
+    waiting in the board, and the window shrinks by a quarter, at most once per window of answers. A timeout halves it.
+    @param initial: int - Window to start with
+    @param minimum: int - Smallest window (default: 1)
+    @param maximum: int - Largest window (default: 16)
+    @param byteLimit: int - Bytes of unanswered commands allowed on the way, to stay within the board's receive buffer (default: 1024)
+    @param tolerance: float - Latency over the quickest seen, as a ratio, above which the board counts as backed up (default: 2)
+    @param slack: float - Seconds of latency over the quickest seen that never count as backed up, for jitter on fast answers (default: 0.005)
+    """
+    # how much of the gap to a slower answer the quickest latency takes on, so it follows a link that got slower for good
+    BASE_DRIFT: float = 0.01
+    DECREASE: float = 0.75
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 16, byteLimit: int = 1024, tolerance: float = 2, slack: float = 0.005):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.byteLimit = byteLimit
+        self.tolerance = tolerance
+        self.slack = slack
+        self.size: float = float(min(max(initial, minimum), maximum))
+        # quickest answer seen, by command name
+        self.baseLatency: dict[str, float] = {}
+        # request timeouts since the last answer
+        self.consecutiveTimeouts: int = 0
+        self._sinceDecrease: int = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"AckWindow Object: {self.limit = }, {self.size = }, {self.consecutiveTimeouts = }, {self.baseLatency = }"
+
+    @property
+    def limit(self) -> int:
+        '''
+        @return: int - Commands allowed in flight right now
+        '''
+        return int(self.size)
+
+    def acknowledge(self, command: str, latency: float) -> None:
+        '''
+        Account for an answer from the board
+        @param command: str - Name of the command answered, e.g. 'ping_node'
+        @param latency: float - Seconds from pushing the command to its answer
+        '''
+        with self._lock:
+            self.consecutiveTimeouts = 0
+            base: float | None = self.baseLatency.get(command)
+            if base is None or latency < base:
+                base = latency
+            else:
+                base += (latency - base) * self.BASE_DRIFT
+            self.baseLatency[command] = base
+            self._sinceDecrease += 1
+
+            if latency <= base * self.tolerance + self.slack:
+                self.size = min(self.maximum, self.size + 1 / self.size)
+            elif self._sinceDecrease >= self.limit:
+                self.size = max(self.minimum, self.size * self.DECREASE)
+                self._sinceDecrease = 0
+
+    def timedOut(self) -> None:
+        '''
+        Account for a command the board did not answer in time
+        '''
+        with self._lock:
+            self.consecutiveTimeouts += 1
+            self.size = max(self.minimum, self.size / 2)
+            self._sinceDecrease = 0
+
+    def reset(self, initial: int) -> None:
+        '''
+        Start over after the link changed, e.g. to another baud rate; the latencies seen before no longer apply
+        @param initial: int - Window to start with
+        '''
+        with self._lock:
+            self.size = float(min(max(initial, self.minimum), self.maximum))
+            self.baseLatency.clear()
+            self.consecutiveTimeouts = 0
+            self._sinceDecrease = 0
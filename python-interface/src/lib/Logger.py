@@ -1,4 +1,10 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+import time
 import colorama
 from colorama import Fore, Style
 
@@ -12,29 +18,227 @@ class ColorizedLoggingHandler(logging.StreamHandler):
         'DEBUG': Fore.WHITE + Style.NORMAL,
     }
 
+    def __init__(self, stream=None, colors=None):
+        super().__init__(stream)
+        if colors is not None:
+            self.colors = colors
+
+    def colorize(self, record):
+        color = self.colors.get(record.levelname, Fore.WHITE)
+        return color + self.format(record) + colorama.Style.RESET_ALL + '\n'
+
     def emit(self, record):
         try:
-            msg = self.format(record)
-            levelname = record.levelname
-            color = self.colors.get(levelname, Fore.WHITE)
             stream = self.stream
-            stream.write(color + msg + colorama.Style.RESET_ALL + '\n')
+            stream.write(self.colorize(record))
             stream.flush()
         except Exception:
             self.handleError(record)
 
-def get_logger(name='ColorLogger', level = logging.DEBUG):
+    def emit_batch(self, records):
+        # one write and one flush for the lot; the terminal is the slow part
+        lines = []
+        for record in records:
+            if not self.filter(record):
+                continue
+            try:
+                lines.append(self.colorize(record))
+            except Exception:
+                self.handleError(record)
+        for log_filter in self.filters:
+            if isinstance(log_filter, RateLimitFilter):
+                lines.extend(Fore.WHITE + note + colorama.Style.RESET_ALL + '\n' for note in log_filter.suppressed_notes())
+        if not lines:
+            return
+        with self.lock:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+
+def get_logger(name='ColorLogger', level = logging.DEBUG, formatter=None, colors=None):
     logger = logging.getLogger(name)
     if not logger.handlers:
         logger.setLevel(level)  # Set the default log level
-        ch = ColorizedLoggingHandler()
-        formatter = logging.Formatter('%(levelname)s: %(message)s')
-        if level == logging.DEBUG:
-            formatter = logging.Formatter('%(levelname)s: [%(funcName)s:%(lineno)d] %(message)s')
+        ch = ColorizedLoggingHandler(colors=colors)
+        if formatter is None:
+            formatter = logging.Formatter('%(levelname)s: %(message)s')
+            if level == logging.DEBUG:
+                formatter = logging.Formatter('%(levelname)s: [%(funcName)s:%(lineno)d] %(message)s')
         ch.setFormatter(formatter)
         logger.addHandler(ch)
     return logger
 
+class LazyJSON:
+    """
+    Log message that is serialized with indent=2 only when a handler formats it, so with queued logging the work happens on the logging thread
+    The data must not be changed after it is logged
+    """
+    __slots__ = ('header', 'data')
+
+    def __init__(self, data, header=''):
+        self.header = header
+        self.data = data
+
+    def __str__(self):
+        text = json.dumps(self.data, indent=2)
+        return f'{self.header}\n{text}' if self.header else text
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message and the `kind` and `data` extras when given.
+    Records with `data` keep it structured instead of the pretty printed message
+    """
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'logger': record.name}
+        kind = getattr(record, 'kind', None)
+        if kind is not None:
+            entry['kind'] = kind
+        if hasattr(record, 'data'):
+            entry['data'] = record.data
+        else:
+            entry['message'] = record.getMessage()
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rates[kind]` records per second of each listed kind (the `kind` extra of a record); other records always pass.
+    Suppressed records are counted and reported by `suppressed_notes`
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        # kind -> [tokens, last refill time, suppressed since the last note, time of the last note]
+        self._buckets = {}
+
+    def filter(self, record):
+        kind = getattr(record, 'kind', None)
+        rate = self.rates.get(kind)
+        if rate is None:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(kind, [rate, now, 0, now])
+        bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        bucket[2] += 1
+        return False
+
+    def suppressed_notes(self, interval=1.0):
+        # at most one note per kind every `interval` seconds
+        notes = []
+        now = time.monotonic()
+        for kind, bucket in self._buckets.items():
+            if bucket[2] and now - bucket[3] >= interval:
+                notes.append(f'[logging] {bucket[2]} {kind} lines not shown, console shows at most {self.rates[kind]:g}/s')
+                bucket[2] = 0
+                bucket[3] = now
+        return notes
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without ever blocking the logging thread; records that do not fit are counted in `dropped`
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting waits for the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class QueueLogListener:
+    """
+    Thread that takes queued records in batches and hands them to the handlers of the logger each came from, plus `common_handlers` for every record
+    """
+    _sentinel = None
+
+    def __init__(self, log_queue, routes, common_handlers=(), batch_size=256):
+        self.queue = log_queue
+        self.routes = routes
+        self.common_handlers = list(common_handlers)
+        self.batch_size = batch_size
+        self.queue_handlers = []
+        self._thread = None
+
+    def dropped(self):
+        # records lost because the queue was full
+        return sum(handler.dropped for handler in self.queue_handlers)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name='QueueLogListener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # everything logged before this is written out first
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+        for handler in self.common_handlers:
+            handler.close()
+
+    def handle_batch(self, records):
+        handlers = {}
+        for record in records:
+            for handler in self.routes.get(record.name, []) + self.common_handlers:
+                if record.levelno >= handler.level:
+                    handlers.setdefault(handler, []).append(record)
+        for handler, handler_records in handlers.items():
+            if hasattr(handler, 'emit_batch'):
+                handler.emit_batch(handler_records)
+            else:
+                for record in handler_records:
+                    handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not self._sentinel and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is self._sentinel
+            self.handle_batch([record for record in batch if record is not self._sentinel])
+            if stop:
+                return
+
+def start_queue_logging(loggers, log_file=None, console_rates=None, queue_size=10000, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    Move the handlers of `loggers` to a background thread, so logging never blocks on the terminal or the disk.
+    Optionally also writes every record as JSON lines to a rotating `log_file`, and limits what the console shows of high volume kinds to `console_rates` ({kind: records per second}).
+    Returns the listener; it is stopped, and the queue written out, at exit
+    """
+    log_queue = queue.Queue(queue_size)
+    routes = {}
+    for logger in loggers:
+        routes[logger.name] = list(logger.handlers)
+        for handler in routes[logger.name]:
+            logger.removeHandler(handler)
+            if console_rates and isinstance(handler, ColorizedLoggingHandler):
+                handler.addFilter(RateLimitFilter(console_rates))
+        logger.addHandler(DroppingQueueHandler(log_queue))
+    common_handlers = []
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        file_handler.setFormatter(JsonLinesFormatter())
+        common_handlers.append(file_handler)
+    listener = QueueLogListener(log_queue, routes, common_handlers)
+    listener.queue_handlers = [logger.handlers[-1] for logger in loggers]
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 def pprint(message, end='\n'):
     print(Fore.CYAN + message + Style.RESET_ALL, end=end)
 
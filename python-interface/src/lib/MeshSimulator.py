@@ -0,0 +1,478 @@
+'''
+Module to simulate a whole mesh behind one board, to see how the host side copes with meshes far larger than the workshop's.
+MeshSimulator grows a painlessMesh-like tree of virtual nodes behind a FakeESP root: topology commands report the whole tree,
+nodes join and leave, and every node's broadcasts reach the root's serial port as live mesh messages after a delay per hop.
+
+Run it on its own to find where the host side saturates; main_controller.py runs against each mesh and reports from its own metrics:
+    python MeshSimulator.py --nodes 7700 --rates 100,1000,5000 --no-throttle
+'''
+import heapq
+import json
+import random
+import socket
+import threading
+import time
+
+from Config import CLIENT_REPLY_TIMEOUT, SERIAL_BAUD_RATES, SOCK_HOST, SOCK_PORT
+from FakeESP import FakeESP
+
+class MeshSimulator:
+    """
+    Tree of virtual nodes behind a FakeESP that plays the root.
+    Every node broadcasts messages like the firmware's `sendMeshMessageCallback`, so the root prints every message sent anywhere in the mesh.
+    @param size: int - Number of nodes, including the root (default: 77)
+    @param fanout: int - Most direct children a node accepts; 1 makes a chain (default: 4)
+    @param hopLatency: float - Seconds a message takes per mesh hop on its way to the root (default: 0.005)
+    @param messageRate: float - Messages per second sent across the whole mesh (default: 0)
+    @param churnRate: float - Nodes joining or leaving per second, on average (default: 0)
+    @param seed: int | None - Seed for the tree, traffic and churn, for repeatable runs (default: None)
+    @param fakeOptions: Further keyword arguments for the root's FakeESP, e.g. latency or baudrate
+    """
+
+    def __init__(self, size: int = 77, fanout: int = 4, hopLatency: float = 0.005, messageRate: float = 0, churnRate: float = 0, seed: int | None = None, **fakeOptions):
+        self.fanout = fanout
+        self.hopLatency = hopLatency
+        self.messageRate = messageRate
+        self.churnRate = churnRate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Node ID -> parent Node ID (None for the root) and children in join order
+        self.parents: dict[int, int | None] = {}
+        self.children: dict[int, list[int]] = {}
+        # nodes that still accept children, for O(1) picks on join
+        self._open: list[int] = []
+        self._depths: dict[int, int] | None = None
+        self._tree: dict | None = None
+        self._nodeList: list[int] | None = None
+        # (arrival time, sequence, sender) of messages still travelling to the root
+        self._inFlight: list[tuple[float, int, int]] = []
+        self._sequence: int = 0
+        self.delivered: int = 0
+        self.joined: int = 0
+        self.left: int = 0
+        self._stopEvent = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.root: int = self.__newNodeID()
+        self.parents[self.root] = None
+        self.children[self.root] = []
+        self._open.append(self.root)
+        for _ in range(size - 1):
+            self.__join()
+        self.fake = FakeESP(nodeID=self.root, topology=self.tree, seed=seed, **fakeOptions)
+
+    def __repr__(self) -> str:
+        return f"MeshSimulator Object: Root: {self.root}, Nodes: {len(self)}, {self.fanout = }, {self.messageRate = }, {self.churnRate = }, Delivered: {self.delivered}, In flight: {self.backlog}"
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    @property
+    def port(self) -> str:
+        '''
+        @return: str - Serial port of the root board, for DeviceIdentifierType.PORT
+        '''
+        return self.fake.port
+
+    @property
+    def backlog(self) -> int:
+        '''
+        @return: int - Messages sent in the mesh that have not reached the host yet, in the mesh or waiting for the root's serial line
+        '''
+        return len(self._inFlight)
+
+    def start(self) -> 'MeshSimulator':
+        '''
+        Start the root board, the traffic and the churn
+        @return: MeshSimulator - The same object
+        '''
+        self.fake.start()
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self.__run, name='MeshSimulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.fake.stop()
+
+    def __enter__(self) -> 'MeshSimulator':
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def __newNodeID(self) -> int:
+        '''
+        Private method to draw an unused Node ID; real ones are the low 32 bits of the MAC address
+        '''
+        while (nodeID := self._random.randrange(1, 2 ** 32)) in self.parents:
+            pass
+        return nodeID
+
+    def __changed(self) -> None:
+        self._depths = self._tree = self._nodeList = None
+
+    def __join(self) -> int:
+        '''
+        Private method to add a node under a random node that has room for it
+        @return: int - Node ID of the new node
+        '''
+        index: int = self._random.randrange(len(self._open))
+        parent: int = self._open[index]
+        nodeID: int = self.__newNodeID()
+        self.parents[nodeID] = parent
+        self.children[nodeID] = []
+        self.children[parent].append(nodeID)
+        if len(self.children[parent]) >= self.fanout:
+            # swap-remove; the order of open nodes does not matter
+            self._open[index] = self._open[-1]
+            self._open.pop()
+        self._open.append(nodeID)
+        self.__changed()
+        return nodeID
+
+    def __leave(self) -> int | None:
+        '''
+        Private method to remove a random node other than the root; its children re-join under its parent, which may go over the fanout for a while as a re-forming mesh does
+        @return: int | None - Node ID of the node that left, or None if only the root is left
+        '''
+        if len(self.parents) < 2:
+            return None
+        nodeID: int = self.__nodes()[self._random.randrange(1, len(self.parents))]
+        parent: int = self.parents.pop(nodeID)  # type: ignore
+        orphans: list[int] = self.children.pop(nodeID)
+        self.children[parent].remove(nodeID)
+        for orphan in orphans:
+            self.parents[orphan] = parent
+            self.children[parent].append(orphan)
+        if nodeID in self._open:
+            self._open.remove(nodeID)
+        if len(self.children[parent]) < self.fanout and parent not in self._open:
+            self._open.append(parent)
+        self.__changed()
+        return nodeID
+
+    def join(self) -> int:
+        '''
+        Add a node to the mesh
+        @return: int - Node ID of the new node
+        '''
+        with self._lock:
+            self.joined += 1
+            return self.__join()
+
+    def leave(self) -> int | None:
+        '''
+        Remove a random node other than the root from the mesh
+        @return: int | None - Node ID of the node that left, or None if only the root is left
+        '''
+        with self._lock:
+            nodeID = self.__leave()
+            self.left += nodeID is not None
+            return nodeID
+
+    def __nodes(self) -> list[int]:
+        '''
+        Private method to list the nodes with the root first, rebuilt only after the mesh changed
+        '''
+        if self._nodeList is None:
+            self._nodeList = [self.root] + [nodeID for nodeID in self.parents if nodeID != self.root]
+        return self._nodeList
+
+    def depthOf(self, nodeID: int) -> int:
+        '''
+        @param nodeID: int - Node ID to look up
+        @return: int - Number of hops between the node and the root
+        @raise KeyError: if the node is not in the mesh
+        '''
+        with self._lock:
+            if self._depths is None:
+                # breadth first from the root, so deep chains do not recurse
+                depths: dict[int, int] = {self.root: 0}
+                frontier: list[int] = [self.root]
+                while frontier:
+                    nextFrontier: list[int] = []
+                    for nodeID in frontier:
+                        for child in self.children[nodeID]:
+                            depths[child] = depths[nodeID] + 1
+                            nextFrontier.append(child)
+                    frontier = nextFrontier
+                self._depths = depths
+            return self._depths[nodeID]
+
+    def tree(self) -> dict:
+        '''
+        Nested `{nodeId, subs}` topology as the root board reports it, rebuilt only after the mesh changed
+        @return: dict - Topology tree rooted at the root board
+        '''
+        with self._lock:
+            if self._tree is None:
+                subtrees: dict[int, dict] = {nodeID: {'nodeId': nodeID, 'subs': []} for nodeID in self.parents}
+                for nodeID, children in self.children.items():
+                    subtrees[nodeID]['subs'] = [subtrees[child] for child in children]
+                self._tree = subtrees[self.root]
+            return self._tree
+
+    def __send(self, now: float) -> None:
+        '''
+        Private method to send one message from a random node other than the root; it reaches the root one hop latency per hop later
+        '''
+        with self._lock:
+            nodes: list[int] = self.__nodes()
+            if len(nodes) < 2:
+                return
+            sender: int = nodes[self._random.randrange(1, len(nodes))]
+        arrival: float = now + self.depthOf(sender) * self.hopLatency
+        self._sequence += 1
+        heapq.heappush(self._inFlight, (arrival, self._sequence, sender))
+
+    def __deliver(self, sender: int) -> None:
+        '''
+        Private method to print a message that reached the root on its serial port
+        '''
+        with self._lock:
+            nodes: list[int] = self.__nodes()
+            receiver: int = nodes[self._random.randrange(len(nodes))]
+        self.fake.sendLiveMessage({
+            'from_node_id': sender,
+            'to_node_id': str(receiver),
+            'HEX': f'#{self._random.randrange(2 ** 24):06x}',
+            'msg': ''.join(self._random.choices('abcdefghijklmnopqrstuvwxyz', k=self._random.randint(10, 40))),
+        })
+        self.delivered += 1
+
+    def __run(self) -> None:
+        '''
+        Private method to generate traffic and churn and deliver messages on time until stopped
+        '''
+        now: float = time.monotonic()
+        nextMessage: float = now
+        rate: float = self.messageRate
+        nextChurn: float = now + (self._random.expovariate(self.churnRate) if self.churnRate else float('inf'))
+        while not self._stopEvent.is_set():
+            now = time.monotonic()
+            if not self.messageRate or self.messageRate != rate:
+                # messages are owed from the moment a rate is set, not from when the simulator started
+                nextMessage = now
+                rate = self.messageRate
+            while rate and nextMessage <= now:
+                self.__send(nextMessage)
+                nextMessage += 1 / rate
+            if nextChurn <= now:
+                # a stable mesh size on average; joins and leaves are equally likely
+                if self._random.random() < 0.5:
+                    self.join()
+                else:
+                    self.leave()
+                nextChurn = now + self._random.expovariate(self.churnRate)
+            # delivery is paced by the root's serial line, so the backlog grows once the mesh outpaces it
+            while self._inFlight and self._inFlight[0][0] <= now and not self._stopEvent.is_set():
+                _, _, sender = heapq.heappop(self._inFlight)
+                self.__deliver(sender)
+                now = time.monotonic()
+            wakeUp: float = min(nextMessage if rate else now + 0.05, nextChurn, self._inFlight[0][0] if self._inFlight else now + 0.05)
+            self._stopEvent.wait(max(0, min(wakeUp - now, 0.05)))
+
+
+def peakRSS(pid: int) -> int | None:
+    '''
+    @param pid: int - Process to look at
+    @return: int | None - Peak resident memory of the process in KiB, or None where /proc is not available
+    '''
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class ControllerProbe:
+    """
+    Client connection to a running main_controller.py that sends one command at a time and waits for its reply
+    """
+
+    def __init__(self):
+        self.connection = socket.create_connection((SOCK_HOST, SOCK_PORT))
+        self._buffer = bytearray()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def ask(self, command: str, timeout: float = CLIENT_REPLY_TIMEOUT) -> dict | None:
+        '''
+        Send a command and wait for its reply; replies to anything else are skipped
+        @param command: str - Command as typed in the command interface, e.g. 'stats'
+        @param timeout: float - Seconds to wait for the reply (default: CLIENT_REPLY_TIMEOUT)
+        @return: dict | None - The reply frame, or None if it did not come in time
+        '''
+        self.connection.sendall(f'{command}\n'.encode())
+        deadline: float = time.monotonic() + timeout
+        while True:
+            end: int = self._buffer.find(b'\n')
+            if end != -1:
+                frame: dict = json.loads(self._buffer[:end])
+                del self._buffer[:end + 1]
+                if frame.get('cmd') == command:
+                    return frame
+                continue
+            timeLeft: float = deadline - time.monotonic()
+            if timeLeft <= 0:
+                return None
+            self.connection.settimeout(timeLeft)
+            try:
+                data: bytes = self.connection.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise ConnectionError('Controller closed the connection')
+            self._buffer += data
+
+    def stats(self) -> dict:
+        '''
+        @return: dict - The controller's metrics, as the `stats` command returns them
+        '''
+        frame = self.ask('stats')
+        if frame is None:
+            raise TimeoutError('Controller did not answer `stats`')
+        return frame['response']
+
+
+def measureSaturation(sizes: list[int], rates: list[float], stepTime: float = 5, fanout: int = 4, hopLatency: float = 0.005, baudrate: int | None = 115200, seed: int | None = 1) -> list[dict]:
+    '''
+    Run main_controller.py against simulated meshes, as its own process exactly as in the room, and find where its serial thread falls behind.
+    The host side numbers come from the controller's own metrics: mesh lines handled, time per line, and the lengths of the command and log queues.
+    A `get_topology` is timed through the client socket every second, so the command path is measured under the load too
+    @param sizes: list[int] - Mesh sizes to try
+    @param rates: list[float] - Message rates to try for each size, in messages per second
+    @param stepTime: float - Seconds to run each size and rate (default: 5s)
+    @param fanout: int - Most direct children per node (default: 4)
+    @param hopLatency: float - Seconds per mesh hop (default: 0.005)
+    @param baudrate: int | None - Serial line rate of the root board, which the controller keeps to; None to take the link out of the picture (default: 115200)
+    @param seed: int | None - Seed for repeatable meshes (default: 1)
+    @return: list[dict] - One result per size and rate
+    '''
+    from benchmark import startController, stopController
+
+    results: list[dict] = []
+    for size in sizes:
+        with MeshSimulator(size, fanout, hopLatency, messageRate=0, seed=seed, baudrate=baudrate) as simulator:
+            controller = startController(simulator.port, maxBaudrate=baudrate or SERIAL_BAUD_RATES[0])
+            probe = ControllerProbe()
+            try:
+                for rate in rates:
+                    result = measureStep(simulator, probe, rate, stepTime)
+                    result['max_rss_kib'] = peakRSS(controller.pid)
+                    results.append(result)
+                    print(result)
+            finally:
+                probe.close()
+                stopController(controller)
+    return results
+
+def measureStep(simulator: MeshSimulator, probe: ControllerProbe, rate: float, stepTime: float) -> dict:
+    '''
+    Offer `rate` messages per second for `stepTime` seconds to a controller that reads the simulator, then let both drain
+    @return: dict - Result of the step
+    '''
+    def total(stats: dict, name: str, labelValue: str = '') -> float:
+        return stats.get(name, {}).get(labelValue, {}).get('total', 0)
+
+    def handlingTime(stats: dict) -> tuple[int, float]:
+        lines = stats.get('ysp_line_handling_seconds', {}).get('')
+        return (lines['count'], lines['mean'] * lines['count']) if lines else (0, 0.0)
+
+    before: dict = probe.stats()
+    commandQueuePeak: float = 0
+    logQueuePeak: float = 0
+    backlogPeak: int = 0
+    topologyTimes: list[float] = []
+    simulator.messageRate = rate
+    start: float = time.monotonic()
+    nextTopology: float = start
+    while (elapsed := time.monotonic() - start) < stepTime:
+        if time.monotonic() >= nextTopology:
+            begin = time.perf_counter()
+            if probe.ask('get_topology') is not None:
+                topologyTimes.append(time.perf_counter() - begin)
+            nextTopology += 1
+        stats: dict = probe.stats()
+        commandQueuePeak = max(commandQueuePeak, stats.get('ysp_command_queue_length', {}).get('', 0))
+        logQueuePeak = max(logQueuePeak, stats.get('ysp_log_queue_length', {}).get('', 0))
+        backlogPeak = max(backlogPeak, simulator.backlog)
+        time.sleep(0.1)
+    after: dict = probe.stats()
+    simulator.messageRate = 0
+
+    # let the mesh and the controller catch up, so the next step starts from empty queues
+    deadline: float = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        stats = probe.stats()
+        if not simulator.backlog and not stats.get('ysp_command_queue_length', {}).get('') and not stats.get('ysp_log_queue_length', {}).get(''):
+            break
+        time.sleep(0.2)
+
+    handled: float = (total(after, 'ysp_serial_lines_total', 'mesh') - total(before, 'ysp_serial_lines_total', 'mesh')) / elapsed
+    linesBefore, timeBefore = handlingTime(before)
+    linesAfter, timeAfter = handlingTime(after)
+    topologyTimes.sort()
+    result = {
+        'nodes': len(simulator),
+        'height': max(simulator.depthOf(nodeID) for nodeID in simulator.parents),
+        'offered_per_s': rate,
+        'handled_per_s': round(handled, 1),
+        'line_mean_us': round((timeAfter - timeBefore) / (linesAfter - linesBefore) * 1e6, 1) if linesAfter > linesBefore else None,
+        # share of the serial thread's time spent on lines
+        'serial_thread_busy': round((timeAfter - timeBefore) / elapsed, 3),
+        'command_queue_peak': commandQueuePeak,
+        'log_queue_peak': logQueuePeak,
+        'log_records_dropped': after.get('ysp_log_records_dropped', {}).get('', 0) - before.get('ysp_log_records_dropped', {}).get('', 0),
+        'mesh_backlog_peak': backlogPeak,
+        'topology_nodes': max(after.get('ysp_topology_nodes', {}).values(), default=None),
+        'topology_reply_p50_ms': round(topologyTimes[len(topologyTimes) // 2] * 1000, 1) if topologyTimes else None,
+    }
+    # the controller keeps up if it handled nearly everything offered; otherwise the link or the controller is the bottleneck
+    result['saturated'] = handled < rate * 0.95
+    host: bool = result['serial_thread_busy'] > 0.9 or result['log_records_dropped'] > 0
+    result['bottleneck'] = None if not result['saturated'] else ('host' if host else 'serial link')
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Simulated mesh behind a fake root board')
+    arg_parser.add_argument('--nodes', default='77,770,7700', help='comma separated mesh sizes to measure (default: 77,770,7700)')
+    arg_parser.add_argument('--rates', default='10,100,1000', help='comma separated messages per second to measure (default: 10,100,1000)')
+    arg_parser.add_argument('--step-time', type=float, default=5, help='seconds per size and rate (default: 5)')
+    arg_parser.add_argument('--fanout', type=int, default=4, help='most children per node; 1 for a chain (default: 4)')
+    arg_parser.add_argument('--hop-latency', type=float, default=0.005, help='seconds per mesh hop (default: 0.005)')
+    arg_parser.add_argument('--no-throttle', action='store_true', help='do not limit the root serial line to 115200 baud, to load the host side alone')
+    arg_parser.add_argument('--serve', action='store_true', help='run one mesh of the first size and rate until Ctrl-C, for main_controller.py --port')
+    arg_parser.add_argument('--churn', type=float, default=0, help='joins and leaves per second with --serve (default: 0)')
+    arg_parser.add_argument('--output', metavar='FILE', help='write the measurements to FILE as JSON')
+    args = arg_parser.parse_args()
+
+    sizes = [int(size) for size in args.nodes.split(',')]
+    rates = [float(rate) for rate in args.rates.split(',')]
+    baudrate = None if args.no_throttle else 115200
+
+    if args.serve:
+        simulator = MeshSimulator(sizes[0], args.fanout, args.hop_latency, rates[0], args.churn, baudrate=baudrate).start()
+        print(f"Simulated mesh of {len(simulator)} nodes, root {simulator.root}, on {simulator.port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"\n{simulator}")
+            simulator.stop()
+    else:
+        results = measureSaturation(sizes, rates, args.step_time, args.fanout, args.hop_latency, baudrate)
+        if args.output:
+            with open(args.output, 'w') as ofile:
+                json.dump(results, ofile, indent=4)
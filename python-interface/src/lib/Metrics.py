@@ -0,0 +1,301 @@
+'''
+Module to collect the controller's runtime metrics: command latency, queue depth, serial traffic, received lines, clients and topology size.
+The same numbers are served to the `stats` command as a dict and to Prometheus in its plain-text exposition format.
+Recording is a lock and an addition or two per event, cheap enough to leave on while the room is running.
+'''
+import bisect
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+class Metric:
+    """
+    Base of all metrics: a name, a help text and values keyed by the value of one optional label
+    @param name: str - Metric name in Prometheus style, e.g. 'ysp_serial_bytes_total'
+    @param help: str - One line description
+    @param label: str | None - Name of the label that splits the metric, e.g. 'command' (default: None, a single value)
+    """
+    kind: str = 'untyped'
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__} Object: {self.name = }, {self.label = }"
+
+    def _labels(self, labelValue: str, extra: str = '') -> str:
+        '''
+        @return: str - Prometheus label set for a value, e.g. '{command="ping_node"}', empty if there are no labels
+        '''
+        labels: list[str] = []
+        if self.label is not None:
+            escaped = str(labelValue).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            labels.append(f'{self.label}="{escaped}"')
+        if extra:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    def render(self) -> list[str]:
+        '''
+        @return: list[str] - Lines of the metric in the Prometheus text format
+        '''
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}'] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        '''
+        @return: dict - Current values keyed by label value ('' without a label)
+        '''
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Value that only goes up, like bytes sent or commands answered
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        super().__init__(name, help, label)
+        self._values: dict[str, float] = {}
+
+    def inc(self, amount: float = 1, labelValue: str = '') -> None:
+        with self._lock:
+            self._values[labelValue] = self._values.get(labelValue, 0) + amount
+
+    def value(self, labelValue: str = '') -> float:
+        return self._values.get(labelValue, 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{self._labels(labelValue)} {value}' for labelValue, value in values.items()]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down, like connected clients. Either set directly, or read from `function` whenever it is collected
+    @param function: Callable[[], float] | None - Returns the current value; for values another object already keeps, like a queue's length (default: None)
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, label: str | None = None, function: Callable[[], float] | None = None):
+        super().__init__(name, help, label)
+        self._values: dict[str, float] = {}
+        self.function = function
+
+    def set(self, value: float, labelValue: str = '') -> None:
+        with self._lock:
+            self._values[labelValue] = value
+
+    def inc(self, amount: float = 1, labelValue: str = '') -> None:
+        with self._lock:
+            self._values[labelValue] = self._values.get(labelValue, 0) + amount
+
+    def dec(self, amount: float = 1, labelValue: str = '') -> None:
+        self.inc(-amount, labelValue)
+
+    def snapshot(self) -> dict:
+        if self.function is not None:
+            try:
+                return {'': self.function()}
+            except Exception:
+                # whatever the function reads from may be gone during shutdown
+                return {}
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self) -> list[str]:
+        return [f'{self.name}{self._labels(labelValue)} {value}' for labelValue, value in self.snapshot().items()]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, counted into fixed buckets, like command latency in seconds
+    @param buckets: tuple[float, ...] - Upper bounds of the buckets, ascending; values above the last one still count in the total
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...], label: str | None = None):
+        super().__init__(name, help, label)
+        self.buckets = tuple(sorted(buckets))
+        # label value -> [count per bucket (+Inf last), sum, max]
+        self._values: dict[str, list] = {}
+
+    def observe(self, value: float, labelValue: str = '') -> None:
+        index: int = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelValue)
+            if state is None:
+                state = self._values[labelValue] = [[0] * (len(self.buckets) + 1), 0.0, value]
+            state[0][index] += 1
+            state[1] += value
+            if value > state[2]:
+                state[2] = value
+
+    def __copy(self) -> dict[str, tuple[list[int], float, float]]:
+        with self._lock:
+            return {labelValue: (list(counts), total, largest) for labelValue, (counts, total, largest) in self._values.items()}
+
+    def quantile(self, counts: list[int], fraction: float, largest: float) -> float:
+        '''
+        Estimate a quantile as the upper bound of the bucket it falls in
+        @param counts: list[int] - Count per bucket, +Inf last
+        @param fraction: float - Quantile as a fraction, e.g. 0.99
+        @param largest: float - Largest value observed, used for the +Inf bucket
+        @return: float - Estimated quantile
+        '''
+        rank: float = fraction * sum(counts)
+        cumulative: int = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self.buckets[index] if index < len(self.buckets) else largest
+        return largest
+
+    def _samples(self) -> list[str]:
+        lines: list[str] = []
+        for labelValue, (counts, total, _) in self.__copy().items():
+            cumulative: int = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le: str = '+Inf' if bound == float('inf') else f'{bound:g}'
+                bucket: str = self._labels(labelValue, f'le="{le}"')
+                lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(labelValue)} {total}')
+            lines.append(f'{self.name}_count{self._labels(labelValue)} {cumulative}')
+        return lines
+
+    def snapshot(self) -> dict:
+        return {
+            labelValue: {
+                'count': sum(counts),
+                'mean': total / sum(counts),
+                'p50': self.quantile(counts, 0.5, largest),
+                'p99': self.quantile(counts, 0.99, largest),
+                'max': largest,
+            }
+            for labelValue, (counts, total, largest) in self.__copy().items()
+        }
+
+
+class MetricsRegistry:
+    """
+    Set of metrics that are rendered and snapshotted together
+    """
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.started: float = time.time()
+        self._lock = threading.Lock()
+        # counter totals at the previous snapshot, for per-second rates
+        self._previous: tuple[float, dict[tuple[str, str], float]] = (time.monotonic(), {})
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label: str | None = None) -> Counter:
+        return self.register(Counter(name, help, label))    # type: ignore
+
+    def gauge(self, name: str, help: str, label: str | None = None, function: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, help, label, function))    # type: ignore
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...], label: str | None = None) -> Histogram:
+        return self.register(Histogram(name, help, buckets, label))     # type: ignore
+
+    def render(self) -> str:
+        '''
+        @return: str - Every metric in the Prometheus text exposition format
+        '''
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        '''
+        Every metric as plain values, with counters also as a rate per second since the previous snapshot
+        @return: dict - Metric name to {label value: value}
+        '''
+        now: float = time.monotonic()
+        totals: dict[tuple[str, str], float] = {}
+        with self._lock:
+            before, previous = self._previous
+            elapsed: float = max(now - before, 1e-9)
+            result: dict = {'uptime_s': round(time.time() - self.started, 1)}
+            for metric in self.metrics:
+                values = metric.snapshot()
+                if isinstance(metric, Counter):
+                    for labelValue, total in values.items():
+                        totals[(metric.name, labelValue)] = total
+                        values[labelValue] = {'total': total, 'per_s': round((total - previous.get((metric.name, labelValue), 0)) / elapsed, 2)}
+                result[metric.name] = values
+            self._previous = (now, totals)
+        return result
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body: bytes = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes every few seconds would drown the console
+        pass
+
+def startMetricsServer(host: str, port: int, registry: MetricsRegistry | None = None) -> ThreadingHTTPServer:
+    '''
+    Serve the metrics over HTTP at /metrics from a background thread
+    @param host: str - Address to listen on
+    @param port: int - Port to listen on
+    @param registry: MetricsRegistry | None - Metrics to serve (default: ControllerMetrics)
+    @return: ThreadingHTTPServer - The running server; call shutdown() to stop it
+    @raise OSError: if the port cannot be bound
+    '''
+    handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': registry or ControllerMetrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+    return server
+
+
+# Metrics of the controller, shared by every module that records them
+ControllerMetrics = MetricsRegistry()
+
+CommandLatency = ControllerMetrics.histogram('ysp_command_latency_seconds', 'Time from pushing a command to the board until its answer, by command',
+                                             (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10), label='command')
+CommandResults = ControllerMetrics.counter('ysp_commands_total', 'Commands pushed to the board, by outcome: answered, error, timeout or cancelled', label='result')
+CommandQueueDepth = ControllerMetrics.histogram('ysp_command_queue_depth', 'Commands still waiting in the queue each time the serial writer takes one',
+                                                (0, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+CommandQueueLength = ControllerMetrics.gauge('ysp_command_queue_length', 'Commands waiting in the client command queue right now')
+LineHandling = ControllerMetrics.histogram('ysp_line_handling_seconds', 'Time the serial thread spends parsing, decrypting and handling each line received from a board',
+                                           (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1))
+SerialBytes = ControllerMetrics.counter('ysp_serial_bytes_total', 'Bytes written to and read from the boards', label='direction')
+SerialLines = ControllerMetrics.counter('ysp_serial_lines_total', 'Lines received from the boards, by kind: response, mesh, invalid_command, malformed or other', label='kind')
+ClientsConnected = ControllerMetrics.gauge('ysp_clients_connected', 'Command interface clients connected right now')
+ClientConnections = ControllerMetrics.counter('ysp_client_connections_total', 'Command interface connections accepted')
+SerialWindow = ControllerMetrics.gauge('ysp_serial_window', 'Commands allowed in flight to the board right now, by hardware index of the board', label='hw_index')
+SerialBaudRate = ControllerMetrics.gauge('ysp_serial_baud_rate', 'Line rate of the serial link, by hardware index of the board', label='hw_index')
+TopologyNodes = ControllerMetrics.gauge('ysp_topology_nodes', 'Nodes in the last topology reported, by hardware index of the board', label='hw_index')
+TopologyHeight = ControllerMetrics.gauge('ysp_topology_height', 'Hops from the board to its farthest node in the last topology reported, by hardware index of the board', label='hw_index')
@@ -0,0 +1,195 @@
+'''
+Module to correlate commands sent to the ESP with the responses it sends back.
+Every command pushed to the board carries a request ID in its payload; the firmware echoes the payload in its response, so the response can be matched to the command that caused it.
+'''
+import threading
+import time
+
+from concurrent.futures import Future
+
+from FlowControl import AckWindow
+
+class RequestTimeoutError(Exception):
+    """
+    Raised on a request's future when the board does not answer it in time, including all retries
+    """
+    pass
+
+class PendingRequest:
+    """
+    A command sent to the board that has not been answered yet
+    @param requestID: int - Request ID stamped into the command's payload
+    @param command: str - Command string as received from the client
+    @param payload: str - Serialized payload pushed to the board, kept for retries
+    @param retries: int - Number of times the payload may still be resent on timeout
+    @param timeout: float - Seconds to wait for the board's answer to each attempt
+    """
+
+    def __init__(self, requestID: int, command: str, payload: str, retries: int, timeout: float):
+        self.requestID = requestID
+        self.command = command
+        self.payload = payload
+        self.retries = retries
+        self.timeout = timeout
+        self.future: Future = Future()
+        self.sentAt: float = time.monotonic()
+        self.deadline: float = self.sentAt + timeout
+
+    def __repr__(self) -> str:
+        return f"PendingRequest Object: {self.requestID = }, {self.command = }, {self.retries = }, {self.timeout = }"
+
+
+class PendingRequests:
+    """
+    Table of the requests in flight to one board. Each request's future resolves with the board's answer as a dict ({'response': ...} or {'error': ...}) plus the round-trip 'latency_ms', or fails with RequestTimeoutError
+    Answers and timeouts are reported to `window`, which sets how many requests writers may have in flight
+    @param timeout: float - Seconds to wait for the board's answer to each attempt
+    @param retries: int - Number of times a request is resent before it times out (default: 0)
+    @param window: AckWindow | None - Flow control window of the board (default: None, a fixed window of 4 commands)
+    """
+
+    def __init__(self, timeout: float, retries: int = 0, window: AckWindow | None = None):
+        self.timeout = timeout
+        self.retries = retries
+        self.window: AckWindow = window if window is not None else AckWindow(4, minimum=4, maximum=4)
+        self._lock = threading.Lock()
+        # notified whenever requests leave the table or writers are let through again
+        self._completed = threading.Condition(self._lock)
+        # insertion order is send order, so the first entry is the oldest request
+        self._requests: dict[int, PendingRequest] = {}
+        # bytes of the payloads in flight, against the window's byte limit
+        self.inFlightBytes: int = 0
+        # set while something else has the link to itself, like a baud rate change
+        self._paused: bool = False
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def add(self, requestID: int, command: str, payload: str) -> Future:
+        '''
+        Track a request that is about to be pushed to the board
+        @param requestID: int - Request ID stamped into the payload
+        @param command: str - Command string as received from the client
+        @param payload: str - Serialized payload pushed to the board
+        @return: Future - Resolves when the board answers or the request times out
+        '''
+        request = PendingRequest(requestID, command, payload, self.retries, self.timeout)
+        with self._lock:
+            self._requests[requestID] = request
+            self.inFlightBytes += len(payload)
+        return request.future
+
+    def hasRoom(self, size: int = 0, limit: int | None = None) -> bool:
+        '''
+        @param size: int - Bytes of the next payload to send (default: 0)
+        @param limit: int | None - Requests allowed in flight (default: None, the window's limit)
+        @return: bool - True if a request of `size` bytes may be sent now; one request always may while none are in flight
+        '''
+        if self._paused:
+            return False
+        if not self._requests:
+            return True
+        return len(self._requests) < (self.window.limit if limit is None else limit) and self.inFlightBytes + size <= self.window.byteLimit
+
+    def waitForCapacity(self, limit: int | None = None, timeout: float | None = None, size: int = 0) -> bool:
+        '''
+        Block until fewer than `limit` requests are in flight, with room for `size` more bytes, and writers are not paused
+        @param limit: int | None - Maximum number of requests in flight (default: None, the window's limit)
+        @param timeout: float | None - Seconds to wait at most. Waits forever if None (default: None)
+        @param size: int - Bytes of the next payload to send (default: 0)
+        @return: bool - True if there is room for another request, False if the wait timed out
+        '''
+        with self._completed:
+            return self._completed.wait_for(lambda: self.hasRoom(size, limit), timeout)
+
+    def pause(self) -> None:
+        '''
+        Stop writers from sending until `resume`; requests in flight are still answered or time out as usual
+        '''
+        with self._completed:
+            self._paused = True
+
+    def resume(self) -> None:
+        '''
+        Let writers send again after `pause`
+        '''
+        with self._completed:
+            self._paused = False
+            self._completed.notify_all()
+
+    def resolve(self, requestID: int | None, result: dict) -> PendingRequest | None:
+        '''
+        Complete a request with the board's answer
+        @param requestID: int | None - Request ID echoed by the board, or None to complete the oldest request (for answers that carry no ID)
+        @param result: dict - Answer to resolve the request's future with
+        @return: PendingRequest | None - The completed request, or None if no such request is in flight
+        '''
+        with self._lock:
+            if requestID is None:
+                requestID = next(iter(self._requests), None)
+            request = self._requests.pop(requestID, None)   # type: ignore
+            if request is not None:
+                self.inFlightBytes -= len(request.payload)
+                # before waking the writers, so they see the window this answer left
+                latency: float = time.monotonic() - request.sentAt
+                self.window.acknowledge(request.command.split(' ', 1)[0], latency)
+                self._completed.notify_all()
+        if request is None:
+            return None
+        result['latency_ms'] = round(latency * 1000, 3)
+        request.future.set_result(result)
+        return request
+
+    def discard(self, requestID: int) -> None:
+        '''
+        Stop waiting for a request, e.g. one whose answer is no longer readable after a baud rate change; its future is cancelled
+        @param requestID: int - Request ID stamped into the payload
+        '''
+        with self._lock:
+            request = self._requests.pop(requestID, None)
+            if request is not None:
+                self.inFlightBytes -= len(request.payload)
+                self._completed.notify_all()
+        if request is not None:
+            request.future.cancel()
+
+    def expire(self) -> list[PendingRequest]:
+        '''
+        Time out the requests past their deadline
+        @return: list[PendingRequest] - Requests that still have retries left; the caller must push their payload again
+        '''
+        now: float = time.monotonic()
+        retry: list[PendingRequest] = []
+        expired: list[PendingRequest] = []
+        with self._lock:
+            for request in self._requests.values():
+                if request.deadline > now:
+                    continue
+                self.window.timedOut()
+                if request.retries > 0:
+                    request.retries -= 1
+                    request.sentAt = now
+                    request.deadline = now + request.timeout
+                    retry.append(request)
+                else:
+                    expired.append(request)
+            for request in expired:
+                del self._requests[request.requestID]
+                self.inFlightBytes -= len(request.payload)
+            if expired:
+                self._completed.notify_all()
+        for request in expired:
+            request.future.set_exception(RequestTimeoutError(f'No response to `{request.command}` within {request.timeout}s'))
+        return retry
+
+    def cancelAll(self) -> None:
+        '''
+        Cancel every request in flight, e.g. when the board is disconnected
+        '''
+        with self._lock:
+            requests = list(self._requests.values())
+            self._requests.clear()
+            self.inFlightBytes = 0
+            self._completed.notify_all()
+        for request in requests:
+            request.future.cancel()
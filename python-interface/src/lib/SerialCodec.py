@@ -0,0 +1,317 @@
+'''
+Module for the compact binary encoding of the serial link, the host side of esp-firmware/general-node/src/serial_codec.hpp.
+JSON lines stay the default. Once a board accepts `set-encoding msgpack`, documents travel as MessagePack with one-letter keys,
+COBS-encoded so they hold no zero byte, between two zero bytes:
+
+    0x00 <COBS(MessagePack)> 0x00
+
+Text the firmware prints (boot dots, `Invalid Command`, logs) never holds a zero byte, so lines and frames can share the link.
+The boot output is bracketed by zero bytes, closing any frame the board was sending when it restarted; it reads as a line all the same.
+The MessagePack subset here covers what ArduinoJson writes: nil, booleans, integers, floats, strings, arrays and maps.
+'''
+import json
+import struct
+
+ENCODINGS = ('json', 'msgpack')
+FRAME_DELIMITER = b'\x00'
+# longest COBS block the firmware reads as a command (SERIAL_MAX_FRAME, less one); longer commands go as JSON lines
+MAX_COMMAND_FRAME = 511
+
+TEXT_BYTES = bytes(range(0x20, 0x7f)) + b'\r\n\t'
+
+# long key -> one-letter tag; must match SERIAL_KEY_TAGS in serial_codec.cpp
+SHORT_KEYS: dict[str, str] = {
+    'payload_type': 't',
+    'payload': 'p',
+    'cmd': 'c',
+    'req_id': 'i',
+    'response': 'r',
+    'to_node_id': 'T',
+    'from_node_id': 'F',
+    'HEX': 'h',
+    'msg': 'm',
+    'nodeId': 'n',
+    'subs': 's',
+    'root': 'R',
+    'room_id': 'o',
+    'base_ssid': 'b',
+    'base_password': 'B',
+    'ssid': 'S',
+    'password': 'P',
+    'success': 'k',
+    'encoding': 'e',
+    'baud': 'd',
+}
+LONG_KEYS: dict[str, str] = {tag: key for key, tag in SHORT_KEYS.items()}
+
+def renameKeys(value, table: dict[str, str]):
+    '''
+    @param value: Decoded JSON value
+    @param table: dict[str, str] - SHORT_KEYS or LONG_KEYS
+    @return: A copy of `value` with every object key found in `table` renamed
+    '''
+    if isinstance(value, dict):
+        return {table.get(key, key): renameKeys(item, table) for key, item in value.items()}
+    if isinstance(value, list):
+        return [renameKeys(item, table) for item in value]
+    return value
+
+def pack(value) -> bytes:
+    '''
+    @param value: JSON value to encode
+    @return: bytes - MessagePack encoding of `value`, in the smallest form of each type
+    @raise TypeError: for values JSON cannot hold either
+    '''
+    chunks: list[bytes] = []
+    __pack(value, chunks)
+    return b''.join(chunks)
+
+def __pack(value, chunks: list[bytes]) -> None:
+    if value is None:
+        chunks.append(b'\xc0')
+    elif value is True:
+        chunks.append(b'\xc3')
+    elif value is False:
+        chunks.append(b'\xc2')
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            chunks.append(bytes((value,)))
+        elif -0x20 <= value < 0:
+            chunks.append(struct.pack('b', value))
+        elif value >= 0:
+            for bits, header in ((8, b'\xcc'), (16, b'\xcd'), (32, b'\xce'), (64, b'\xcf')):
+                if value < 1 << bits:
+                    chunks.append(header + value.to_bytes(bits // 8, 'big'))
+                    break
+            else:
+                raise TypeError(f'Integer {value} does not fit in 64 bits')
+        else:
+            for bits, header in ((8, b'\xd0'), (16, b'\xd1'), (32, b'\xd2'), (64, b'\xd3')):
+                if value >= -(1 << (bits - 1)):
+                    chunks.append(header + value.to_bytes(bits // 8, 'big', signed=True))
+                    break
+            else:
+                raise TypeError(f'Integer {value} does not fit in 64 bits')
+    elif isinstance(value, float):
+        chunks.append(b'\xcb' + struct.pack('>d', value))
+    elif isinstance(value, str):
+        data: bytes = value.encode()
+        chunks.append(__header(len(data), 0xa0, 32, b'\xd9', b'\xda', b'\xdb'))
+        chunks.append(data)
+    elif isinstance(value, (list, tuple)):
+        chunks.append(__header(len(value), 0x90, 16, None, b'\xdc', b'\xdd'))
+        for item in value:
+            __pack(item, chunks)
+    elif isinstance(value, dict):
+        chunks.append(__header(len(value), 0x80, 16, None, b'\xde', b'\xdf'))
+        for key, item in value.items():
+            __pack(str(key), chunks)
+            __pack(item, chunks)
+    else:
+        raise TypeError(f'Cannot encode {type(value).__name__} as MessagePack')
+
+def __header(length: int, fixBase: int, fixLimit: int, header8: bytes | None, header16: bytes, header32: bytes) -> bytes:
+    '''
+    @return: bytes - Header of a string, array or map of `length` items, in its shortest form
+    '''
+    if length < fixLimit:
+        return bytes((fixBase | length,))
+    if header8 is not None and length <= 0xff:
+        return header8 + bytes((length,))
+    if length <= 0xffff:
+        return header16 + struct.pack('>H', length)
+    return header32 + struct.pack('>I', length)
+
+def unpack(data: bytes):
+    '''
+    @param data: bytes - One MessagePack value
+    @return: The decoded value; maps become dicts, arrays lists
+    @raise ValueError: if `data` is not exactly one valid value
+    '''
+    try:
+        value, end = __unpack(memoryview(data), 0)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f'Malformed MessagePack: {e}') from e
+    if end != len(data):
+        raise ValueError(f'Malformed MessagePack: {len(data) - end} bytes after the value')
+    return value
+
+# fixed size types: header -> (struct format, size)
+_FIXED: dict[int, tuple[str, int]] = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+
+def __unpack(data: memoryview, position: int):
+    header: int = data[position]
+    position += 1
+    if header < 0x80:
+        return header, position
+    if header >= 0xe0:
+        return header - 0x100, position
+    if 0xa0 <= header <= 0xbf:
+        return __string(data, position, header & 0x1f)
+    if 0x90 <= header <= 0x9f:
+        return __array(data, position, header & 0x0f)
+    if 0x80 <= header <= 0x8f:
+        return __map(data, position, header & 0x0f)
+    if header == 0xc0:
+        return None, position
+    if header == 0xc2:
+        return False, position
+    if header == 0xc3:
+        return True, position
+    if header in _FIXED:
+        format, size = _FIXED[header]
+        if position + size > len(data):
+            raise IndexError('value cut off')
+        return struct.unpack_from(format, data, position)[0], position + size
+    if header in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6, 0xdc, 0xdd, 0xde, 0xdf):
+        size: int = {0xd9: 1, 0xc4: 1, 0xda: 2, 0xc5: 2, 0xdc: 2, 0xde: 2}.get(header, 4)
+        length: int = int.from_bytes(data[position:position + size], 'big')
+        position += size
+        if header in (0xd9, 0xda, 0xdb):
+            return __string(data, position, length)
+        if header in (0xc4, 0xc5, 0xc6):
+            # bin: not written by ArduinoJson, kept as text for the JSON side
+            return __string(data, position, length)
+        if header in (0xdc, 0xdd):
+            return __array(data, position, length)
+        return __map(data, position, length)
+    raise ValueError(f'Unsupported MessagePack type 0x{header:02x}')
+
+def __string(data: memoryview, position: int, length: int):
+    if position + length > len(data):
+        raise IndexError('string cut off')
+    return str(data[position:position + length], 'utf-8'), position + length
+
+def __array(data: memoryview, position: int, length: int):
+    items: list = []
+    for _ in range(length):
+        item, position = __unpack(data, position)
+        items.append(item)
+    return items, position
+
+def __map(data: memoryview, position: int, length: int):
+    items: dict = {}
+    for _ in range(length):
+        key, position = __unpack(data, position)
+        items[str(key)], position = __unpack(data, position)
+    return items, position
+
+def cobsEncode(data: bytes) -> bytes:
+    '''
+    @return: bytes - `data` with every zero byte removed by Consistent Overhead Byte Stuffing
+    '''
+    encoded = bytearray()
+    for block in data.split(b'\x00'):
+        # a code byte of 0xFF is a full block of 254 bytes with no zero after it
+        while len(block) >= 254:
+            encoded.append(0xff)
+            encoded += block[:254]
+            block = block[254:]
+        encoded.append(len(block) + 1)
+        encoded += block
+    return bytes(encoded)
+
+def cobsDecode(data: bytes) -> bytes:
+    '''
+    @return: bytes - The bytes `cobsEncode` was given
+    @raise ValueError: if `data` is not valid COBS
+    '''
+    decoded = bytearray()
+    position: int = 0
+    while position < len(data):
+        code: int = data[position]
+        if code == 0 or position + code > len(data):
+            raise ValueError('Malformed COBS block')
+        decoded += data[position + 1:position + code]
+        position += code
+        if code < 0xff and position < len(data):
+            decoded.append(0)
+    return bytes(decoded)
+
+def encodeFrame(document: dict) -> bytes:
+    '''
+    @param document: dict - Document with long key names
+    @return: bytes - The frame to write, delimiters included
+    '''
+    return FRAME_DELIMITER + cobsEncode(pack(renameKeys(document, SHORT_KEYS))) + FRAME_DELIMITER
+
+def decodeFrame(frame: bytes) -> dict:
+    '''
+    @param frame: bytes - Frame content, without the delimiters
+    @return: dict - The document, with long key names
+    @raise ValueError: if the frame is not a valid MessagePack map
+    '''
+    document = renameKeys(unpack(cobsDecode(frame)), LONG_KEYS)
+    if not isinstance(document, dict):
+        raise ValueError('Frame is not a MessagePack map')
+    return document
+
+def encodeCommand(command: str, encoding: str) -> bytes:
+    '''
+    @param command: str - JSON command, as CommandParser.create_payload makes it
+    @param encoding: str - Encoding the board reads; commands too long for its frame buffer go as JSON lines, which it always reads
+    @return: bytes - Bytes to write for the command
+    '''
+    if encoding == 'msgpack':
+        frame: bytes = encodeFrame(json.loads(command))
+        if len(frame) - 2 <= MAX_COMMAND_FRAME:
+            return frame
+    return (command + '\n').encode()
+
+def isText(data: bytes) -> bool:
+    '''
+    @return: bool - True if `data` is only printable ASCII and line breaks, as firmware text is
+    '''
+    return not data.translate(None, TEXT_BYTES)
+
+def splitReceived(buffer: bytearray) -> tuple[list[str], int, int]:
+    '''
+    Split what a board sent into text lines and frames; frames are returned as compact JSON so both read the same downstream
+    @param buffer: bytearray - Bytes received and not consumed yet
+    @return: tuple[list[str], int, int] - Complete lines and decoded frames in order, the number of bytes consumed, and the number of malformed frames skipped
+    '''
+    items: list[str] = []
+    malformed: int = 0
+    start: int = 0
+    while start < len(buffer):
+        if buffer[start] == 0:
+            end: int = buffer.find(FRAME_DELIMITER, start + 1)
+            if end == -1:
+                break
+            if end == start + 1:
+                # two zeros in a row: the first closed a frame read only in part, the second opens the next one
+                start = end
+                continue
+            frame: bytes = bytes(buffer[start + 1:end])
+            if isText(frame):
+                # text between two delimiters, like the boot banner; no frame is all text, it starts with a map header
+                items.extend(line.decode() for line in frame.splitlines() if line)
+                start = end + 1
+                continue
+            try:
+                items.append(json.dumps(decodeFrame(frame), separators=(',', ':')))
+            except (ValueError, RecursionError):
+                malformed += 1
+                # leave the closing zero in case it opens the next frame
+                start = end
+                continue
+            start = end + 1
+            continue
+        newline: int = buffer.find(b'\n', start)
+        zero: int = buffer.find(FRAME_DELIMITER, start)
+        if zero != -1 and (newline == -1 or zero < newline):
+            # the tail of a frame that started before we were listening
+            malformed += 1
+            start = zero
+            continue
+        if newline == -1:
+            break
+        line: bytes = bytes(buffer[start:newline]).rstrip(b'\r')
+        start = newline + 1
+        if line:
+            items.append(line.decode(errors='replace'))
+    return items, start, malformed
@@ -2,14 +2,60 @@
 Module to automatically connect to the ESP via serial and send commands to it.
 Use the DeviceIdentifierType 'FROM_LIST' for YSP workshop; it checks against an allowed list of devices located in file 'DeviceList.py'.
 '''
+import json
+import os
+import queue
+import selectors
 import serial
+import threading
 import time
 
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from typing import Callable, Iterator
 
 from serial.tools import list_ports, list_ports_common
 
-from DeviceList import AllowedDevicesNodeIDs
+from DeviceList import AllowedDevicesNodeIDs, nodeIDFromSerialNumber
+from Metrics import SerialBytes, SerialLines
+from SerialCodec import encodeCommand, splitReceived
+
+# last device each board was found on, so the next start tries it first: {serial number: {port, nodeID, hardwareIndex}}
+DEVICE_CACHE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'device_cache.json')
+
+# cheap command every firmware answers; request ID 0 is never issued by CommandParser, so a late answer matches no command
+HANDSHAKE_PROBE = b'{"payload_type": "cmd", "payload": {"cmd": "get-room-id", "req_id": 0}}\n'
+
+def loadDeviceCache() -> dict[str, dict[str, str | int]]:
+    '''
+    @return: dict - Cached {serial number: {port, nodeID, hardwareIndex}}, empty if there is no usable cache
+    '''
+    try:
+        with open(DEVICE_CACHE_FILE) as ifile:
+            cache = json.load(ifile)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+_deviceCacheLock = threading.Lock()
+
+def saveDeviceCache(serialNumber: str, port: str, nodeID: int, hardwareIndex: int) -> None:
+    '''
+    Remember the device a board was found on
+    '''
+    entry = {'port': port, 'nodeID': nodeID, 'hardwareIndex': hardwareIndex}
+    # boards of a pool connect in parallel; keep their read-modify-write of the file apart
+    with _deviceCacheLock:
+        cache = loadDeviceCache()
+        if cache.get(serialNumber) == entry:
+            return
+        cache[serialNumber] = entry
+        try:
+            with open(DEVICE_CACHE_FILE, 'w') as ofile:
+                json.dump(cache, ofile, indent=4)
+        except OSError as e:
+            print(f"Could not write device cache {DEVICE_CACHE_FILE}: {e}")
 
 class DeviceIdentifierType(Enum):
     PORT = 1
@@ -26,17 +72,19 @@ class ESPController:
     @param identifierString: str - Identifier string to use for device identification (default: '') [PORT, SERIAL_NUMBER]
     @param baudrate: int - Baudrate to use for serial communication (default: 115200)
     @param timeout: int - Timeout for serial communication (default: 0)
-    @param waitTime: int - Wait time for controller to initialize in seconds (default: 2s)
+    @param waitTime: int - Maximum time to wait for the controller to answer the readiness handshake in seconds (default: 2s)
+    @param lazy: bool - Connect on first use of `controller` instead of right away (default: False)
     """
 
-    def __init__(self, identifierType: DeviceIdentifierType = DeviceIdentifierType.FROM_LIST, identifierString: str = '', baudrate: int = 115200, timeout: int = 0, waitTime: int = 2):
+    def __init__(self, identifierType: DeviceIdentifierType = DeviceIdentifierType.FROM_LIST, identifierString: str = '', baudrate: int = 115200, timeout: int = 0, waitTime: int = 2, lazy: bool = False):
         """
         ESP Controller connection and communication class
         @param identifierType: DeviceIdentifierType - Type of identifier to use for device identification (default: DeviceIdentifierType.FROM_LIST) [PORT, SERIAL_NUMBER, AUTO_DETECT, FROM_LIST]
         @param identifierString: str - Identifier string to use for device identification (default: '') [PORT, SERIAL_NUMBER]
         @param baudrate: int - Baudrate to use for serial communication (default: 115200)
         @param timeout: int - Timeout for serial communication (default: 0)
-        @param waitTime: int - Wait time for controller to initialize in seconds (default: 2s)
+        @param waitTime: int - Maximum time to wait for the controller to answer the readiness handshake in seconds (default: 2s)
+        @param lazy: bool - Connect on first use of `controller` instead of right away (default: False)
         """
         self.identifierType = identifierType
         self.identifierString = identifierString
@@ -49,9 +97,39 @@ class ESPController:
         self._connectedDevice: str = ''
         self._nodeID: int = 0
         self._hardwareIndex: int = 0
-        self._allowedDevices: dict[int, int] = {}
-        self.controller: serial.Serial | None = self.__connect()
+        self._allowedDevices: Mapping[int, int] = {}
+        self._rxBuffer: bytearray = bytearray()
+        # encoding the board answers in, 'json' lines until it accepts `set_encoding`; see SerialCodec
+        self.encoding: str = 'json'
+        # commands can be pushed from more than one thread (writer and retries); keep each line in one piece
+        self._writeLock: threading.Lock = threading.Lock()
+        self._controller: serial.Serial | None = None
+        self._connectAttempted: bool = False
+        if not lazy:
+            self.connect()
+
+    @property
+    def controller(self) -> serial.Serial | None:
+        if not self._connectAttempted:
+            self.connect()
+        return self._controller
+
+    @controller.setter
+    def controller(self, value: serial.Serial | None) -> None:
+        self._connectAttempted = True
+        self._controller = value
+
+    def connect(self) -> serial.Serial | None:
+        '''
+        Find and connect to the controller. Called on creation, or on first use of `controller` for lazy controllers
+        @return: serial.Serial | None - Serial object if controller connected, None otherwise
+        '''
+        self._connectAttempted = True
+        self._controller = self.__connect()
         self.__initSuccess()
+        if self._controller and self.serialNumber:
+            saveDeviceCache(self.serialNumber, self.controllerPort, self.nodeID, self.hardwareIndex)
+        return self._controller
 
     @property
     def isConnected(self) -> str:
@@ -106,14 +184,14 @@ class ESPController:
     def hardwareIndex(self, value: int) -> None:
         self._hardwareIndex = value
 
-    def __calculateNodeID(self, serialNumber: str) -> int:
+    @staticmethod
+    def calculateNodeID(serialNumber: str) -> int:
         """
         Find the Node ID of the connected controller
         @param serialNumber: str - Serial number of the connected controller
         @return: int - Node ID of the connected controller
         """
-        partialMAC: list[str] = serialNumber.split(':')[-4:]
-        return int(''.join(partialMAC), 16) + 1
+        return nodeIDFromSerialNumber(serialNumber)
 
     @staticmethod
     def listConnectedDevices() -> list[dict[str, str | int]] | None:
@@ -134,59 +212,137 @@ class ESPController:
         '''
         return f"MagnetController Object: {self.identifierType = }, {self.identifierString = }, {self.baudrate = }, {self.timeout = }, {self.waitTime = }, {self.controllerConnected = }, Port: {self.controllerPort}, Serial Number: {self.serialNumber}, Node ID: {self.nodeID}, Controller: {self.controller if self.controllerConnected else None}"
 
+    @staticmethod
+    def handshake(controller: serial.Serial, waitTime: float) -> bool:
+        '''
+        Wait for the firmware to answer a probe command instead of sleeping a fixed time. Boards that are already running answer within milliseconds
+        @param controller: serial.Serial - Freshly opened serial port
+        @param waitTime: float - Maximum time to wait in seconds
+        @return: bool - True if the firmware answered, False if it did not answer within `waitTime`
+        '''
+        timeout = controller.timeout
+        deadline: float = time.monotonic() + waitTime
+        nextProbe: float = 0
+        buffer = bytearray()
+        try:
+            while (now := time.monotonic()) < deadline:
+                # a booting board drops what it receives, so probe again every second
+                if now >= nextProbe:
+                    controller.write(HANDSHAKE_PROBE)
+                    nextProbe = now + 1
+                controller.timeout = min(0.1, deadline - now)
+                buffer += controller.read(controller.in_waiting or 1)
+                *lines, tail = buffer.split(b'\n')
+                buffer = bytearray(tail)
+                for line in lines:
+                    try:
+                        payload = json.loads(line).get('payload', {})
+                    except (ValueError, AttributeError):
+                        # boot messages and anything else that is not a JSON object
+                        continue
+                    if payload.get('req_id') == 0 and 'response' in payload:
+                        return True
+        except serial.SerialException:
+            return False
+        finally:
+            controller.timeout = timeout
+        return False
+
     def __connect(self) -> serial.Serial | None:
         '''
         Private method to connect to the controller based on the identifier type and string
         @return: serial.Serial | None - Serial object if controller connected, None otherwise
         '''
 
-        def __connectDevice(device: list_ports_common.ListPortInfo) -> serial.Serial | None:
+        def __openDevice(device: list_ports_common.ListPortInfo) -> tuple[serial.Serial | None, bool]:
             '''
-            Private method to connect to the found device
-            @param device: list_ports_common.ListPortInfo - Device to connect to
-            @return: serial.Serial | None - Serial object if controller connected, None otherwise
+            Private method to open a device and wait for its firmware to be ready
+            @param device: list_ports_common.ListPortInfo - Device to open
+            @return: tuple[serial.Serial | None, bool] - Serial object (None if the port could not be opened) and whether the firmware answered
+            '''
+            try:
+                controller: serial.Serial = serial.Serial(device.device, self.baudrate, timeout=self.timeout)
+            except serial.SerialException as e:
+                print(f"Could not open {device.device}: {e}")
+                return None, False
+            return controller, self.handshake(controller, self.waitTime)
+
+        def __useDevice(device: list_ports_common.ListPortInfo, controller: serial.Serial) -> serial.Serial:
+            '''
+            Private method to record the device the controller is connected to
+            @param device: list_ports_common.ListPortInfo - Device the controller is open on
+            @param controller: serial.Serial - Open serial object
+            @return: serial.Serial - The same serial object
             '''
-            controller: serial.Serial = serial.Serial(device.device, self.baudrate, timeout=self.timeout)
-            time.sleep(self.waitTime)
             self.connectedDevice = device.device
             self.controllerConnected = True
             self.controllerPort = controller.port   # type: ignore
             self.serialNumber = device.serial_number    # type: ignore
+            if not self.nodeID and self.serialNumber and ':' in self.serialNumber:
+                # boards picked by port or serial number still get their IDs when the serial number is a MAC address
+                try:
+                    self.nodeID = self.calculateNodeID(self.serialNumber)
+                    self.hardwareIndex = AllowedDevicesNodeIDs.get(self.nodeID, 0)
+                except (IndexError, ValueError):
+                    pass
             return controller
 
-        def __connectDeviceFromList(device: list_ports_common.ListPortInfo) -> serial.Serial | None:
+        def __connectDevice(device: list_ports_common.ListPortInfo) -> serial.Serial | None:
             '''
-            Private method to check if device is in allowed list and connect to it
-            @param device: list_ports_common.ListPortInfo - Device to check if allowed and connect to
+            Private method to connect to the found device
+            @param device: list_ports_common.ListPortInfo - Device to connect to
             @return: serial.Serial | None - Serial object if controller connected, None otherwise
             '''
-            try:
-                nodeID: int = self.__calculateNodeID(device.serial_number)  # type: ignore
-            except IndexError:
-                print(f"Invalid Serial Number: {device.serial_number}")
-                return None
-            if nodeID in self._allowedDevices:
-                self.nodeID = nodeID
-                self.hardwareIndex = self._allowedDevices[nodeID]
-                return __connectDevice(device)
-            else:
-                print(f"Device with {device.serial_number = }, {nodeID = } not allowed")
+            controller, _ = __openDevice(device)
+            return __useDevice(device, controller) if controller else None
+
+        def __connectFirstReady(candidates: list[tuple[list_ports_common.ListPortInfo, int]]) -> serial.Serial | None:
+            '''
+            Private method to probe all the allowed candidates in parallel and keep the first one, in candidate order, whose firmware answered
+            @param candidates: list[tuple[list_ports_common.ListPortInfo, int]] - (device, nodeID) pairs, most likely first
+            @return: serial.Serial | None - Serial object if controller connected, None otherwise
+            '''
+            with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+                results = list(executor.map(lambda candidate: __openDevice(candidate[0]), candidates))
+            opened = [(candidate, controller, ready) for candidate, (controller, ready) in zip(candidates, results) if controller]
+            if not opened:
                 return None
+            # fall back to the first port that opened if no firmware answered in time, like the fixed wait used to
+            chosen = next((entry for entry in opened if entry[2]), opened[0])
+            for entry in opened:
+                if entry is not chosen:
+                    entry[1].close()
+            (device, nodeID), controller, _ = chosen
+            self.nodeID = nodeID
+            self.hardwareIndex = self._allowedDevices[nodeID]
+            return __useDevice(device, controller)
 
         serialDevices: list[list_ports_common.ListPortInfo] = list_ports.comports()
-        if not serialDevices:
+        if not serialDevices and self.identifierType != DeviceIdentifierType.PORT:
             print('No serial devices found')
             return None
+        # try the device each board was last found on first
+        cache = loadDeviceCache()
+        serialDevices.sort(key=lambda device: cache.get(device.serial_number, {}).get('port') != device.device)  # type: ignore
         match self.identifierType:
             case DeviceIdentifierType.FROM_LIST:
                 self._allowedDevices = AllowedDevicesNodeIDs
+                candidates: list[tuple[list_ports_common.ListPortInfo, int]] = []
                 for device in serialDevices:
                     # handle 'None' serial numbers; only allow potential MAC addresses
-                    if device.serial_number and ':' in device.serial_number:
-                        _returnedDevice: serial.Serial | None = __connectDeviceFromList(device)
-                        if not _returnedDevice:
-                            continue
-                        return _returnedDevice
+                    if not device.serial_number or ':' not in device.serial_number:
+                        continue
+                    try:
+                        nodeID: int = self.calculateNodeID(device.serial_number)
+                    except (IndexError, ValueError):
+                        print(f"Invalid Serial Number: {device.serial_number}")
+                        continue
+                    if nodeID in self._allowedDevices:
+                        candidates.append((device, nodeID))
+                    else:
+                        print(f"Device with {device.serial_number = }, {nodeID = } not allowed")
+                if candidates:
+                    return __connectFirstReady(candidates)
             case DeviceIdentifierType.AUTO_DETECT:
                 if len(serialDevices) > 1:
                     print("Multiple serial devices found")
@@ -198,6 +354,9 @@ class ESPController:
                 for device in serialDevices:
                     if device.device == self.identifierString:
                         return __connectDevice(device)
+                # ports the system does not list, like the pseudo-terminal of a FakeESP
+                if os.path.exists(self.identifierString):
+                    return __connectDevice(list_ports_common.ListPortInfo(self.identifierString, skip_link_detection=True))
             case DeviceIdentifierType.SERIAL_NUMBER:
                 for device in serialDevices:
                     if device.serial_number == self.identifierString:
@@ -216,30 +375,123 @@ class ESPController:
 
     def push(self, command: str) -> None:
         '''
-        Push a command to the ESP after appendiong a newline character
+        Push a command to the ESP, as a line or a frame depending on `encoding`
         @param command: str - Command to send to the ESP
         '''
         if not self.controllerConnected:
             print("Controller not connected")
         try:
-            self.controller.write((command + '\n').encode()) # type: ignore
+            data: bytes = encodeCommand(command, self.encoding)
+            with self._writeLock:
+                self.controller.write(data) # type: ignore
+            SerialBytes.inc(len(data), 'out')
         except serial.SerialException as e:
             print(f"Error sending command: {command} to {self.controllerPort}: {e}")
 
 
-    def pull(self) -> str:
+    def pushMany(self, commands: list[str]) -> None:
         '''
-        Pull data from the ESP
-        @return: str - Data received from the ESP (Only one line at a time). Returns empty string if no data available
+        Push several commands to the ESP in a single write, one line or frame per command
+        @param commands: list[str] - Commands to send to the ESP
         '''
+        if not commands:
+            return
         if not self.controllerConnected:
             print("Controller not connected")
+        try:
+            if self.encoding == 'json':
+                data: bytes = ('\n'.join(commands) + '\n').encode()
+            else:
+                data = b''.join(encodeCommand(command, self.encoding) for command in commands)
+            with self._writeLock:
+                self.controller.write(data) # type: ignore
+            SerialBytes.inc(len(data), 'out')
+        except serial.SerialException as e:
+            print(f"Error sending {len(commands)} commands to {self.controllerPort}: {e}")
+
+    def setBaudrate(self, baudrate: int) -> None:
+        '''
+        Switch the open port to another line rate once everything written has gone out; bytes received at the old rate are dropped
+        @param baudrate: int - New line rate
+        '''
+        with self._writeLock:
+            try:
+                self.controller.flush()  # type: ignore
+                self.controller.baudrate = baudrate  # type: ignore
+                self.controller.reset_input_buffer()  # type: ignore
+            except serial.SerialException as e:
+                print(f"Error switching {self.controllerPort} to {baudrate} baud: {e}")
+                return
+            self.baudrate = baudrate
+            self._rxBuffer.clear()
+
+    def __setReadTimeout(self, timeout: float | None) -> None:
+        '''
+        Private method to change the read timeout of the open port. pyserial reconfigures the port on every assignment, so skip it when unchanged
+        @param timeout: float | None - New read timeout in seconds
+        '''
+        if self.controller.timeout != timeout:  # type: ignore
+            self.controller.timeout = timeout   # type: ignore
+
+    def __read(self, timeout: float | None = None) -> bytes:
+        '''
+        Private method to read all the raw bytes currently available from the ESP
+        @param timeout: float | None - Seconds to block waiting for data if none is available yet. Returns immediately if None (default: None)
+        @return: bytes - Raw bytes received from the ESP. Returns empty bytes if no data available
+        '''
+        if not self.controllerConnected:
+            print("Controller not connected")
+        data: bytes = b''
         try:
             if self.controller.in_waiting > 0:  # type: ignore
-                return self.controller.read(self.controller.in_waiting).decode()  # type: ignore
+                data = self.controller.read(self.controller.in_waiting)  # type: ignore
+            elif timeout is not None:
+                # block in the driver until the first byte arrives, then take whatever else came with it
+                self.__setReadTimeout(timeout)
+                data = self.controller.read(1)  # type: ignore
+                if data and self.controller.in_waiting > 0:  # type: ignore
+                    data += self.controller.read(self.controller.in_waiting)  # type: ignore
         except serial.SerialException as e:
             print(f"Error receiving data from {self.controllerPort}: {e}")
-        return ''
+        if data:
+            SerialBytes.inc(len(data), 'in')
+        return data
+
+    def pull(self, timeout: float | None = None) -> str:
+        '''
+        Pull data from the ESP
+        @param timeout: float | None - Seconds to block waiting for data if none is available yet. Returns immediately if None (default: None)
+        @return: str - Data received from the ESP (Only one line at a time). Returns empty string if no data available
+        '''
+        return self.__read(timeout).decode(errors='replace')
+
+    def readLines(self, timeout: float | None = None) -> Iterator[str]:
+        '''
+        Pull data from the ESP and yield only complete lines. Partial lines are kept in the receive buffer until the rest arrives on a later call
+        MessagePack frames are yielded as compact JSON lines, so callers read both encodings the same way
+        @param timeout: float | None - Seconds to block waiting for data if none is available yet. Returns immediately if None (default: None)
+        @return: Iterator[str] - Complete lines received from the ESP, without line endings. Empty lines are skipped
+        '''
+        data: bytes = self.__read(timeout)
+        if data:
+            self._rxBuffer += data
+        if b'\x00' not in self._rxBuffer:
+            start: int = 0
+            try:
+                while (end := self._rxBuffer.find(b'\n', start)) != -1:
+                    line: bytes = bytes(self._rxBuffer[start:end]).rstrip(b'\r')
+                    start = end + 1
+                    if line:
+                        yield line.decode(errors='replace')
+            finally:
+                # drop consumed lines once, even if the consumer stopped early
+                del self._rxBuffer[:start]
+            return
+        lines, consumed, malformed = splitReceived(self._rxBuffer)
+        del self._rxBuffer[:consumed]
+        if malformed:
+            SerialLines.inc(malformed, 'malformed_frame')
+        yield from lines
 
     def disconnectESP(self) -> None:
         '''
@@ -249,11 +501,151 @@ class ESPController:
             self.controller.close()  # type: ignore
 
 
+
+class ESPControllerPool:
+    """
+    Manager for every allowed ESP connected to this host. Reads from all the boards are multiplexed through one selector and commands are routed to a board by its Node ID or Hardware Index
+    @param allowedDevices: Mapping[int, int] | None - Node ID to Hardware Index map of boards to open (default: AllowedDevicesNodeIDs)
+    @param baudrate: int - Baudrate to use for serial communication (default: 115200)
+    @param waitTime: int - Maximum time to wait for each controller to answer the readiness handshake in seconds; boards are probed in parallel (default: 2s)
+    @param queueFactory: Callable[[], queue.Queue] - Builds the command queue of each board (default: queue.Queue)
+    """
+    # fallback poll interval in seconds on platforms where serial ports cannot be registered with a selector (Windows)
+    pollInterval: float = 0.01
+
+    def __init__(self, allowedDevices: Mapping[int, int] | None = None, baudrate: int = 115200, waitTime: int = 2, queueFactory: Callable[[], queue.Queue] = queue.Queue):
+        self.baudrate = baudrate
+        self.waitTime = waitTime
+        self._queueFactory = queueFactory
+        self._allowedDevices: Mapping[int, int] = AllowedDevicesNodeIDs if allowedDevices is None else allowedDevices
+        # Node ID -> controller, in the order the boards were opened
+        self.nodes: dict[int, ESPController] = {}
+        # Hardware Index -> Node ID
+        self._hardwareIndexes: dict[int, int] = {}
+        # Node ID -> commands waiting to be pushed to that board
+        self.queues: dict[int, queue.Queue] = {}
+        self._selector: selectors.BaseSelector | None = None
+        self.__connectAll()
+
+    def __repr__(self) -> str:
+        return f"ESPControllerPool Object: {self.baudrate = }, {self.waitTime = }, Boards: {[node.hardwareIndex for node in self.nodes.values()]}"
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def primary(self) -> ESPController | None:
+        '''
+        @return: ESPController | None - First board opened by the pool, or None if no boards are connected
+        '''
+        return next(iter(self.nodes.values()), None)
+
+    def __connectAll(self) -> None:
+        '''
+        Private method to open every allowed device found and register it with the read selector
+        '''
+        serialDevices: list[list_ports_common.ListPortInfo] = list_ports.comports()
+        candidates: dict[int, str] = {}
+        for device in serialDevices:
+            # handle 'None' serial numbers; only allow potential MAC addresses
+            if not device.serial_number or ':' not in device.serial_number:
+                continue
+            try:
+                nodeID: int = ESPController.calculateNodeID(device.serial_number)
+            except (IndexError, ValueError):
+                print(f"Invalid Serial Number: {device.serial_number}")
+                continue
+            if nodeID in self._allowedDevices and nodeID not in candidates:
+                candidates[nodeID] = device.device
+
+        if not candidates:
+            print('No allowed ESPs found to connect to.')
+            return
+        # open and handshake with all the boards at once, so startup takes as long as the slowest board rather than the sum
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            opened = list(executor.map(lambda port: ESPController(identifierType=DeviceIdentifierType.PORT, identifierString=port, baudrate=self.baudrate, waitTime=self.waitTime), candidates.values()))
+        for nodeID, node in zip(candidates, opened):
+            if not node.controller:
+                continue
+            node.nodeID = nodeID
+            node.hardwareIndex = self._allowedDevices[nodeID]
+            self.nodes[nodeID] = node
+            self._hardwareIndexes[node.hardwareIndex] = nodeID
+            self.queues[nodeID] = self._queueFactory()
+        if not self.nodes:
+            print('No allowed ESPs found to connect to.')
+            return
+
+        # serial ports only expose a file descriptor on POSIX; everywhere else the pool polls the boards instead
+        if all(callable(getattr(node.controller, 'fileno', None)) for node in self.nodes.values()):
+            self._selector = selectors.DefaultSelector()
+            for nodeID, node in self.nodes.items():
+                self._selector.register(node.controller, selectors.EVENT_READ, nodeID)  # type: ignore
+        print(f"ESP Pool Connected: {len(self.nodes)} boards, Hardware Indexes: {sorted(self._hardwareIndexes)}")
+
+    def resolve(self, target: int) -> ESPController | None:
+        '''
+        Find a connected board by Node ID or Hardware Index
+        @param target: int - Node ID or Hardware Index of the board
+        @return: ESPController | None - Controller of the board, or None if no such board is connected
+        '''
+        if target in self.nodes:
+            return self.nodes[target]
+        if target in self._hardwareIndexes:
+            return self.nodes[self._hardwareIndexes[target]]
+        return None
+
+    def submit(self, target: int, command: str, reply: Callable[[dict], None] | None = None) -> bool:
+        '''
+        Queue a command for a board
+        @param target: int - Node ID or Hardware Index of the board
+        @param command: str - Command to queue for the board
+        @param reply: Callable[[dict], None] | None - Called with the board's answer to the command (default: None)
+        @return: bool - True if the command was queued, False if no such board is connected
+        '''
+        node = self.resolve(target)
+        if node is None:
+            return False
+        self.queues[node.nodeID].put((command, reply))
+        return True
+
+    def readLines(self, timeout: float | None = None) -> Iterator[tuple[ESPController, str]]:
+        '''
+        Pull data from all the boards and yield complete lines along with the board they came from
+        @param timeout: float | None - Seconds to block waiting for any board to send data. Returns immediately if None (default: None)
+        @return: Iterator[tuple[ESPController, str]] - (board, line) pairs for every complete line received
+        '''
+        if self._selector is None:
+            received: bool = False
+            for node in self.nodes.values():
+                for line in node.readLines():
+                    received = True
+                    yield node, line
+            if not received and timeout:
+                time.sleep(min(timeout, self.pollInterval))
+            return
+        for key, _ in self._selector.select(timeout):
+            node = self.nodes[key.data]
+            for line in node.readLines():
+                yield node, line
+
+    def disconnectAll(self) -> None:
+        '''
+        Close the serial connections of all the boards
+        '''
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for node in self.nodes.values():
+            node.disconnectESP()
+
+
 # Instantiate an object and make it available for export
-HWNode = ESPController(identifierType=DeviceIdentifierType.FROM_LIST)
+# Connects on first use, so importing this module does not touch the serial ports
+HWNode = ESPController(identifierType=DeviceIdentifierType.FROM_LIST, lazy=True)
 
-####### Root Node: uncomment this and comment line 253
-# HWNode = ESPController(identifierType=DeviceIdentifierType.SERIAL_NUMBER, identifierString='0001')
+####### Root Node: uncomment this and comment the line above
+# HWNode = ESPController(identifierType=DeviceIdentifierType.SERIAL_NUMBER, identifierString='0001', lazy=True)
 
 if __name__ == '__main__':
     # print(ESPController.listConnectedDevices())
@@ -0,0 +1,295 @@
+'''
+Module to index the mesh topology reported by the board.
+The firmware reports the topology as a nested `{nodeId, subs}` tree rooted at the board connected to this device; Topology flattens it once so that structural queries do not walk the JSON again.
+'''
+import json
+import time
+
+from collections.abc import Mapping
+
+from DeviceList import AllowedDevicesNodeIDs
+
+class Topology:
+    """
+    Flat, pre-order index of a mesh topology tree.
+    Every node gets a position in pre-order; parent, depth and subtree size are stored per position, so a node's subtree is the contiguous range [position, position + subtree size).
+    @param tree: dict - Nested `{nodeId, subs}` topology as reported by the board
+    @param allowedDevices: Mapping[int, int] | None - Node ID to Hardware Index map used to join hardware indexes (default: AllowedDevicesNodeIDs)
+    """
+
+    def __init__(self, tree: dict, allowedDevices: Mapping[int, int] | None = None):
+        self._allowedDevices: Mapping[int, int] = AllowedDevicesNodeIDs if allowedDevices is None else allowedDevices
+        # position -> Node ID, parent position (-1 for the root), depth and subtree size
+        self.nodeIDs: list[int] = []
+        self.parents: list[int] = []
+        self.depths: list[int] = []
+        self.subtreeSizes: list[int] = []
+        # Node ID -> position
+        self.positions: dict[int, int] = {}
+        self.leaves: list[int] = []
+        self.__index(tree)
+
+    def __repr__(self) -> str:
+        return f"Topology Object: Root: {self.root}, Nodes: {len(self)}, Height: {self.height}, Leaves: {len(self.leaves)}"
+
+    def __len__(self) -> int:
+        return len(self.nodeIDs)
+
+    def __contains__(self, nodeID: int) -> bool:
+        return nodeID in self.positions
+
+    def __iter__(self):
+        return iter(self.nodeIDs)
+
+    def __index(self, tree: dict) -> None:
+        '''
+        Private method to flatten the tree with an explicit stack, so deep meshes do not hit the recursion limit
+        @param tree: dict - Nested `{nodeId, subs}` topology
+        '''
+        if not tree or 'nodeId' not in tree:
+            return
+        stack: list[tuple[dict, int, int]] = [(tree, -1, 0)]
+        while stack:
+            subtree, parent, depth = stack.pop()
+            nodeID: int = subtree['nodeId']
+            if nodeID in self.positions:
+                # a node reported twice while the mesh is re-forming; keep its first position
+                continue
+            position: int = len(self.nodeIDs)
+            self.positions[nodeID] = position
+            self.nodeIDs.append(nodeID)
+            self.parents.append(parent)
+            self.depths.append(depth)
+            self.subtreeSizes.append(1)
+            subs: list[dict] = subtree.get('subs') or []
+            if not subs:
+                self.leaves.append(nodeID)
+            # reversed so children come out of the stack, and into pre-order, in reported order
+            for sub in reversed(subs):
+                stack.append((sub, position, depth + 1))
+
+        # children always come after their parent in pre-order, so one backward pass accumulates subtree sizes
+        for position in range(len(self.nodeIDs) - 1, 0, -1):
+            self.subtreeSizes[self.parents[position]] += self.subtreeSizes[position]
+
+    @property
+    def root(self) -> int | None:
+        '''
+        @return: int | None - Node ID of the root (the board connected to this device), or None for an empty topology
+        '''
+        return self.nodeIDs[0] if self.nodeIDs else None
+
+    @property
+    def height(self) -> int:
+        '''
+        @return: int - Largest depth of any node; 0 for a lone root
+        '''
+        return max(self.depths, default=0)
+
+    def parentOf(self, nodeID: int) -> int | None:
+        '''
+        @param nodeID: int - Node ID to look up
+        @return: int | None - Node ID of the parent, or None for the root
+        @raise KeyError: if the node is not in the topology
+        '''
+        parent: int = self.parents[self.positions[nodeID]]
+        return None if parent < 0 else self.nodeIDs[parent]
+
+    def depthOf(self, nodeID: int) -> int:
+        '''
+        @param nodeID: int - Node ID to look up
+        @return: int - Number of hops from the root
+        @raise KeyError: if the node is not in the topology
+        '''
+        return self.depths[self.positions[nodeID]]
+
+    def subtreeSizeOf(self, nodeID: int) -> int:
+        '''
+        @param nodeID: int - Node ID to look up
+        @return: int - Number of nodes in the subtree rooted at the node, including itself
+        @raise KeyError: if the node is not in the topology
+        '''
+        return self.subtreeSizes[self.positions[nodeID]]
+
+    def childrenOf(self, nodeID: int) -> list[int]:
+        '''
+        @param nodeID: int - Node ID to look up
+        @return: list[int] - Node IDs of the direct children, in reported order
+        @raise KeyError: if the node is not in the topology
+        '''
+        position: int = self.positions[nodeID]
+        children: list[int] = []
+        child: int = position + 1
+        end: int = position + self.subtreeSizes[position]
+        # children are the starts of consecutive subtrees inside the parent's range
+        while child < end:
+            children.append(self.nodeIDs[child])
+            child += self.subtreeSizes[child]
+        return children
+
+    def isAncestor(self, ancestorID: int, nodeID: int) -> bool:
+        '''
+        @param ancestorID: int - Node ID of the possible ancestor
+        @param nodeID: int - Node ID of the possible descendant
+        @return: bool - True if `nodeID` is in the subtree of `ancestorID` (a node is its own ancestor)
+        @raise KeyError: if either node is not in the topology
+        '''
+        ancestor: int = self.positions[ancestorID]
+        return ancestor <= self.positions[nodeID] < ancestor + self.subtreeSizes[ancestor]
+
+    def pathToRoot(self, nodeID: int) -> list[int]:
+        '''
+        @param nodeID: int - Node ID to start from
+        @return: list[int] - Node IDs from the node up to and including the root
+        @raise KeyError: if the node is not in the topology
+        '''
+        path: list[int] = []
+        position: int = self.positions[nodeID]
+        while position >= 0:
+            path.append(self.nodeIDs[position])
+            position = self.parents[position]
+        return path
+
+    def hops(self, nodeA: int, nodeB: int) -> int:
+        '''
+        Number of mesh hops between two nodes, through their lowest common ancestor
+        @param nodeA: int - Node ID of one end
+        @param nodeB: int - Node ID of the other end
+        @return: int - Hop count; 0 if both are the same node
+        @raise KeyError: if either node is not in the topology
+        '''
+        a: int = self.positions[nodeA]
+        b: int = self.positions[nodeB]
+        distance: int = 0
+        while self.depths[a] > self.depths[b]:
+            a = self.parents[a]
+            distance += 1
+        while self.depths[b] > self.depths[a]:
+            b = self.parents[b]
+            distance += 1
+        while a != b:
+            a = self.parents[a]
+            b = self.parents[b]
+            distance += 2
+        return distance
+
+    def largestSubtree(self, nodeID: int | None = None) -> int | None:
+        '''
+        @param nodeID: int | None - Node ID whose children to compare (default: the root)
+        @return: int | None - Node ID of the child heading the largest subtree, or None if the node has no children
+        @raise KeyError: if the node is not in the topology
+        '''
+        if nodeID is None:
+            nodeID = self.root
+            if nodeID is None:
+                return None
+        return max(self.childrenOf(nodeID), key=self.subtreeSizeOf, default=None)
+
+    def hardwareIndexOf(self, nodeID: int) -> int | None:
+        '''
+        @param nodeID: int - Node ID to look up
+        @return: int | None - Hardware Index of the board, or None if it is not in the allowed device list
+        '''
+        return self._allowedDevices.get(nodeID)
+
+    def hardwareIndexes(self) -> dict[int, int]:
+        '''
+        @return: dict[int, int] - Hardware Index to Node ID for every allowed board present in the topology
+        '''
+        return {self._allowedDevices[nodeID]: nodeID for nodeID in self.nodeIDs if nodeID in self._allowedDevices}
+
+
+    def diff(self, previous: 'Topology') -> 'TopologyDiff':
+        '''
+        Structural changes from an earlier topology to this one.
+        A node that kept its parent moves with it, so its depth change follows from an ancestor's move and is not listed:
+        moving a subtree reports the node that moved, not every node below it
+        @param previous: Topology - Earlier topology of the same mesh
+        @return: TopologyDiff - Nodes that joined, left, or moved to another parent, and the depth change of each that moved
+        '''
+        changes = TopologyDiff()
+        for nodeID, position in self.positions.items():
+            oldPosition: int | None = previous.positions.get(nodeID)
+            if oldPosition is None:
+                changes.joined.append(nodeID)
+                continue
+            oldParent: int = previous.parents[oldPosition]
+            oldParentID: int | None = None if oldParent < 0 else previous.nodeIDs[oldParent]
+            newParentID: int | None = None if self.parents[position] < 0 else self.nodeIDs[self.parents[position]]
+            if oldParentID == newParentID:
+                continue
+            changes.reparented.append((nodeID, oldParentID, newParentID))
+            if previous.depths[oldPosition] != self.depths[position]:
+                changes.depthChanged.append((nodeID, previous.depths[oldPosition], self.depths[position]))
+        changes.left = [nodeID for nodeID in previous.nodeIDs if nodeID not in self.positions]
+        return changes
+
+
+class TopologyDiff:
+    """
+    Structural changes between two topologies of the same mesh. Falsy when nothing changed
+    """
+
+    def __init__(self):
+        self.joined: list[int] = []
+        self.left: list[int] = []
+        # (Node ID, old parent, new parent); a parent of None means the node is the root
+        self.reparented: list[tuple[int, int | None, int | None]] = []
+        # (Node ID, old depth, new depth) of re-parented nodes; the nodes below them moved by the same amount
+        self.depthChanged: list[tuple[int, int, int]] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.joined or self.left or self.reparented or self.depthChanged)
+
+    def __repr__(self) -> str:
+        return f"+{len(self.joined)} joined, -{len(self.left)} left, {len(self.reparented)} re-parented, {len(self.depthChanged)} depth changes"
+
+    def toDict(self) -> dict[str, list]:
+        return {
+            'joined': self.joined,
+            'left': self.left,
+            'reparented': [{'nodeId': nodeID, 'from': old, 'to': new} for nodeID, old, new in self.reparented],
+            'depth_changed': [{'nodeId': nodeID, 'from': old, 'to': new} for nodeID, old, new in self.depthChanged],
+        }
+
+
+class TopologyWatcher:
+    """
+    Keeps the last topology reported by one board and works out what changed with every new one
+    @param journalFile: str | None - File to append every non-empty change set to, one JSON object per line (default: None, no journal)
+    """
+
+    def __init__(self, journalFile: str | None = None):
+        self.journalFile = journalFile
+        self.topology: Topology | None = None
+        # changes found by the latest update; None until there are two topologies to compare
+        self.changes: TopologyDiff | None = None
+
+    def update(self, topology: Topology) -> TopologyDiff | None:
+        '''
+        Record a new topology
+        @param topology: Topology - Topology just reported by the board
+        @return: TopologyDiff | None - Changes since the previous topology, or None for the first one
+        '''
+        previous: Topology | None = self.topology
+        self.topology = topology
+        if previous is None:
+            return None
+        changes = self.changes = topology.diff(previous)
+        if changes and self.journalFile:
+            with open(self.journalFile, 'a') as ofile:
+                json.dump({'time': time.time(), 'root': topology.root, **changes.toDict()}, ofile)
+                ofile.write('\n')
+        return changes
+
+if __name__ == '__main__':
+    import json
+    import os
+
+    dataFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'esp-firmware', 'root-node', 'lib', 'data.json')
+    with open(dataFile) as ifile:
+        topology = Topology(json.load(ifile))
+    print(topology)
+    print(f"Leaves: {topology.leaves}")
+    print(f"Largest subtree: {topology.largestSubtree()}")
+    print(f"Hops between {topology.leaves[0]} and {topology.leaves[-1]}: {topology.hops(topology.leaves[0], topology.leaves[-1])}")
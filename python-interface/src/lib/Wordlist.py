@@ -0,0 +1,170 @@
+'''
+Module to index the word list that `ping_node` payloads are made of.
+A payload is five words run together without separators, so telling a good decryption from a bad one means finding words in a string.
+WordlistIndex keeps the words sorted for sampling and in a trie for segmenting, and can be saved to a binary cache next to the source file.
+'''
+import os
+import pickle
+import random
+
+from collections.abc import Iterable
+
+# marks the end of a word in a trie node; never a character of a word
+END = ''
+# bump when the cache layout changes, so older caches are rebuilt
+CACHE_VERSION = 1
+
+class WordlistIndex:
+    """
+    Sorted, de-duplicated lower case words with a trie over them, for sampling payloads and checking decryptions
+    @param words: Iterable[str] - Words to index; blank ones are skipped
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words: tuple[str, ...] = tuple(sorted({word.strip().lower() for word in words if word.strip()}))
+        # nested {character: node} dicts; END in a node means a word ends there
+        self.trie: dict = {}
+        for word in self.words:
+            node = self.trie
+            for character in word:
+                node = node.setdefault(character, {})
+            node[END] = True
+        self.longest: int = max(map(len, self.words), default=0)
+
+    def __repr__(self) -> str:
+        return f"WordlistIndex Object: {len(self.words) = }, {self.longest = }"
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        node = self.trie
+        for character in word.lower():
+            node = node.get(character)
+            if node is None:
+                return False
+        return END in node
+
+    @classmethod
+    def load(cls, path: str, cachePath: str | None = None) -> 'WordlistIndex':
+        '''
+        Index a word list file, one word per line, going through the binary cache if one is given
+        @param path: str - Word list file
+        @param cachePath: str | None - Cache file; used if it was built from the same version of `path`, rebuilt otherwise (default: None, no cache)
+        @return: WordlistIndex - The index
+        @raise OSError: if the word list cannot be read
+        '''
+        stat = os.stat(path)
+        signature = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+        if cachePath is not None:
+            try:
+                with open(cachePath, 'rb') as ifile:
+                    cached = pickle.load(ifile)
+                if cached.get('signature') == signature:
+                    index = cls.__new__(cls)
+                    index.words, index.trie, index.longest = cached['words'], cached['trie'], cached['longest']
+                    return index
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError, TypeError):
+                pass
+
+        with open(path) as ifile:
+            index = cls(ifile.read().split())
+        if cachePath is not None:
+            try:
+                with open(cachePath, 'wb') as ofile:
+                    pickle.dump({'signature': signature, 'words': index.words, 'trie': index.trie, 'longest': index.longest}, ofile, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                print(f"Could not write word list cache {cachePath}: {e}")
+        return index
+
+    def sample(self, count: int, generator: random.Random | None = None) -> list[str]:
+        '''
+        @param count: int - Number of distinct words
+        @param generator: random.Random | None - Source of randomness (default: None, the `random` module)
+        @return: list[str] - Words picked at random, each by its position, without repeats
+        @raise ValueError: if there are fewer than `count` words
+        '''
+        if count > len(self.words):
+            raise ValueError(f'Cannot pick {count} words out of {len(self.words)}')
+        randrange = (generator or random).randrange
+        # a few draws per word; repeats are rare while `count` is much smaller than the list
+        indexes: list[int] = []
+        while len(indexes) < count:
+            index: int = randrange(len(self.words))
+            if index not in indexes:
+                indexes.append(index)
+        return [self.words[index] for index in indexes]
+
+    def wordsAt(self, text: str, start: int) -> list[int]:
+        '''
+        @param text: str - Lower case text
+        @param start: int - Position in `text`
+        @return: list[int] - End positions of every word that starts at `start`
+        '''
+        ends: list[int] = []
+        node = self.trie
+        for position in range(start, len(text)):
+            node = node.get(text[position])
+            if node is None:
+                break
+            if END in node:
+                ends.append(position + 1)
+        return ends
+
+    def __bestCover(self, text: str) -> list[tuple[int, int, int]]:
+        '''
+        Private method to place words over a text so they cover as many characters as possible, with as few words as possible
+        @return: list[tuple[int, int, int]] - For each prefix length: characters covered, minus the words used, and where the last word starts (-1 for an uncovered character)
+        '''
+        best: list[tuple[int, int, int]] = [(0, 0, -1)] + [(-1, 0, -1)] * len(text)
+        for start in range(len(text)):
+            covered, words, _ = best[start]
+            # leave this character uncovered
+            if (covered, words) > best[start + 1][:2]:
+                best[start + 1] = (covered, words, -1)
+            for end in self.wordsAt(text, start):
+                if (covered + end - start, words - 1) > best[end][:2]:
+                    best[end] = (covered + end - start, words - 1, start)
+        return best
+
+    def segment(self, text: str) -> list[str] | None:
+        '''
+        Split a payload back into its words
+        @param text: str - Words run together, like a `ping_node` payload
+        @return: list[str] | None - The fewest words that make up the whole text, or None if it cannot be made of words of the list
+        '''
+        lowered: str = text.lower()
+        best = self.__bestCover(lowered)
+        if best[-1][0] != len(text):
+            return None
+        words: list[str] = []
+        end: int = len(text)
+        while end > 0:
+            start: int = best[end][2]
+            words.append(text[start:end])
+            end = start
+        return words[::-1]
+
+    def coverage(self, text: str) -> float:
+        '''
+        @param text: str - Candidate plaintext
+        @return: float - Share of the characters of `text` that words of the list can cover, 0 to 1
+        '''
+        if not text:
+            return 0.0
+        return self.__bestCover(text.lower())[-1][0] / len(text)
+
+    def plausibility(self, text: str, words: int | None = None) -> float:
+        '''
+        How much a candidate decryption looks like a payload: the share of it covered by words, reduced when it takes more words than a payload has
+        @param text: str - Candidate plaintext
+        @param words: int | None - Number of words payloads are made of; None to not check (default: None)
+        @return: float - 0 (nothing like a payload) to 1 (made entirely of words of the list)
+        '''
+        if not text:
+            return 0.0
+        covered, negativeWords, _ = self.__bestCover(text.lower())[-1]
+        score: float = covered / len(text)
+        if words is not None and -negativeWords > words:
+            score *= words / -negativeWords
+        return score
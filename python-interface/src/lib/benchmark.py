@@ -0,0 +1,287 @@
+'''
+End-to-end benchmark of the command path: client socket -> client_handler -> command queue -> CommandParser.create_payload -> ESPController.push,
+and back through the board's answer -> ESPController.readLines -> handle_line -> reply frame.
+The controller runs as its own process (`main_controller.py --port`), exactly as in the room; the board is a simulated mesh unless `--port` names a real one.
+
+    python benchmark.py                                  # default matrix against simulated meshes
+    python benchmark.py --clients 1,8 --bursts 1,16      # a smaller matrix
+    python benchmark.py --port /dev/ttyUSB0              # a real board; its own mesh sets the topology size
+    python benchmark.py --encoding msgpack               # the same matrix over MessagePack frames
+    python benchmark.py --max-baudrate 115200            # without raising the line rate
+
+Results are written as JSON to BENCHMARK_DIR, named after the commit, so runs on two commits can be compared number by number.
+'''
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from Config import BENCHMARK_DIR, CLIENT_REPLY_TIMEOUT, EXIT_COMMAND, LIB_DIR, SERIAL_BAUD_RATES, SERIAL_ENCODING, SOCK_HOST, SOCK_PORT
+from SerialCodec import ENCODINGS
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    '''
+    @param values: list[float] - Sorted values
+    @param fraction: float - Percentile as a fraction, e.g. 0.99
+    @return: float | None - Nearest-rank percentile, or None for no values
+    '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def gitCommit() -> str:
+    '''
+    @return: str - Short hash of the checked out commit, with '-dirty' if there are local changes, or 'unknown'
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=LIB_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=LIB_DIR, capture_output=True, text=True).stdout.strip()
+        return f'{commit}-dirty' if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def startController(port: str, useAsyncio: bool = False, timeout: float = 30, encoding: str = SERIAL_ENCODING, maxBaudrate: int = SERIAL_BAUD_RATES[0]) -> subprocess.Popen:
+    '''
+    Start main_controller.py on a board and wait until it accepts clients
+    @param port: str - Serial port of the board
+    @param useAsyncio: bool - Serve clients from the asyncio event loop (default: False)
+    @param timeout: float - Seconds to wait for the server to come up (default: 30s)
+    @param encoding: str - Encoding the controller asks of the board (default: SERIAL_ENCODING)
+    @param maxBaudrate: int - Fastest line rate the controller negotiates (default: the fastest of SERIAL_BAUD_RATES)
+    @return: subprocess.Popen - The controller process
+    @raise RuntimeError: if the controller exits or does not accept connections in time
+    '''
+    command = [sys.executable, os.path.join(LIB_DIR, 'main_controller.py'), '--port', port, '--encoding', encoding, '--max-baudrate', str(maxBaudrate)] + (['--asyncio'] if useAsyncio else [])
+    # its console output is part of the cost being measured, but nobody reads it
+    process = subprocess.Popen(command, cwd=LIB_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline: float = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Controller exited with code {process.returncode}; is a board on {port}?')
+        try:
+            # the controller treats an empty line as nothing, so probing costs no command
+            with socket.create_connection((SOCK_HOST, SOCK_PORT), timeout=1) as probe:
+                probe.sendall(b'\n')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'Controller did not accept connections within {timeout}s')
+
+def stopController(process: subprocess.Popen) -> None:
+    try:
+        with socket.create_connection((SOCK_HOST, SOCK_PORT), timeout=1) as connection:
+            connection.sendall(f'{EXIT_COMMAND}\n'.encode())
+        process.wait(timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        process.kill()
+        process.wait()
+
+
+class BenchmarkClient:
+    """
+    One client connection that sends commands in bursts and times each reply.
+    Commands of a burst are sent back to back without waiting; replies are matched to commands by the echoed command string
+    @param nodeIDs: list[int] - Node IDs to ping
+    @param topologyShare: float - Fraction of commands that are `get_topology` instead of `ping_node`
+    @param seed: int - Seed for the command mix
+    """
+
+    def __init__(self, nodeIDs: list[int], topologyShare: float, seed: int):
+        self.nodeIDs = nodeIDs
+        self.topologyShare = topologyShare
+        self._random = random.Random(seed)
+        self._seed = seed
+        self._count: int = 0
+        self.connection = socket.create_connection((SOCK_HOST, SOCK_PORT))
+        self._buffer = bytearray()
+        self.latencies: dict[str, list[float]] = collections.defaultdict(list)
+        self.errors: int = 0
+        self.timeouts: int = 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __command(self) -> tuple[str, str]:
+        '''
+        Private method to make the next command; ping messages are numbered so every reply matches exactly one command
+        @return: tuple[str, str] - Command type and command string
+        '''
+        self._count += 1
+        if self._random.random() < self.topologyShare:
+            return 'get_topology', 'get_topology'
+        nodeID: int = self._random.choice(self.nodeIDs)
+        return 'ping_node', f'ping_node {nodeID} #{self._random.randrange(2 ** 24):06x} bench{self._seed}x{self._count}'
+
+    def burst(self, size: int) -> None:
+        '''
+        Send `size` commands at once and wait for all their replies
+        @param size: int - Number of commands in the burst
+        '''
+        commands: list[tuple[str, str]] = [self.__command() for _ in range(size)]
+        # the same command string may be in flight more than once (get_topology); answer them first in, first out
+        waiting: dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        start: float = time.perf_counter()
+        for kind, command in commands:
+            waiting[command].append(kind)
+        self.connection.sendall(''.join(f'{command}\n' for _, command in commands).encode())
+
+        remaining: int = size
+        deadline: float = time.monotonic() + CLIENT_REPLY_TIMEOUT
+        while remaining:
+            end: int = self._buffer.find(b'\n')
+            if end == -1:
+                timeLeft: float = deadline - time.monotonic()
+                if timeLeft <= 0:
+                    break
+                self.connection.settimeout(timeLeft)
+                try:
+                    data: bytes = self.connection.recv(65536)
+                except socket.timeout:
+                    break
+                if not data:
+                    raise ConnectionError('Controller closed the connection')
+                self._buffer += data
+                continue
+            frame: dict = json.loads(self._buffer[:end])
+            del self._buffer[:end + 1]
+            kinds = waiting.get(frame.get('cmd', ''))
+            if not kinds:
+                # a late reply to a command of an earlier, timed out burst
+                continue
+            kind: str = kinds.popleft()
+            remaining -= 1
+            if 'error' in frame:
+                self.errors += 1
+            else:
+                self.latencies[kind].append(time.perf_counter() - start)
+        self.timeouts += remaining
+
+
+def runCase(nodeIDs: list[int], clients: int, burst: int, rounds: int, topologyShare: float) -> dict:
+    '''
+    Run `clients` clients in parallel, each sending `rounds` bursts of `burst` commands
+    @return: dict - Latency percentiles in ms, throughput and failure counts
+    '''
+    benchmarkClients: list[BenchmarkClient] = [BenchmarkClient(nodeIDs, topologyShare, seed) for seed in range(clients)]
+    barrier = threading.Barrier(clients)
+    failures: list[Exception] = []
+
+    def work(client: BenchmarkClient) -> None:
+        barrier.wait()
+        try:
+            for _ in range(rounds):
+                client.burst(burst)
+        except (OSError, ValueError) as e:
+            failures.append(e)
+
+    threads: list[threading.Thread] = [threading.Thread(target=work, args=(client,)) for client in benchmarkClients]
+    start: float = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed: float = time.perf_counter() - start
+    for client in benchmarkClients:
+        client.close()
+
+    result: dict = {'clients': clients, 'burst': burst, 'rounds': rounds}
+    everything: list[float] = []
+    for kind in ('ping_node', 'get_topology'):
+        latencies: list[float] = sorted(latency for client in benchmarkClients for latency in client.latencies[kind])
+        everything += latencies
+        result[kind] = {
+            'count': len(latencies),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        }
+    everything.sort()
+    result.update({
+        'p50_ms': round(percentile(everything, 0.5) * 1000, 3) if everything else None,
+        'p99_ms': round(percentile(everything, 0.99) * 1000, 3) if everything else None,
+        'max_ms': round(everything[-1] * 1000, 3) if everything else None,
+        'commands_per_s': round(len(everything) / elapsed, 1),
+        'errors': sum(client.errors for client in benchmarkClients),
+        'timeouts': sum(client.timeouts for client in benchmarkClients),
+        'client_failures': [str(e) for e in failures],
+        'elapsed_s': round(elapsed, 3),
+    })
+    return result
+
+def runSuite(args: argparse.Namespace) -> dict:
+    '''
+    Run every combination of topology size, client count and burst size
+    @return: dict - Run metadata and one result per combination
+    '''
+    from MeshSimulator import MeshSimulator
+
+    clientCounts: list[int] = [int(count) for count in args.clients.split(',')]
+    bursts: list[int] = [int(burst) for burst in args.bursts.split(',')]
+    # a real board brings its own mesh; 0 stands for "whatever it reports"
+    sizes: list[int] = [0] if args.port else [int(size) for size in args.nodes.split(',')]
+    report: dict = {
+        'meta': {
+            'commit': gitCommit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'target': args.port or 'simulated',
+            'board_latency_s': None if args.port else args.board_latency,
+            'baudrate': None if args.port or args.no_throttle else 115200,
+            'asyncio': args.asyncio,
+            'encoding': args.encoding,
+            'max_baudrate': args.max_baudrate,
+            'topology_share': args.topology_share,
+        },
+        'results': [],
+    }
+    for size in sizes:
+        simulator = None
+        if args.port:
+            port, nodeIDs = args.port, [1]
+        else:
+            simulator = MeshSimulator(size, seed=size, latency=args.board_latency, baudrate=None if args.no_throttle else 115200).start()
+            port, nodeIDs = simulator.port, list(simulator.parents)
+        controller = startController(port, args.asyncio, encoding=args.encoding, maxBaudrate=args.max_baudrate)
+        try:
+            for clients in clientCounts:
+                for burst in bursts:
+                    result = runCase(nodeIDs, clients, burst, args.rounds, args.topology_share)
+                    result['nodes'] = size or None
+                    report['results'].append(result)
+                    print(f"nodes={size or '?':>5} clients={clients:>3} burst={burst:>3}  p50={result['p50_ms']} ms  p99={result['p99_ms']} ms  {result['commands_per_s']} cmd/s  errors={result['errors']} timeouts={result['timeouts']}")
+        finally:
+            stopController(controller)
+            if simulator is not None:
+                simulator.stop()
+    return report
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='End-to-end benchmark of the controller command path')
+    arg_parser.add_argument('--port', help='benchmark the board on this serial port instead of simulated meshes')
+    arg_parser.add_argument('--nodes', default='1,77,770', help='comma separated simulated mesh sizes (default: 1,77,770)')
+    arg_parser.add_argument('--clients', default='1,4', help='comma separated numbers of parallel clients (default: 1,4)')
+    arg_parser.add_argument('--bursts', default='1,8,32', help='comma separated commands sent back to back per burst (default: 1,8,32)')
+    arg_parser.add_argument('--rounds', type=int, default=20, help='bursts per client per combination (default: 20)')
+    arg_parser.add_argument('--topology-share', type=float, default=0.1, help='fraction of commands that are get_topology (default: 0.1)')
+    arg_parser.add_argument('--board-latency', type=float, default=0.002, help='seconds the simulated board takes per command (default: 0.002)')
+    arg_parser.add_argument('--no-throttle', action='store_true', help='do not limit the simulated serial line to 115200 baud')
+    arg_parser.add_argument('--asyncio', action='store_true', help='run the controller with --asyncio')
+    arg_parser.add_argument('--encoding', choices=ENCODINGS, default=SERIAL_ENCODING, help=f'encoding the controller asks of the board (default: {SERIAL_ENCODING})')
+    arg_parser.add_argument('--max-baudrate', type=int, default=SERIAL_BAUD_RATES[0], help=f'fastest line rate the controller negotiates with the board (default: {SERIAL_BAUD_RATES[0]})')
+    arg_parser.add_argument('--output', metavar='FILE', help=f'where to write the results (default: {BENCHMARK_DIR}/e2e-<commit>-<time>.json)')
+    args = arg_parser.parse_args()
+
+    report = runSuite(args)
+    output: str = args.output or os.path.join(BENCHMARK_DIR, f"e2e-{report['meta']['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as ofile:
+        json.dump(report, ofile, indent=4)
+    print(f'Results written to {output}')
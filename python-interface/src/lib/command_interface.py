@@ -1,18 +1,26 @@
+import collections
+import json
 import os
-import random
 import re
 import signal
 import socket
 import sys
 
-from Config import EXIT_COMMAND, SOCK_HOST, SOCK_PORT, WORDLIST_FILE, encrypt, log
+from Config import CLIENT_REPLY_TIMEOUT, EXIT_COMMAND, PAYLOAD_WORDS, SERIAL_WINDOW_MAX, SOCK_HOST, SOCK_PORT, TEAMS, WORDLIST_CACHE_FILE, WORDLIST_FILE, decrypt, encrypt, log
 from DeviceList import AllowedDevicesNodeIDs
 from Logger import ControlFlowException, pprint
+from Wordlist import WordlistIndex
 
-device_list = dict()
-wordlist = list()
+wordlist = WordlistIndex(())
 payload = ''
 encrypted_payload = ''
+# `@[hw index]` prefix of the current command; picks the board when the server drives all boards
+board_target = ''
+# long-lived connection to the server shared by every command, and the bytes received on it that are not a full reply yet
+connection = None
+reply_buffer = bytearray()
+# commands that timed out, by the command echoed in their reply; that many replies to each are late and skipped
+stale_replies = collections.Counter()
 
 def trigger_exit():
     # os.kill(os.getpid(), signal.SIGINT)
@@ -37,13 +45,60 @@ def check_server_availability(host=SOCK_HOST, port=SOCK_PORT):
     except socket.error:
         return False
 
-def send_data(data, host=SOCK_HOST, port=SOCK_PORT):
+def read_reply(cmd, timeout=CLIENT_REPLY_TIMEOUT):
+    # replies are one JSON object per line; skip late replies to commands that already timed out
+    connection.settimeout(timeout)
+    while True:
+        end = reply_buffer.find(b'\n')
+        if end == -1:
+            data = connection.recv(4096)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            reply_buffer.extend(data)
+            continue
+        frame = json.loads(reply_buffer[:end])
+        del reply_buffer[:end + 1]
+        echoed = frame.get('cmd')
+        if stale_replies[echoed] > 0:
+            # the answer to an earlier send of this command that we stopped waiting for, not to this one
+            stale_replies[echoed] -= 1
+            continue
+        if echoed == cmd:
+            return frame
+
+def send_data(data, host=SOCK_HOST, port=SOCK_PORT, timeout=CLIENT_REPLY_TIMEOUT):
+    global connection
+    if board_target and data != EXIT_COMMAND:
+        data = f'{board_target} {data}'
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((host, port))
-            s.sendall(data.encode())
-    except ConnectionError as e:
+        if connection is None:
+            connection = socket.create_connection((host, port))
+            reply_buffer.clear()
+            stale_replies.clear()
+        connection.sendall((data + '\n').encode())
+        if data == EXIT_COMMAND:
+            return None
+        # the server strips the board prefix before echoing the command back
+        echoed = data.split(' ', 1)[1] if board_target else data
+        try:
+            return read_reply(echoed, timeout)
+        except socket.timeout:
+            stale_replies[echoed] += 1
+            raise
+    except socket.timeout:
+        log.warning(f'No reply from the board within {timeout}s')
+    except (ConnectionError, OSError) as e:
         log.error(f'Connection failed: {e}')
+        connection = None
+    return None
+
+def print_reply(frame):
+    if frame is None:
+        return
+    if 'error' in frame:
+        log.warning(frame['error'])
+    else:
+        pprint(json.dumps(frame.get('response'), indent=2))
 
 def colour_validator(colour):
     # IMP: `colour` should be all lowercase
@@ -56,34 +111,58 @@ def topology_cmd_handler(args):
     try:
         if len(args) != 0:
             raise ValueError('Incorrect use of `get_topology` command')
-        send_data('get_topology')
+        print_reply(send_data('get_topology'))
     except ValueError as e:
         log.warning(e)
         log.info('Usage: `get_topology`')
 
+def parse_ping_targets(spec):
+    # `0-9,12,20`, `all` or a team name from Config.TEAMS, in any combination; returns hw indexes in order, without repeats
+    targets = []
+    for part in spec.split(','):
+        if part == 'all':
+            targets.extend(sorted(AllowedDevicesNodeIDs.values()))
+        elif part in TEAMS:
+            targets.extend(TEAMS[part])
+        elif re.match(r'^\d+-\d+$', part):
+            start, end = map(int, part.split('-'))
+            targets.extend(range(start, end + 1))
+        elif part.isdigit():
+            targets.append(int(part))
+        else:
+            raise ValueError(f'[hw index] `{part}` is not a number, range, team or `all`')
+    for hw_index in targets:
+        if AllowedDevicesNodeIDs.nodeIDOf(hw_index) is None:
+            raise ValueError(f'[hw index] {hw_index} is not the number of any development board')
+    return list(dict.fromkeys(targets))
+
 def ping_cmd_handler(args):
     try:
         if len(args) != 2:
             raise ValueError('Incorrect use of `ping_node` command')
 
-        hw_index, colour = args
+        target_spec, colour = args
 
-        if not hw_index.isdigit() or int(hw_index) not in device_list:
-            raise ValueError('[hw index] needs to be the number on your development board')
+        targets = parse_ping_targets(target_spec)
         if not colour_validator(colour):
             raise ValueError('[color hex] needs to be a hex value (like `#ff0000`) or the word `false`')
         else:
             # generate message and send
             global payload, encrypted_payload
 
-            payload = ''.join(random.sample(wordlist, 5))
+            # one message, encrypted once, for every target
+            payload = ''.join(wordlist.sample(PAYLOAD_WORDS))
             encrypted_payload = encrypt(payload)
 
-            # replace HWIndex with nodeID
-            send_data(f'ping_node {device_list[int(hw_index)]} {colour} {encrypted_payload}')
+            # replace HWIndex with nodeID; the server expands a comma separated list into one ping per node
+            node_ids = ','.join(str(AllowedDevicesNodeIDs.nodeIDOf(hw_index)) for hw_index in targets)
+            # pings go out a window at a time; allow a round per full window plus one reply timeout for the slowest, so a dead
+            # board is reported within seconds to a minute for the whole room instead of one full timeout per target
+            timeout = CLIENT_REPLY_TIMEOUT * (-(-len(targets) // SERIAL_WINDOW_MAX) + 1)
+            print_reply(send_data(f'ping_node {node_ids} {colour} {encrypted_payload}', timeout=timeout))
     except ValueError as e:
         log.warning(e)
-        log.info('Usage: `ping_node [hw index] [color hex OR \'false\']`')
+        log.info('Usage: `ping_node [hw index] [color hex OR \'false\']`; [hw index] can also be a list like 0-9,12, a team name or all')
 
 def payload_cmd_handler(args):
     try:
@@ -95,6 +174,10 @@ def payload_cmd_handler(args):
         print('Payload used for the previous `ping_node` command\nNote: Encrypted payload is sent to the pinged node\n')
         print(f'Unencrypted payload: {payload}')
         print(f'Encrypted payload: {encrypted_payload}')
+        # what a receiving node running the same workspace would show
+        decrypted = decrypt(encrypted_payload)
+        words = wordlist.segment(decrypted)
+        print(f"Decrypted again: {decrypted} ({' '.join(words) if words else 'not words of the list'}{'' if decrypted == payload else ', DOES NOT MATCH the payload'})")
     except ControlFlowException as e:
         log.warning(e)
     except ValueError as e:
@@ -107,7 +190,7 @@ def nodeid_cmd_handler(args):
             raise ValueError('Incorrect use of `print_my_nodeid` command')
 
         print("Your development board's Node ID will be printed on the Serial Monitor now")
-        send_data('mirror-mirror')
+        print_reply(send_data('mirror-mirror'))
     except ValueError as e:
         log.warning(e)
         log.info('Usage: `print_my_nodeid`')
@@ -118,11 +201,62 @@ def export_topology_cmd_handler(args):
             raise ValueError('Incorrect use of `export_topology` command')
 
         print('Current topology will be saved to `src/topology.json`')
-        send_data('export_topology')
+        print_reply(send_data('export_topology'))
     except ValueError as e:
         log.warning(e)
         log.info('Usage: `export_topology`')
 
+def print_stats(stats):
+    def totals(name):
+        return ', '.join(f"{label or 'total'} {value['total']:g} ({value['per_s']:g}/s)" for label, value in stats.get(name, {}).items()) or '-'
+
+    print(f"Uptime: {stats['uptime_s']}s, clients connected: {stats.get('ysp_clients_connected', {}).get('', 0):g}")
+    print(f"Commands: {totals('ysp_commands_total')}")
+    for command, latency in stats.get('ysp_command_latency_seconds', {}).items():
+        print(f"  {command:<16} p50 <= {latency['p50'] * 1000:g} ms, p99 <= {latency['p99'] * 1000:g} ms, max {latency['max'] * 1000:.1f} ms over {latency['count']}")
+    queue_depth = stats.get('ysp_command_queue_depth', {}).get('')
+    print(f"Command queue: {stats.get('ysp_command_queue_length', {}).get('', 0):g} waiting" + (f", p99 <= {queue_depth['p99']:g}, max {queue_depth['max']:g}" if queue_depth else ''))
+    print(f"Serial bytes: {totals('ysp_serial_bytes_total')}")
+    print(f"Serial lines: {totals('ysp_serial_lines_total')}")
+    for hw_index, nodes in stats.get('ysp_topology_nodes', {}).items():
+        print(f"Topology of hw index {hw_index}: {nodes:g} nodes, {stats['ysp_topology_height'].get(hw_index, 0):g} hops deep")
+
+def stats_cmd_handler(args):
+    try:
+        if len(args) != 0:
+            raise ValueError('Incorrect use of `stats` command')
+        frame = send_data('stats')
+        if frame is None or 'error' in frame:
+            print_reply(frame)
+        else:
+            print_stats(frame['response'])
+    except ValueError as e:
+        log.warning(e)
+        log.info('Usage: `stats`')
+
+def print_crack(result):
+    print(f"Messages analysed: {result['analysed']}" + (f", {result['dropped']} dropped while busy" if result['dropped'] else ''))
+    if not result['senders']:
+        print('No mesh messages received yet')
+    for sender, ranking in result['senders'].items():
+        print(f'\nFrom node {sender}:')
+        for candidate in ranking:
+            print(f"  {candidate['alphabet']:<9} {candidate['cipher']:<6} multiplier {candidate['multiplier']:<3} shift {candidate['shift']:<3} "
+                  f"score {candidate['score']:.2f}, plausibility {candidate['plausibility']:.0%}: {' '.join(candidate['words'] or [candidate['sample']])}")
+
+def crack_cmd_handler(args):
+    try:
+        if len(args) != 0:
+            raise ValueError('Incorrect use of `crack` command')
+        frame = send_data('crack')
+        if frame is None or 'error' in frame:
+            print_reply(frame)
+        else:
+            print_crack(frame['response'])
+    except ValueError as e:
+        log.warning(e)
+        log.info('Usage: `crack`')
+
 def help_cmd_handler(args):
     print('Available Commands:')
     for command, description in command_descriptions.items():
@@ -130,11 +264,14 @@ def help_cmd_handler(args):
 
 command_descriptions = {
     'get_topology': 'Retrieve network topology',
-    'ping_node': 'Send a ping to a node with optional color. Usage: `ping_node [hw index] [color hex OR \'false\']`',
+    'ping_node': 'Send a ping to one or more nodes with optional color. Usage: `ping_node [hw index] [color hex OR \'false\']`; [hw index] can also be a list like 0-9,12, a team name or all',
     'print_my_nodeid': 'Display the node ID of the development board connected to your device',
     'print_payload': 'Print the encrypted and plaintext payload sent in the previous `ping_node`',
     'export_topology': 'Retrieve and save the current network topology to a JSON file `src/topology.json`',
+    'stats': 'Show the server\'s command latency, queue depth, serial traffic and topology size',
+    'crack': 'Show the most likely shift and affine cipher keys of each node sending mesh messages; needs the server to run with `--crack`',
     'help': 'Display this help message',
+    '@[hw index] [command]': 'Send a command through a specific board when the server runs with `--all-boards`',
     'exit': 'Exit the command interface'
 }
 
@@ -144,6 +281,8 @@ command_handlers = {
     'print_my_nodeid': nodeid_cmd_handler,
     'print_payload': payload_cmd_handler,
     'export_topology': export_topology_cmd_handler,
+    'stats': stats_cmd_handler,
+    'crack': crack_cmd_handler,
     'help': help_cmd_handler,
 }
 
@@ -152,7 +291,12 @@ command_handlers = {
 def usr_input_handler(input_string):
     # IMP: `input_string` should be lowercase
 
+    global board_target
+
     parts = input_string.split()
+    board_target = ''
+    if parts[0].startswith('@') and len(parts) > 1:
+        board_target, parts = parts[0], parts[1:]
     cmd = parts[0]
     args = parts[1:]
 
@@ -178,16 +322,9 @@ def main():
 
     log.info('Command Interface initiated. Press CTRL+C or type "exit" to exit.')
     try:
-        # Initialise device list
-        # AllowedDevicesNodeIDs key-value pair is (nodeID, HWIndex).
-        # We need the reverse since `ping_node` takes HWIndex
-        global device_list
-        device_list = {v: k for k, v in AllowedDevicesNodeIDs.items()}
-
-        # Read the wordfile and load words into a list
-        with open(WORDLIST_FILE, 'r') as file:
-            global wordlist
-            wordlist = file.read().split()
+        # Index the wordfile, or load the index saved last time
+        global wordlist
+        wordlist = WordlistIndex.load(WORDLIST_FILE, WORDLIST_CACHE_FILE)
 
         while True:
             pprint('\nEnter a command\n> ', '')
@@ -1,16 +1,29 @@
+import argparse
+import asyncio
+import collections
 import json
 import os
 import queue
 import socket
 import threading
-import time
 import serial
 import signal
 import sys
+import time
+
+from concurrent.futures import CancelledError
 
 from CommandParser import CommandParser
-from Config import EXIT_COMMAND, SOCK_HOST, SOCK_PORT, log
-from SerialController import ESPController, HWNode
+from CommandScheduler import CommandScheduler
+from Config import CLIENT_SEND_BUFFER_BYTES, CLIENT_SEND_TIMEOUT, CONSOLE_RATE_LIMITS, EXIT_COMMAND, LOG_FILE_BACKUPS, LOG_FILE_MAX_BYTES, LOG_QUEUE_SIZE, METRICS_HOST, METRICS_PORT, REQUEST_RETRIES, REQUEST_TIMEOUT, SERIAL_BAUD_CONFIRM_TIMEOUT, SERIAL_BAUD_FALLBACK_TIMEOUTS, SERIAL_BAUD_RATE, SERIAL_BAUD_RATES, SERIAL_ENCODING, SERIAL_RX_BUFFER_BYTES, SERIAL_WAIT_TIMEOUT, SERIAL_WINDOW_INITIAL, SERIAL_WINDOW_MAX, SERIAL_WINDOW_MIN, SOCK_HOST, SOCK_PORT, TOPOLOGY_POLL_MAX_INTERVAL, TOPOLOGY_POLL_MIN_INTERVAL, WORDLIST_CACHE_FILE, WORDLIST_FILE, log, serial_log
+from FlowControl import AckWindow
+from Logger import LazyJSON, start_queue_logging
+from Metrics import ClientConnections, ClientsConnected, CommandLatency, CommandQueueDepth, CommandQueueLength, CommandResults, ControllerMetrics, LineHandling, SerialBaudRate, SerialLines, SerialWindow, TopologyHeight, TopologyNodes, startMetricsServer
+from PendingRequests import PendingRequests, RequestTimeoutError
+from SerialCodec import ENCODINGS
+from SerialController import DeviceIdentifierType, ESPController, ESPControllerPool, HWNode
+from Topology import TopologyWatcher
+from Wordlist import WordlistIndex
 
 parser = CommandParser()
 
@@ -24,52 +37,540 @@ def trigger_exit(shutdown_event, serial_thread):
 def self_identifier(id):
     print(f'[server] My Node ID: {id}')
 
-def serial_interface(node: ESPController, cmd_queue: queue.Queue, shutdown_event: threading.Event):
+# line the firmware prints instead of a response when it does not understand a command
+INVALID_COMMAND_RESPONSE = 'Invalid Command'
+# line the firmware prints when it (re)starts; it is back to JSON lines by then
+BOOT_BANNER = 'Starting Node...'
+
+# clients that sent this get every later topology change pushed to them, as long as they stay connected
+WATCH_TOPOLOGY_COMMAND = 'watch_topology'
+topology_watchers = set()
+# answered by the server itself with a snapshot of its metrics
+STATS_COMMAND = 'stats'
+# answered by the server itself with the most likely cipher keys of each sender, when run with `--crack`
+CRACK_COMMAND = 'crack'
+# Cryptanalyst fed every mesh message received, set with `--crack`
+analyst = None
+# append-only file for topology changes, set with `--topology-journal`
+topology_journal_file = None
+# fetch the topology in the background, set with `--poll-topology`
+poll_topology = False
+# encoding asked of every board, set with `--encoding`, and the queue of each board to ask it through again after a restart
+serial_encoding = SERIAL_ENCODING
+board_queues = {}
+# fastest line rate tried, set with `--max-baudrate`
+max_baudrate = SERIAL_BAUD_RATES[0]
+# boards that just connected or restarted; the reader negotiates their rate and encoding again
+relink = set()
+# client commands that already fetch the topology; the poller does not add another one while these are pending
+TOPOLOGY_COMMANDS = {'get_topology', 'export_topology'}
+
+def encode_frame(frame: dict | bytes) -> bytes:
+    # replies to clients are one JSON object per line; a frame sent to many clients is encoded once and passed on as bytes
+    if isinstance(frame, bytes):
+        return frame
+    return (json.dumps(frame) + '\n').encode()
+
+class ClientWriter:
+    """
+    Reply callable of one client connection: frames are queued and sent from a thread of its own, so the serial thread,
+    which answers commands and publishes topology changes, never blocks on a client socket.
+    A client more than CLIENT_SEND_BUFFER_BYTES behind is not reading; it is disconnected instead of buffered without bound
+    @param conn: socket.socket - Client connection
+    @param addr: Address of the client, for the logs
+    """
+
+    def __init__(self, conn: socket.socket, addr):
+        self.conn = conn
+        self.addr = addr
+        # bytes queued and not sent yet
+        self.queued: int = 0
+        self._frames = collections.deque()
+        self._closed: bool = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self.__run, name=f'ClientWriter-{addr}', daemon=True)
+        self._thread.start()
+
+    def __call__(self, frame: dict | bytes):
+        data = encode_frame(frame)
+        with self._condition:
+            if self._closed:
+                log.debug(f'[server] Dropping reply, {self.addr} is gone')
+                return
+            if self.queued <= CLIENT_SEND_BUFFER_BYTES:
+                self._frames.append(data)
+                self.queued += len(data)
+                self._condition.notify()
+                return
+            self._closed = True
+        log.warning(f'[server] {self.addr} is not reading its replies; disconnecting it')
+        self.__shutdown()
+
+    def close(self):
+        '''
+        Send what is still queued, waiting at most CLIENT_SEND_TIMEOUT, and stop; the caller closes the connection
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(CLIENT_SEND_TIMEOUT)
+        if self._thread.is_alive():
+            self.__shutdown()
+
+    def __shutdown(self):
+        # wakes both the writer in `sendall` and the client handler reading the connection
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __run(self):
+        while True:
+            with self._condition:
+                while not self._frames and not self._closed:
+                    self._condition.wait()
+                if not self._frames:
+                    return
+                # whatever piled up goes out in one write
+                data = b''.join(self._frames)
+                self._frames.clear()
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                log.debug(f'[server] Dropping replies, {self.addr} is gone')
+                with self._condition:
+                    self._closed = True
+                    self._frames.clear()
+                return
+            with self._condition:
+                self.queued -= len(data)
+
+def send_reply(reply, cmd_str: str, **fields):
+    if reply is not None:
+        reply({'cmd': cmd_str, **fields})
+
+def track_request(pending: PendingRequests, request_id: int, cmd_str: str, payload: str, reply):
+    def on_done(future):
+        try:
+            fields = future.result()
+        except RequestTimeoutError as e:
+            log.warning(f'[serial] {e}')
+            fields = {'error': str(e)}
+            CommandResults.inc(1, 'timeout')
+        except CancelledError:
+            fields = {'error': 'Board disconnected'}
+            CommandResults.inc(1, 'cancelled')
+        else:
+            CommandResults.inc(1, 'error' if 'error' in fields else 'answered')
+            CommandLatency.observe(fields['latency_ms'] / 1000, CommandScheduler.commandName(cmd_str))
+        send_reply(reply, cmd_str, req_id=request_id, **fields)
+    pending.add(request_id, cmd_str, payload).add_done_callback(on_done)
+
+def expand_multicast(cmd_str: str, reply) -> list:
+    # `ping_node <id>,<id>,... <colour> <msg>` becomes one ping per node, paced by the serial writer's in-flight budget;
+    # the client gets a single per-node summary once every node has been answered
+    words = cmd_str.split()
+    prefix = words.pop(0) + ' ' if words and words[0].startswith('@') else ''
+    if len(words) != 4 or words[0] != 'ping_node' or ',' not in words[1]:
+        return [(cmd_str, reply)]
+
+    targets = list(dict.fromkeys(words[1].split(',')))
+    frames = {}
+    lock = threading.Lock()
+
+    def collect(target, frame):
+        with lock:
+            frames[target] = frame
+            if len(frames) < len(targets):
+                return
+        summary = {
+            'sent': [target for target in targets if 'error' not in frames[target]],
+            'failed': {target: frames[target]['error'] for target in targets if 'error' in frames[target]},
+        }
+        latencies = [frame['latency_ms'] for frame in frames.values() if 'latency_ms' in frame]
+        # echoed without the board prefix, like every other reply
+        send_reply(reply, split_target(cmd_str)[1], response=summary, latency_ms=max(latencies, default=0))
+
+    return [(f'{prefix}ping_node {target} {words[2]} {words[3]}', lambda frame, target=target: collect(target, frame)) for target in targets]
+
+def serial_writer(node: ESPController, cmd_queue: queue.Queue, shutdown_event: threading.Event, pending: PendingRequests):
     # IMP: *only* reads from Queue
+    # blocks on the queue, so a command is pushed to the board as soon as a client enqueues it
+    # commands taken off the queue that do not fit in the window yet, as (command, reply, request ID, payload); they go first
+    held = collections.deque()
+    while not shutdown_event.is_set():
+        window = pending.window
+        # wait until at most half the window is unanswered, so a refill goes out as one write instead of one write per
+        # answer, and commands wait in the queue (where priorities apply) rather than in this thread
+        if not pending.waitForCapacity(window.limit // 2 + 1, SERIAL_WAIT_TIMEOUT, len(held[0][3]) if held else 0):
+            continue
+        batch = []
+        if not held:
+            try:
+                batch.append(cmd_queue.get(timeout=SERIAL_WAIT_TIMEOUT))
+            except queue.Empty:
+                continue
+        # drain whatever else is ready, up to the window, so a burst goes out in as few writes as possible
+        while len(pending) + len(held) + len(batch) < window.limit:
+            try:
+                batch.append(cmd_queue.get_nowait())
+            except queue.Empty:
+                break
+        CommandQueueDepth.observe(cmd_queue.qsize())
+        SerialWindow.set(window.limit, str(node.hardwareIndex))
+
+        for cmd_str, reply in batch:
+            # only single-board mode gets here with a board prefix; the pool dispatcher takes it off
+            target, cmd_str = split_target(cmd_str)
+            if target is not None and not (target.isdigit() and int(target) in (node.hardwareIndex, node.nodeID)):
+                send_reply(reply, cmd_str, error=no_board_error(target))
+                continue
+            if cmd_str == 'mirror-mirror':
+                # connected board's nodeID, no serial call
+                self_identifier(node.nodeID)
+                send_reply(reply, cmd_str, response={'nodeId': node.nodeID})
+                continue
+
+            request_id = parser.next_request_id()
+            serial_send_payload = parser.create_payload(cmd_str, request_id)
+            if serial_send_payload == '{}':
+                send_reply(reply, cmd_str, error='Invalid command or incorrect parameters')
+                continue
+            held.append((cmd_str, reply, request_id, serial_send_payload))
+
+        payloads = []
+        # as many as the window has room for, counting commands and bytes, so the board's receive buffer never overflows
+        while held and pending.hasRoom(len(held[0][3])):
+            cmd_str, reply, request_id, serial_send_payload = held.popleft()
+            # track before pushing so a fast response cannot arrive ahead of its entry
+            track_request(pending, request_id, cmd_str, serial_send_payload, reply)
+            payloads.append(serial_send_payload)
+        node.pushMany(payloads)
+
+def watch_topology(reply):
+    topology_watchers.add(reply)
+    send_reply(reply, WATCH_TOPOLOGY_COMMAND, response={'watching': True})
+
+def publish_topology_changes(node: ESPController, watcher: TopologyWatcher):
+    TopologyNodes.set(len(parser.topology), str(node.hardwareIndex))   # type: ignore
+    TopologyHeight.set(parser.topology.height, str(node.hardwareIndex))   # type: ignore
+    changes = watcher.update(parser.topology)   # type: ignore
+    if not changes:
+        return
+    log.info(f'[topology] hw index {node.hardwareIndex}: {changes}')
+    # runs on the serial thread: the watchers' replies only queue the frame for each connection's own writer,
+    # and one that stopped reading is disconnected rather than waited for
+    frame = encode_frame({'cmd': WATCH_TOPOLOGY_COMMAND, 'hw_index': node.hardwareIndex, 'changes': changes.toDict()})
+    for reply in list(topology_watchers):
+        reply(frame)
+
+def topology_poller(cmd_queue: CommandScheduler, watcher: TopologyWatcher, shutdown_event: threading.Event):
+    # *only* writes to Queue, through the scheduler so polls queue behind control commands like any client read
+    interval = TOPOLOGY_POLL_MIN_INTERVAL
+    while not shutdown_event.wait(interval):
+        if cmd_queue.hasPending(TOPOLOGY_COMMANDS):
+            # a client already asked; its answer refreshes the watcher just the same
+            continue
+
+        answered = threading.Event()
+        answer = {}
+        def on_answer(frame: dict):
+            answer.update(frame)
+            answered.set()
+        cmd_queue.put(('export_topology', on_answer))
+        while not answered.wait(SERIAL_WAIT_TIMEOUT):
+            if shutdown_event.is_set():
+                return
+
+        if 'error' in answer:
+            # no news about the mesh; try again at the same pace
+            continue
+        # the watcher has already diffed the answer by the time the reply is sent
+        if watcher.changes:
+            interval = TOPOLOGY_POLL_MIN_INTERVAL
+        else:
+            interval = min(interval * 2, TOPOLOGY_POLL_MAX_INTERVAL)
+        log.debug(f'[topology] next poll in {interval}s')
+
+def start_topology_poller(cmd_queue, watcher: TopologyWatcher, shutdown_event: threading.Event):
+    if not poll_topology:
+        return None
+    poller_thread = threading.Thread(target=topology_poller, args=(cmd_queue, watcher, shutdown_event))
+    poller_thread.daemon = True
+    poller_thread.start()
+    return poller_thread
+
+def new_pending() -> PendingRequests:
+    return PendingRequests(REQUEST_TIMEOUT, REQUEST_RETRIES, AckWindow(SERIAL_WINDOW_INITIAL, SERIAL_WINDOW_MIN, SERIAL_WINDOW_MAX, SERIAL_RX_BUFFER_BYTES))
+
+def exchange(node: ESPController, pending: PendingRequests, watcher: TopologyWatcher, cmd_str: str, timeout: float = SERIAL_BAUD_CONFIRM_TIMEOUT) -> dict | None:
+    # push one command past the writer and read until it is answered; anything else received meanwhile is handled as usual
+    request_id = parser.next_request_id()
+    payload = parser.create_payload(cmd_str, request_id)
+    future = pending.add(request_id, cmd_str, payload)
+    node.push(payload)
+    deadline = time.monotonic() + timeout
+    while not future.done() and time.monotonic() < deadline:
+        handle_lines(list(node.readLines(timeout=min(SERIAL_WAIT_TIMEOUT, max(0, deadline - time.monotonic())))), node, pending, watcher)
+    if not future.done():
+        pending.discard(request_id)
+        return None
+    return future.result()
+
+def negotiate_baudrate(node: ESPController, pending: PendingRequests, watcher: TopologyWatcher, shutdown_event: threading.Event):
+    # runs on the thread that reads the board, with the writer paused, so nothing else is on the line while its rate changes.
+    # The board answers at the old rate and switches; asked again at the new rate, it keeps it, otherwise it goes back on its own
+    rates = [rate for rate in SERIAL_BAUD_RATES if node.baudrate < rate <= max_baudrate]
+    SerialBaudRate.set(node.baudrate, str(node.hardwareIndex))
+    if not rates:
+        return
+    pending.pause()
+    try:
+        while len(pending) and not shutdown_event.is_set():
+            handle_lines(list(node.readLines(timeout=SERIAL_WAIT_TIMEOUT)), node, pending, watcher)
+            expire_requests(node, pending)
+        for rate in rates:
+            previous = node.baudrate
+            answer = exchange(node, pending, watcher, f'set_baud {rate}')
+            if answer is None or 'error' in answer:
+                # firmware without `set-baud`, or a board that does not answer at all
+                log.info(f'[serial] hw index {node.hardwareIndex} stays at {previous} baud: {"no answer" if answer is None else answer["error"]}')
+                return
+            if not answer['response'].get('success'):
+                continue
+            node.setBaudrate(rate)
+            confirmed = exchange(node, pending, watcher, f'set_baud {rate}')
+            if confirmed is not None and confirmed.get('response', {}).get('success'):
+                log.info(f'[serial] hw index {node.hardwareIndex} now at {rate} baud')
+                return
+            # by now the board has gone back as well
+            log.warning(f'[serial] hw index {node.hardwareIndex} could not be read at {rate} baud; back to {previous}')
+            node.setBaudrate(previous)
+    finally:
+        pending.window.reset(SERIAL_WINDOW_INITIAL)
+        SerialBaudRate.set(node.baudrate, str(node.hardwareIndex))
+        pending.resume()
+
+def maintain_link(node: ESPController, pending: PendingRequests, watcher: TopologyWatcher, shutdown_event: threading.Event):
+    window = pending.window
+    if node.baudrate != SERIAL_BAUD_RATE and window.consecutiveTimeouts >= SERIAL_BAUD_FALLBACK_TIMEOUTS:
+        # its boot banner was unreadable at our rate
+        log.warning(f'[serial] hw index {node.hardwareIndex}: {window.consecutiveTimeouts} timeouts in a row at {node.baudrate} baud; taking it to have restarted')
+        node.encoding = 'json'
+        relink.add(node)
+    if node in relink:
+        relink.discard(node)
+        if node.baudrate != SERIAL_BAUD_RATE:
+            # a board that restarted is back at the starting rate
+            node.setBaudrate(SERIAL_BAUD_RATE)
+        negotiate_baudrate(node, pending, watcher, shutdown_event)
+        negotiate_encoding(node, board_queues[node])
+
+def negotiate_encoding(node: ESPController, cmd_queue: CommandScheduler):
+    # the board keeps answering in its current encoding until it accepts; `handle_line` switches `node.encoding` on its answer
+    if serial_encoding == node.encoding:
+        return
+    def on_answer(frame: dict):
+        if frame.get('response', {}).get('success'):
+            log.info(f'[serial] hw index {node.hardwareIndex} now talks {node.encoding}')
+        else:
+            log.warning(f'[serial] hw index {node.hardwareIndex} did not switch to {serial_encoding}; staying with {node.encoding}: {frame.get("error", frame.get("response"))}')
+    cmd_queue.put((f'set_encoding {serial_encoding}', on_answer))
+
+def handle_lines(lines: list[str], node: ESPController, pending: PendingRequests, watcher: TopologyWatcher, header: str = '[serial] Received >>>'):
+    if not lines:
+        return
+    start = time.perf_counter()
+    # lines that arrived together are decrypted together
+    datas = [parser.parse_line(line) for line in lines]
+    if analyst is not None:
+        # the ciphertext, before the workspace decrypts it
+        for data in datas:
+            if parser.is_mesh_message(data):
+                analyst.submit(data['payload'].get('from_node_id'), data['payload']['msg'])
+    for line, data, shown in zip(lines, datas, parser.process_many(datas)):
+        handle_line(line, data, shown, node, pending, watcher, header)
+    # each line of the batch is charged its share of the time
+    share = (time.perf_counter() - start) / len(lines)
+    for _ in lines:
+        LineHandling.observe(share)
+
+def handle_line(line: str, data: dict | None, shown: dict | None, node: ESPController, pending: PendingRequests, watcher: TopologyWatcher, header: str):
+    kind = line_kind(line, data)
+    SerialLines.inc(1, kind)
+    # pretty printing waits for the logging thread
+    if shown is None:
+        serial_log.info(f'{header}\n{line}', extra={'kind': kind})
+    else:
+        serial_log.info(LazyJSON(shown, header), extra={'kind': kind, 'data': shown})
+
+    if data is not None and 'response' in data.get('payload', {}):
+        if data['payload'].get('cmd') in ('topology', 'capture-topology'):
+            publish_topology_changes(node, watcher)
+        elif data['payload'].get('cmd') == 'set-encoding' and data['payload']['response'].get('success'):
+            # whoever asked; later commands may go out in the new encoding
+            node.encoding = data['payload']['response']['encoding']
+        pending.resolve(data['payload'].get('req_id'), {'response': data['payload']['response']})
+    elif line == INVALID_COMMAND_RESPONSE:
+        # carries no request ID; the firmware answers in order, so it belongs to the oldest request
+        pending.resolve(None, {'error': line})
+    elif line.endswith(BOOT_BANNER):
+        # the board restarted; commands in flight are lost and it reads and writes JSON lines again, at the starting rate
+        node.encoding = 'json'
+        if node in board_queues:
+            relink.add(node)
+    # live mesh messages and firmware logs are not answers to a command
+
+def line_kind(line: str, data: dict | None) -> str:
+    if data is None:
+        if line == INVALID_COMMAND_RESPONSE:
+            return 'invalid_command'
+        # firmware logs start with a letter or the boot dots; anything that looks like cut off JSON is malformed
+        return 'malformed' if line.lstrip().startswith(('{', '[', '"')) else 'other'
+    if 'response' in data.get('payload', {}):
+        return 'response'
+    return 'mesh' if data.get('payload_type') == 'mesh' else 'other'
+
+def crack_reply(cmd_str: str, reply):
+    if analyst is None:
+        send_reply(reply, cmd_str, error='The server is not analysing messages; start it with `--crack`')
+    else:
+        send_reply(reply, cmd_str, response={'analysed': analyst.analysed, 'dropped': analyst.dropped, 'senders': analyst.rankings()})
+
+def expire_requests(node: ESPController, pending: PendingRequests):
+    for request in pending.expire():
+        log.warning(f'[serial] No response to `{request.command}`, retrying')
+        node.push(request.payload)
+
+def serial_interface(node: ESPController, cmd_queue: queue.Queue, shutdown_event: threading.Event):
+    # reads block in the serial driver until the board sends something; writes happen on their own thread
+    pending = new_pending()
+    watcher = TopologyWatcher(topology_journal_file)
+    writer_thread = threading.Thread(target=serial_writer, args=(node, cmd_queue, shutdown_event, pending))
+    writer_thread.daemon = True
+    writer_thread.start()
+    board_queues[node] = cmd_queue
+    relink.add(node)
+    start_topology_poller(cmd_queue, watcher, shutdown_event)
     try:
         # if signal handler requested a shutdown, break out of loop
         while not shutdown_event.is_set():
-            read_data = node.pull()
-            if read_data:
-                print(f'[serial] Received >>>')
-                for line in read_data.split('\n'):
-                    print(parser.extract_from_payload(line))
-            if cmd_queue.qsize() > 0:
-                cmd_str = cmd_queue.get()
-
-                if cmd_str == 'mirror-mirror':
-                    # connected board's nodeID, no serial call
-                    self_identifier(node.nodeID)
-                else:
-                    serial_send_payload = parser.create_payload(cmd_str)
-                    node.push(serial_send_payload)
-            time.sleep(0.5)
+            handle_lines(list(node.readLines(timeout=SERIAL_WAIT_TIMEOUT)), node, pending, watcher)
+            expire_requests(node, pending)
+            maintain_link(node, pending, watcher, shutdown_event)
     except serial.SerialException as e:
         log.error(f'[serial] Serial error: {e}')
     finally:
+        writer_thread.join()
+        pending.cancelAll()
         print('[serial] Closing serial monitor')
         node.disconnectESP()
 
 
+def split_target(cmd_str: str) -> tuple[str | None, str]:
+    # `@<hw index or node id> <command>` routes a command to one board; the prefix is taken off in single-board mode too,
+    # so the reply always echoes the command without it, as the command interface expects
+    if cmd_str.startswith('@'):
+        target, _, cmd_str = cmd_str[1:].partition(' ')
+        return target, cmd_str
+    return None, cmd_str
+
+def no_board_error(target: str) -> str:
+    log.warning(f'[server] No connected board with hw index or node id {target}')
+    return f'No connected board with hw index or node id {target}'
+
+def pool_dispatcher(pool: ESPControllerPool, cmd_queue: queue.Queue, shutdown_event: threading.Event):
+    # IMP: *only* reads from the client Queue; each board's writer *only* reads from its own Queue
+    while not shutdown_event.is_set():
+        try:
+            cmd_str, reply = cmd_queue.get(timeout=SERIAL_WAIT_TIMEOUT)
+        except queue.Empty:
+            continue
+        target, cmd_str = split_target(cmd_str)
+
+        # commands without a target go to the first board, same as single-board mode
+        node = pool.primary if target is None else pool.resolve(int(target)) if target.isdigit() else None
+        if node is None:
+            send_reply(reply, cmd_str, error=no_board_error(target))
+            continue
+        pool.submit(node.nodeID, cmd_str, reply)
+
+def serial_pool_interface(pool: ESPControllerPool, cmd_queue: queue.Queue, shutdown_event: threading.Event):
+    # one reader multiplexes every board; writes happen on one thread per board so a slow board does not stall the rest
+    pending = {node_id: new_pending() for node_id in pool.nodes}
+    watchers = {node_id: TopologyWatcher(topology_journal_file) for node_id in pool.nodes}
+    threads = [threading.Thread(target=pool_dispatcher, args=(pool, cmd_queue, shutdown_event))]
+    for node_id, node in pool.nodes.items():
+        threads.append(threading.Thread(target=serial_writer, args=(node, pool.queues[node_id], shutdown_event, pending[node_id])))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for node_id, node in pool.nodes.items():
+        board_queues[node] = pool.queues[node_id]
+        relink.add(node)
+        start_topology_poller(pool.queues[node_id], watchers[node_id], shutdown_event)
+    try:
+        while not shutdown_event.is_set():
+            received = {}
+            for node, line in pool.readLines(timeout=SERIAL_WAIT_TIMEOUT):
+                received.setdefault(node, []).append(line)
+            for node, lines in received.items():
+                handle_lines(lines, node, pending[node.nodeID], watchers[node.nodeID], f'[serial] Received from hw index {node.hardwareIndex} >>>')
+            for node_id, node in pool.nodes.items():
+                expire_requests(node, pending[node_id])
+                maintain_link(node, pending[node_id], watchers[node_id], shutdown_event)
+    except serial.SerialException as e:
+        log.error(f'[serial] Serial error: {e}')
+    finally:
+        for thread in threads:
+            thread.join()
+        for board_pending in pending.values():
+            board_pending.cancelAll()
+        print('[serial] Closing serial monitor')
+        pool.disconnectAll()
+
+
 def client_handler(conn, addr, cmd_queue, shutdown_event, serial_thread):
     # IMP: *only* writes to Queue
     log.debug(f'Connected by {addr}')
+    ClientConnections.inc()
+    ClientsConnected.inc()
+    # called from the serial thread once the board answers a command sent on this connection; only queues the frame
+    reply = ClientWriter(conn, addr)
+
     try:
-        while not shutdown_event.is_set():
-            data = conn.recv(1024)
-            if not data:
-                break
-            # only parse to check for exit command to start exit immediately
-            if data.decode() == EXIT_COMMAND:
-                trigger_exit(shutdown_event, serial_thread)
-                break
+        # commands are newline-framed; a client that closes without a trailing newline still gets its last command run
+        with conn.makefile('rb') as lines:
+            for raw_line in lines:
+                if shutdown_event.is_set():
+                    break
+                cmd_str = raw_line.decode().strip()
+                if not cmd_str:
+                    continue
+                # only parse to check for exit command to start exit immediately
+                if cmd_str == EXIT_COMMAND:
+                    trigger_exit(shutdown_event, serial_thread)
+                    break
+                if cmd_str == WATCH_TOPOLOGY_COMMAND:
+                    watch_topology(reply)
+                    continue
+                if cmd_str == STATS_COMMAND:
+                    send_reply(reply, cmd_str, response=ControllerMetrics.snapshot())
+                    continue
+                if cmd_str == CRACK_COMMAND:
+                    crack_reply(cmd_str, reply)
+                    continue
 
-            print(f'[server] Sending command: {data.decode()}')
-            cmd_queue.put(data.decode())
+                print(f'[server] Sending command: {cmd_str}')
+                for item in expand_multicast(cmd_str, reply):
+                    cmd_queue.put(item)
     except ConnectionResetError:
         log.error(f'[server] Connection reset by {addr}')
     finally:
         log.debug('Closing client connection')
+        topology_watchers.discard(reply)
+        ClientsConnected.dec()
+        reply.close()
         conn.close()
 
 def init_server(input_queue, shutdown_event, serial_thread):
@@ -111,22 +612,183 @@ def signal_handler(shutdown_event, serial_thread, sig, frame):
     # serial and server threads will free their objects on exit
     sys.exit(0)
 
+async def async_client_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cmd_queue: queue.Queue, stop_event: asyncio.Event):
+    # IMP: *only* writes to Queue
+    loop = asyncio.get_running_loop()
+    addr = writer.get_extra_info('peername')
+    log.debug(f'Connected by {addr}')
+    ClientConnections.inc()
+    ClientsConnected.inc()
+
+    def write_frame(frame: dict | bytes):
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > CLIENT_SEND_BUFFER_BYTES:
+            log.warning(f'[server] {addr} is not reading its replies; disconnecting it')
+            writer.transport.abort()
+            return
+        writer.write(encode_frame(frame))
+
+    # called from the serial thread once the board answers a command sent on this connection
+    def reply(frame: dict | bytes):
+        loop.call_soon_threadsafe(write_frame, frame)
+
+    try:
+        while not stop_event.is_set():
+            # commands are newline-framed; a client that closes without a trailing newline still gets its last command run
+            raw_line = await reader.readline()
+            if not raw_line:
+                break
+            cmd_str = raw_line.decode().strip()
+            if not cmd_str:
+                continue
+            # only parse to check for exit command to start exit immediately
+            if cmd_str == EXIT_COMMAND:
+                stop_event.set()
+                break
+            if cmd_str == WATCH_TOPOLOGY_COMMAND:
+                watch_topology(reply)
+                continue
+            if cmd_str == STATS_COMMAND:
+                send_reply(reply, cmd_str, response=ControllerMetrics.snapshot())
+                continue
+            if cmd_str == CRACK_COMMAND:
+                crack_reply(cmd_str, reply)
+                continue
+
+            print(f'[server] Sending command: {cmd_str}')
+            for item in expand_multicast(cmd_str, reply):
+                cmd_queue.put(item)
+    except ConnectionResetError:
+        log.error(f'[server] Connection reset by {addr}')
+    finally:
+        log.debug('Closing client connection')
+        topology_watchers.discard(reply)
+        ClientsConnected.dec()
+        writer.close()
+
+async def async_server(node, serial_target, cmd_queue: queue.Queue, shutdown_event: threading.Event):
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    client_tasks: set[asyncio.Task] = set()
+
+    # signal handlers run on this (the loop's) thread, but `call_soon_threadsafe` also wakes a loop blocked in select
+    def request_stop(sig, frame):
+        loop.call_soon_threadsafe(stop_event.set)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    async def on_connect(reader, writer):
+        task = asyncio.current_task()
+        client_tasks.add(task)
+        try:
+            await async_client_handler(reader, writer, cmd_queue, stop_event)
+        except asyncio.CancelledError:
+            # cancelled by shutdown; the connection is already closed by the handler
+            pass
+        finally:
+            client_tasks.discard(task)
+
+    # bind first: if the port is taken there is no serial thread yet to keep the process alive
+    server = await asyncio.start_server(on_connect, SOCK_HOST, SOCK_PORT)
+    print(f'[server] Async server started on {SOCK_HOST}:{SOCK_PORT}')
+
+    # blocking serial I/O stays on an executor thread; the loop only ever touches the client sockets and the queue
+    serial_future = loop.run_in_executor(None, serial_target, node, cmd_queue, shutdown_event)
+
+    try:
+        await stop_event.wait()
+        print('\n[housekeeping] Initiating shutdown...')
+    finally:
+        # whatever ends the loop, the serial thread must stop too or it keeps the process alive
+        shutdown_event.set()
+
+        server.close()
+        for task in list(client_tasks):
+            task.cancel()
+        await asyncio.gather(*client_tasks, return_exceptions=True)
+        await server.wait_closed()
+        print('[server] Closing server')
+
+        # wait for serial monitor to exit once `shutdown_event` is set
+        await serial_future
+
 def main():
     global HWNode
 
-    if not HWNode.controller:
+    arg_parser = argparse.ArgumentParser(description='Serial bridge between the command interface and the development board(s)')
+    arg_parser.add_argument('--all-boards', action='store_true', help='drive every allowed board connected to this device; prefix commands with `@[hw index]` to pick one')
+    arg_parser.add_argument('--asyncio', action='store_true', help='serve clients from one asyncio event loop instead of one thread per connection')
+    arg_parser.add_argument('--topology-journal', metavar='FILE', help='append every topology change to FILE, one JSON object per line')
+    arg_parser.add_argument('--poll-topology', action='store_true', help='fetch the topology in the background, more often while the mesh is changing')
+    arg_parser.add_argument('--port', help='connect to the board on this serial port instead of searching the allowed list, e.g. the port of a FakeESP')
+    arg_parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help=f'serve Prometheus metrics on this local port; 0 to turn off (default: {METRICS_PORT})')
+    arg_parser.add_argument('--log-file', metavar='FILE', help='also write every log record and board line to FILE as JSON lines, rotated at 10 MB')
+    arg_parser.add_argument('--sync-logging', action='store_true', help='write log output from the thread that logs it instead of a background thread')
+    arg_parser.add_argument('--crack', action='store_true', help='break the shift and affine ciphers of received mesh messages in the background and answer `crack` with the likely keys; needs NumPy')
+    arg_parser.add_argument('--encoding', choices=ENCODINGS, default=SERIAL_ENCODING, help=f'talk to the boards in JSON lines or compact MessagePack frames; boards that do not know `set-encoding` stay on JSON (default: {SERIAL_ENCODING})')
+    arg_parser.add_argument('--max-baudrate', type=int, default=SERIAL_BAUD_RATES[0], help=f'fastest line rate to negotiate with the boards, trying {", ".join(map(str, SERIAL_BAUD_RATES))} in turn; {SERIAL_BAUD_RATE} to stay at the starting rate (default: {SERIAL_BAUD_RATES[0]})')
+    args = arg_parser.parse_args()
+
+    if not args.sync_logging:
+        log_listener = start_queue_logging([log, serial_log], args.log_file, CONSOLE_RATE_LIMITS, LOG_QUEUE_SIZE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS)
+        ControllerMetrics.gauge('ysp_log_records_dropped', 'Log records dropped because the logging queue was full', function=log_listener.dropped)
+        ControllerMetrics.gauge('ysp_log_queue_length', 'Log records waiting for the logging thread right now', function=log_listener.queue.qsize)
+    elif args.log_file:
+        log.warning('[housekeeping] --log-file needs queued logging; ignoring it with --sync-logging')
+
+    if args.crack:
+        global analyst
+        try:
+            from Cryptanalysis import Cryptanalyst, LanguageModel
+            analyst = Cryptanalyst(LanguageModel.fromWordlist(WordlistIndex.load(WORDLIST_FILE, WORDLIST_CACHE_FILE))).start()
+            ControllerMetrics.gauge('ysp_cryptanalysis_messages_analysed', 'Mesh messages scored against every shift and affine key', function=lambda: analyst.analysed)
+        except ImportError as e:
+            log.warning(f'[housekeeping] --crack needs NumPy ({e}); not analysing messages')
+
+    global topology_journal_file, poll_topology, serial_encoding, max_baudrate
+    topology_journal_file = args.topology_journal
+    poll_topology = args.poll_topology
+    serial_encoding = args.encoding
+    max_baudrate = args.max_baudrate
+
+    if args.all_boards:
+        node = ESPControllerPool(queueFactory=CommandScheduler)
+        serial_target = serial_pool_interface
+        connected = len(node) > 0
+    else:
+        if args.port:
+            HWNode = ESPController(identifierType=DeviceIdentifierType.PORT, identifierString=args.port, lazy=True)
+        node = HWNode
+        serial_target = serial_interface
+        connected = HWNode.controller is not None
+
+    if not connected:
         log.error('[housekeeping] No development board detected on your device')
         log.info('Check if your board is connected and the red on-board light is on')
         sys.exit(1)
 
-    # client commands queue
+    # client commands queue; ordered and merged by the scheduler unless the pool schedules per board
     # IMP: there are no locks. Make sure we are dealing with only one Queue.
-    client_cmd_queue = queue.Queue()
+    # in single-board mode a prefix naming the board is the same as none, so `@0 get_topology` merges with `get_topology`
+    client_cmd_queue = queue.Queue() if args.all_boards else CommandScheduler({str(HWNode.hardwareIndex), str(HWNode.nodeID)})
+
+    CommandQueueLength.function = client_cmd_queue.qsize
+    if args.metrics_port:
+        try:
+            startMetricsServer(METRICS_HOST, args.metrics_port)
+            log.info(f'[metrics] Serving metrics on http://{METRICS_HOST}:{args.metrics_port}/metrics')
+        except OSError as e:
+            log.warning(f'[metrics] Could not serve metrics on port {args.metrics_port}: {e}')
 
     # event channel to signal shutdown across threads safely
     shutdown_event = threading.Event()
 
-    serial_thread = threading.Thread(target=serial_interface, args=(HWNode, client_cmd_queue, shutdown_event))
+    if args.asyncio:
+        asyncio.run(async_server(node, serial_target, client_cmd_queue, shutdown_event))
+        return
+
+    serial_thread = threading.Thread(target=serial_target, args=(node, client_cmd_queue, shutdown_event))
     serial_thread.start()
 
     init_server(client_cmd_queue, shutdown_event, serial_thread)
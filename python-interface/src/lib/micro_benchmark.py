@@ -0,0 +1,214 @@
+'''
+Micro-benchmarks of the functions that run once per command or per received line:
+CommandParser.create_payload, CommandParser.parse_line and extract_from_payload (which re-serializes every line with indent=2),
+the workspace cipher (encrypt/decrypt, as compiled by CipherEngine, and decrypt_many), and parsing of topology trees of growing size.
+The `cipher.example_shift` cases time a character-by-character shift cipher, as teams usually write it, called directly and through CipherEngine.
+
+    python micro_benchmark.py                            # everything
+    python micro_benchmark.py --filter cipher            # only the cases with 'cipher' in their name
+    python micro_benchmark.py --compare ../benchmarks/micro-b01f697-20261018-101500.json
+
+Results are written as JSON to BENCHMARK_DIR, named after the commit, like benchmark.py.
+The workspace cipher is edited during sessions; a decrypt slower than a fraction of a message's serial line time is flagged, since it runs on the serial thread.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import time
+import timeit
+import types
+
+from typing import Callable
+
+from benchmark import gitCommit
+from Cipher import CipherEngine
+from CommandParser import CommandParser
+from Config import BENCHMARK_DIR, PAYLOAD_WORDS, WORDLIST_CACHE_FILE, WORDLIST_FILE, Cipher, decrypt, decrypt_many, encrypt
+from Topology import Topology
+from Wordlist import WordlistIndex
+
+# a decrypt taking more than this share of a message's time on a 115200 baud line holds up the serial thread
+CIPHER_LINE_TIME_SHARE = 0.1
+LINE_SECONDS_PER_BYTE = 10 / 115200
+
+def randomTree(size: int, fanout: int = 4, seed: int = 1) -> dict:
+    '''
+    @param size: int - Number of nodes
+    @param fanout: int - Most children per node
+    @param seed: int - Seed for a repeatable tree
+    @return: dict - Nested `{nodeId, subs}` topology with random 32 bit Node IDs
+    '''
+    generator = random.Random(seed)
+    nodeIDs: list[int] = generator.sample(range(1, 2 ** 32), size)
+    subtrees: list[dict] = [{'nodeId': nodeID, 'subs': []} for nodeID in nodeIDs]
+    openNodes: list[int] = [0]
+    for index in range(1, size):
+        slot: int = generator.randrange(len(openNodes))
+        parent: dict = subtrees[openNodes[slot]]
+        parent['subs'].append(subtrees[index])
+        if len(parent['subs']) >= fanout:
+            openNodes[slot] = openNodes[-1]
+            openNodes.pop()
+        openNodes.append(index)
+    return subtrees[0]
+
+def exampleShiftCipher(key: int = 3) -> types.ModuleType:
+    '''
+    @param key: int - Shift of the letters
+    @return: types.ModuleType - Workspace-like module with a loop-based shift cipher of letters
+    '''
+    module = types.ModuleType('example_shift')
+    module.SHIFT_KEY = key
+
+    def shift(message: str, key: int) -> str:
+        result = ''
+        for character in message:
+            if character.isalpha() and character.isascii():
+                base = ord('a') if character.islower() else ord('A')
+                result += chr((ord(character) - base + key) % 26 + base)
+            else:
+                result += character
+        return result
+
+    module.encrypt = lambda message: shift(message, module.SHIFT_KEY)
+    module.decrypt = lambda message: shift(message, -module.SHIFT_KEY)
+    return module
+
+def cases(topologySizes: list[int]) -> dict[str, Callable[[], object]]:
+    '''
+    @param topologySizes: list[int] - Mesh sizes for the topology cases
+    @return: dict[str, Callable[[], object]] - Case name to a function running one call of it
+    '''
+    parser = CommandParser()
+    wordlist = WordlistIndex.load(WORDLIST_FILE, WORDLIST_CACHE_FILE)
+    # a message the command interface would send: five words, no separator
+    message: str = ''.join(wordlist.sample(PAYLOAD_WORDS, random.Random(1)))
+    ciphertext: str = encrypt(message)
+    burst: list[str] = [ciphertext] * 64
+    example = exampleShiftCipher()
+    exampleEngine = CipherEngine(example)
+    exampleCiphertext: str = example.encrypt(message)
+    exampleBurst: list[str] = [exampleCiphertext] * 64
+
+    pingLine: str = json.dumps({'payload_type': 'cmd', 'payload': {'cmd': 'ping', 'to_node_id': '2781714569', 'HEX': '#ff8800', 'msg': ciphertext, 'req_id': 7,
+                                'response': {'payload_type': 'mesh', 'payload': {'from_node_id': 1022050302, 'to_node_id': '2781714569', 'HEX': '#ff8800', 'msg': ciphertext}}}}, separators=(',', ':'))
+    meshLine: str = json.dumps({'payload_type': 'mesh', 'payload': {'from_node_id': 1022050302, 'to_node_id': '2781714569', 'HEX': '#ff8800', 'msg': ciphertext}}, separators=(',', ':'))
+
+    benchmarks: dict[str, Callable[[], object]] = {
+        'create_payload.ping_node': lambda: parser.create_payload(f'ping_node 2781714569 #ff8800 {ciphertext}', 7),
+        'create_payload.get_topology': lambda: parser.create_payload('get_topology', 7),
+        'parse_line.ping_response': lambda: parser.parse_line(pingLine),
+        'extract_from_payload.ping_response': lambda: parser.extract_from_payload(pingLine),
+        'parse_line.mesh_message': lambda: parser.parse_line(meshLine),
+        'extract_from_payload.mesh_message': lambda: parser.extract_from_payload(meshLine),
+        'cipher.encrypt': lambda: encrypt(message),
+        'cipher.decrypt': lambda: decrypt(ciphertext),
+        'cipher.workspace_decrypt': lambda: Cipher.module.decrypt(ciphertext),
+        'cipher.decrypt_many.64': lambda: decrypt_many(burst),
+        'cipher.example_shift.loop': lambda: example.decrypt(exampleCiphertext),
+        'cipher.example_shift.engine': lambda: exampleEngine.decrypt(exampleCiphertext),
+        'cipher.example_shift.decrypt_many.64': lambda: exampleEngine.decrypt_many(exampleBurst),
+        'wordlist.sample': lambda: wordlist.sample(PAYLOAD_WORDS),
+        'wordlist.segment': lambda: wordlist.segment(message),
+        'wordlist.plausibility.ciphertext': lambda: wordlist.plausibility(exampleCiphertext),
+    }
+    for size in topologySizes:
+        tree: dict = randomTree(size)
+        # 'topology' rather than 'capture-topology', which would also write topology.json
+        topologyLine: str = json.dumps({'payload_type': 'cmd', 'payload': {'cmd': 'topology', 'req_id': 7, 'response': tree}}, separators=(',', ':'))
+        benchmarks[f'topology.{size}.json_loads'] = lambda line=topologyLine: json.loads(line)
+        benchmarks[f'topology.{size}.index'] = lambda tree=tree: Topology(tree, allowedDevices={})
+        benchmarks[f'topology.{size}.extract_from_payload'] = lambda line=topologyLine: parser.extract_from_payload(line)
+    return benchmarks
+
+def measure(function: Callable[[], object], repeat: int, minTime: float) -> dict:
+    '''
+    Time a function with timeit: calls per sample are picked so each sample takes at least `minTime`
+    @param function: Callable[[], object] - Function to time
+    @param repeat: int - Number of samples
+    @param minTime: float - Seconds each sample should take at least
+    @return: dict - Best and median time per call in microseconds, and the calls per sample
+    '''
+    timer = timeit.Timer(function)
+    calls: int = 1
+    while (elapsed := timer.timeit(calls)) < minTime:
+        calls = max(calls * 2, int(calls * minTime / max(elapsed, 1e-9)))
+    samples: list[float] = [sample / calls for sample in timer.repeat(repeat, calls)]
+    return {
+        'best_us': round(min(samples) * 1e6, 3),
+        'median_us': round(statistics.median(samples) * 1e6, 3),
+        'calls': calls,
+    }
+
+def run(filter_: str, repeat: int, minTime: float, topologySizes: list[int]) -> dict:
+    '''
+    @return: dict - Run metadata and one result per case
+    '''
+    report: dict = {
+        'meta': {
+            'commit': gitCommit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'min_time_s': minTime,
+        },
+        'results': {},
+    }
+    for name, function in cases(topologySizes).items():
+        if filter_ not in name:
+            continue
+        result = report['results'][name] = measure(function, repeat, minTime)
+        print(f"{name:<45} {result['best_us']:>12.3f} us  (median {result['median_us']:.3f} us, {result['calls']} calls/sample)")
+    return report
+
+def checkCipher(report: dict) -> None:
+    '''
+    Warn if the workspace cipher is slow enough to hold up the serial thread
+    '''
+    meshMessageBytes: int = 150
+    budget: float = meshMessageBytes * LINE_SECONDS_PER_BYTE * CIPHER_LINE_TIME_SHARE * 1e6
+    for name in ('cipher.encrypt', 'cipher.decrypt'):
+        result = report['results'].get(name)
+        if result and result['median_us'] > budget:
+            print(f"WARNING: {name} takes {result['median_us']:.0f} us per message, over the {budget:.0f} us budget; it will slow the serial thread on a busy mesh")
+
+def compare(report: dict, baselineFile: str) -> None:
+    '''
+    Print each case's change against an earlier run
+    @param report: dict - This run
+    @param baselineFile: str - JSON file written by an earlier run
+    '''
+    with open(baselineFile) as ifile:
+        baseline: dict = json.load(ifile)
+    print(f"\nCompared with {baseline['meta']['commit']} ({baseline['meta']['time']}):")
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<45} new")
+            continue
+        ratio: float = result['best_us'] / before['best_us']
+        print(f"{name:<45} {before['best_us']:>12.3f} -> {result['best_us']:>12.3f} us  x{ratio:.2f}{'  SLOWER' if ratio > 1.1 else ''}")
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Micro-benchmarks of the per-message hot functions')
+    arg_parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='samples per case (default: 5)')
+    arg_parser.add_argument('--min-time', type=float, default=0.2, help='seconds per sample at least (default: 0.2)')
+    arg_parser.add_argument('--topology-sizes', default='77,770,7700', help='comma separated mesh sizes (default: 77,770,7700)')
+    arg_parser.add_argument('--compare', metavar='FILE', help='print the change against an earlier result file')
+    arg_parser.add_argument('--output', metavar='FILE', help=f'where to write the results (default: {BENCHMARK_DIR}/micro-<commit>-<time>.json)')
+    args = arg_parser.parse_args()
+
+    report = run(args.filter, args.repeat, args.min_time, [int(size) for size in args.topology_sizes.split(',')])
+    checkCipher(report)
+    if args.compare:
+        compare(report, args.compare)
+    output: str = args.output or os.path.join(BENCHMARK_DIR, f"micro-{report['meta']['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as ofile:
+        json.dump(report, ofile, indent=4)
+    print(f'Results written to {output}')
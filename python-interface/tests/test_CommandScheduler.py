@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lib'))
+
+from CommandScheduler import CommandScheduler
+
+def answer(scheduler: CommandScheduler, frame: dict) -> None:
+    command, reply = scheduler.get_nowait()
+    reply({'cmd': command, **frame})
+
+def test_prefixed_copy_of_a_read_merges_and_gets_its_own_echo():
+    scheduler = CommandScheduler({'0', '1234'})
+    frames = []
+    scheduler.put(('get_topology', frames.append))
+    scheduler.put(('@0 get_topology', frames.append))
+    scheduler.put(('@1234  get_topology ', frames.append))
+    assert scheduler.qsize() == 1
+
+    answer(scheduler, {'response': {'nodeId': 1234}})
+    assert [frame['cmd'] for frame in frames] == ['get_topology', 'get_topology', 'get_topology']
+    assert all(frame['response'] == {'nodeId': 1234} for frame in frames)
+
+def test_copies_for_another_board_do_not_merge():
+    scheduler = CommandScheduler({'0'})
+    scheduler.put(('get_topology', None))
+    scheduler.put(('@7 get_topology', None))
+    scheduler.put(('@7 get_topology', None))
+    assert scheduler.qsize() == 2
+
+def test_has_pending_sees_prefixed_and_spaced_copies():
+    scheduler = CommandScheduler({'0'})
+    scheduler.put(('@0 export_topology', None))
+    assert scheduler.hasPending({'get_topology', 'export_topology'})
+
+    answer(scheduler, {'response': {}})
+    assert not scheduler.hasPending({'export_topology'})
+
+    scheduler.put(('get_topology  ', None))
+    assert scheduler.hasPending({'get_topology'})
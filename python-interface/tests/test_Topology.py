@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lib'))
+
+from Topology import Topology
+
+def chain(*nodeIDs: int) -> dict:
+    tree: dict = {'nodeId': nodeIDs[-1]}
+    for nodeID in reversed(nodeIDs[:-1]):
+        tree = {'nodeId': nodeID, 'subs': [tree]}
+    return tree
+
+def test_moving_a_subtree_reports_the_node_that_moved_only():
+    # 1 - 2 - 3 - 4 - 5 - 6, then 3 and everything below it moves under the root
+    before = Topology(chain(1, 2, 3, 4, 5, 6), allowedDevices={})
+    moved = chain(3, 4, 5, 6)
+    after = Topology({'nodeId': 1, 'subs': [{'nodeId': 2}, moved]}, allowedDevices={})
+
+    changes = after.diff(before)
+    assert changes.reparented == [(3, 2, 1)]
+    assert changes.depthChanged == [(3, 2, 1)]
+    assert not changes.joined and not changes.left
+
+def test_reparent_at_the_same_depth_has_no_depth_change():
+    before = Topology({'nodeId': 1, 'subs': [{'nodeId': 2, 'subs': [{'nodeId': 4}]}, {'nodeId': 3}]}, allowedDevices={})
+    after = Topology({'nodeId': 1, 'subs': [{'nodeId': 2}, {'nodeId': 3, 'subs': [{'nodeId': 4}]}]}, allowedDevices={})
+
+    changes = after.diff(before)
+    assert changes.reparented == [(4, 2, 3)]
+    assert changes.depthChanged == []